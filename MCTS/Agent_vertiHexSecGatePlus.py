@@ -1,24 +1,120 @@
 import argparse
 import numpy as np
+import os
 import time
 
 import sys
 
 sys.path.extend(['../Simulators'])
-from nodesHexSecGatePlus import MultiAircraftNode, MultiAircraftState
-from search_multi import MCTS
+from nodesHexSecGatePlus import MultiAircraftNode, make_root_state, sector_futures
+from search_multi import MCTS, SearchStats
+from policy_net import encode, load_cached
+from distill import DatasetWriter
+from latency import LatencyRecorder
+from rng import GLOBAL_RNG
 from config_hex_sec import Config
 from MultiAircraftVertiHexSecGatePlusEnv import MultiAircraftEnv
+from trajectory_recorder import TrajectoryRecorder
+from offscreen import FrameExporter
+from run_logger import RingBuffer, RunLogger, env_record
 
 
-def run_experiment(env, no_episodes, render, save_path):
+def plan_epoch(last_observation, info, cpa=None, stats=None, config=Config, rng=GLOBAL_RNG, dataset=None):
+    """
+    run one decision epoch: search an action for every aircraft controlled by each sector.
+    with a conflict table cpa (env.predict_conflicts()), aircraft predicted to come close to another one get
+    the full search and only their predicted intruders are simulated, otherwise the full search is decided by
+    the current distance in info and all aircraft in the sector are simulated.
+    with config.sector_futures, sampled futures of the aircraft of each sector are drawn once and shared by the
+    searches of its ownships.
+    with config.policy_net, the searches run in PUCT mode with that network (see policy_net.py).
+    with config.distilled_policy, the aircraft that would get the lite search take the action of that policy
+    (see distill.py) instead, unless its prior is below config.policy_min_confidence.
+    with a DatasetWriter dataset (distill.py), the decision of every search is logged to it.
+    with a SearchStats stats, the counters and timers of every search are recorded in it.
+    config and rng: Config class and random number generator of the planner (see rng.py).
+    return the actions {id: action} and the decision time (ms) of each sector
+    """
+    action_by_id = {}
+    time_list = []
+    alert_ids = cpa.alert_ids(config.cpa_alert_dist) if cpa is not None else None
+    net = load_cached(config.policy_net) if config.policy_net is not None else None
+    policy = load_cached(config.distilled_policy) if config.distilled_policy is not None else None
+    for i in range(len(last_observation)):
+
+        ob_by_sector, id_list, goal_exit_id_list = last_observation[i]
+        time_before = time.perf_counter()
+
+        num_considered_aircraft = len(id_list)
+        num_existing_aircraft = ob_by_sector.shape[0]
+        # if not num_considered_aircraft == num_existing_aircraft:
+        #     import ipdb; ipdb.set_trace()
+        action = np.ones(num_existing_aircraft, dtype=np.int32)
+        # the other aircraft of the sector are simulated once for all ownships
+        futures = sector_futures(ob_by_sector, action, config, rng) if config.sector_futures else None
+        root_evals = None
+        policy_priors = None
+        if (net is not None or policy is not None or dataset is not None) and num_considered_aircraft > 0:
+            # the ownships of the sector are encoded and evaluated by the networks in one batch
+            features = np.stack([encode(ob_by_sector, index, config) for index in range(num_considered_aircraft)])
+            if net is not None and cpa is None:
+                root_evals = net.evaluate(features)
+            if policy is not None:
+                policy_priors = policy.evaluate(features)[0]
+
+        for index in range(num_considered_aircraft):
+            if cpa is None:
+                rows = np.arange(num_existing_aircraft)
+                full_search = info[id_list[index]] < config.full_search_dist
+            else:
+                intruders = cpa.intruders(id_list[index])
+                rows = np.array([index] + [k for k, id in enumerate(cpa.row_ids[i]) if id in intruders],
+                                dtype=np.int64)
+                full_search = id_list[index] in alert_ids
+            if policy_priors is not None and not full_search and \
+                    policy_priors[index].max() >= config.policy_min_confidence:
+                action[index] = np.argmax(policy_priors[index])
+                action_by_id[id_list[index]] = action[index]
+                continue
+            own_index = int(np.flatnonzero(rows == index)[0])
+            if full_search:
+                simulations, search_depth = config.no_simulations, config.search_depth
+            else:
+                simulations, search_depth = config.no_simulations_lite, config.search_depth_lite
+            state = make_root_state(ob_by_sector[rows], own_index, action[rows], i, goal_exit_id_list[index],
+                                    search_depth, config, rng, futures, rows)
+            root = MultiAircraftNode(state=state)
+            root_eval = (root_evals[0][index], root_evals[1][index]) if root_evals is not None else None
+            mcts = MCTS(root, stats, net, config.c_puct, config.leaf_batch, root_eval)
+            best_node = mcts.best_action(simulations, search_depth)
+
+            action[index] = best_node.state.prev_action[own_index]
+            action_by_id[id_list[index]] = best_node.state.prev_action[own_index]
+            if dataset is not None:
+                dataset.add(features[index], root, action[index])
+
+        time_after = time.perf_counter()
+
+        time_list.append((time_after - time_before) * 1000)
+
+    return action_by_id, time_list
+
+
+def run_experiment(env, no_episodes, render, save_path, record_dir=None, frame_dir=None, frame_format='ppm',
+                   frame_skip=1, fast_forward=False, use_cpa=False, search_stats=False, dataset_dir=None):
     text_file = open(save_path, "w")  # save all non-terminal print statements in a txt file
+    logger = RunLogger(os.path.splitext(save_path)[0] + '_metrics.jsonl')  # metrics every 100 time steps
     episode = 0
-    epi_returns = []
     conflicts_list = []
-    enroute_number_list = []
+    NMACs_list = []
+    goals_list = []
+    generated_list = []
+    enroute_number = RingBuffer(1000)  # aircraft enroute every 100 time steps, last 1000 samples
     num_aircraft = Config.num_aircraft
-    time_dict = {}
+    latency = LatencyRecorder(Config.decision_deadline)
+    stats = SearchStats() if search_stats else None
+    epoch_stats = None
+    dataset = DatasetWriter(dataset_dir) if dataset_dir is not None else None
 
     while episode < no_episodes:
         # at the beginning of each episode, set done to False, set time step in this episode to 0
@@ -28,6 +124,12 @@ def run_experiment(env, no_episodes, render, save_path):
         episode_time_step = 0
         episode_reward = 0
         last_observation = env.reset()
+        recorder = None
+        if record_dir is not None:
+            recorder = TrajectoryRecorder(os.path.join(record_dir, 'episode_%04d' % episode), env)
+        exporter = None
+        if frame_dir is not None:
+            exporter = FrameExporter(os.path.join(frame_dir, 'episode_%04d' % episode), env, frame_format, frame_skip)
         # last_observation = env.pressure_reset()
         action_by_id = {}
         info = None
@@ -40,82 +142,45 @@ def run_experiment(env, no_episodes, render, save_path):
             if episode_time_step % 5 == 0:
                 # if env.id_tracker > 84 and env.debug:
                 #     import ipdb; ipdb.set_trace()
-                action_by_id = {}
-                time_list = []
-                for i in range(7):
-
-                    ob_by_sector, id_list, goal_exit_id_list = last_observation[i]
-                    time_before = int(round(time.time() * 1000))
-
-                    num_considered_aircraft = len(id_list)
-                    num_existing_aircraft = ob_by_sector.shape[0]
-                    # if not num_considered_aircraft == num_existing_aircraft:
-                    #     import ipdb; ipdb.set_trace()
-                    action = np.ones(num_existing_aircraft, dtype=np.int32)
-
-                    for index in range(num_considered_aircraft):
-                        state = MultiAircraftState(state=ob_by_sector,
-                                                   index=index,
-                                                   init_action=action,
-                                                   sector_id=i,
-                                                   goal_exit_id=goal_exit_id_list[index])
-                        root = MultiAircraftNode(state=state)
-                        mcts = MCTS(root)
-                        if info[id_list[index]] < 2 * Config.minimum_separation:
-                            best_node = mcts.best_action(Config.no_simulations, Config.search_depth)
-                        else:
-                            best_node = mcts.best_action(Config.no_simulations_lite, Config.search_depth_lite)
-
-                        # if id_list[index] == 103 or id_list[index] == 123:
-                        #     if env.id_tracker > 130:
-                        #         import ipdb; ipdb.set_trace()
-
-                        action[index] = best_node.state.prev_action[index]
-                        action_by_id[id_list[index]] = best_node.state.prev_action[index]
-
-                    time_after = int(round(time.time() * 1000))
-
-                    time_list.append(time_after - time_before)
-
-                if env.aircraft_dict.num_aircraft in time_dict:
-                    time_dict[env.aircraft_dict.num_aircraft].append(max(time_list))
-                else:
-                    time_dict[env.aircraft_dict.num_aircraft] = [max(time_list)]
-
-            observation, reward, done, info = env.step(action_by_id, near_end)
+                cpa = env.predict_conflicts() if use_cpa else None
+                action_by_id, time_list = plan_epoch(last_observation, info, cpa, stats, dataset=dataset)
+                if stats is not None:
+                    epoch_stats = stats.epoch()
+
+                latency.record_epoch(max(time_list), env.aircraft_dict.num_aircraft, time_list)
+
+            steps = 1
+            if fast_forward and not render:
+                # fly to the next decision epoch in one go if nothing can happen before it
+                steps = max(env.safe_steps(5 - episode_time_step % 5, near_end), 1)
+            if steps > 1:
+                observation, reward, done, info = env.fast_forward(action_by_id, steps)
+            else:
+                observation, reward, done, info = env.step(action_by_id, near_end)
+            if recorder is not None:
+                recorder.record_step(env, episode_time_step, action_by_id)
+            if exporter is not None:
+                exporter.submit(env, episode_time_step)
 
             episode_reward += reward
             last_observation = observation
-            episode_time_step += 1
+            episode_time_step += steps
 
             if episode_time_step % 100 == 0:
-                print('========================== Time Step: %d =============================' % episode_time_step,
-                      file=text_file)
-                print('Number of conflicts:', env.conflicts / 2, file=text_file)
-                print('Total Aircraft Genrated:', env.id_tracker, file=text_file)
-                print('Goal Aircraft:', env.goals, file=text_file)
-                print('NMACs:', env.NMACs / 2, file=text_file)
-                print('NMAC/h:', (env.NMACs / 2) / (env.total_timesteps / 3600), file=text_file)
-                print('Total Flight Hours:', env.total_timesteps / 3600, file=text_file)
-                print('Current Aircraft Enroute:', env.aircraft_dict.num_aircraft, file=text_file)
-                print('Time:', file=text_file)
-                for key, item in time_dict.items():
-                    print(key, np.mean(item), file=text_file)
-                enroute_number_list.append(env.aircraft_dict.num_aircraft)
-                print('Enroute Aircraft Number:', enroute_number_list, file=text_file)
+                logger.log(env_record(env, episode=episode, step=episode_time_step,
+                                      decision_ms=latency.epochs.summary(), search=epoch_stats))
+                enroute_number.append(env.aircraft_dict.num_aircraft)
 
                 print('========================== Time Step: %d =============================' % episode_time_step)
-                print('Number of conflicts:', env.conflicts / 2)
+                print('Number of conflicts:', env.conflicts)
                 print('Total Aircraft Genrated:', env.id_tracker)
                 print('Goal Aircraft:', env.goals)
-                print('NMACs:', env.NMACs / 2)
-                print('NMAC/h:', (env.NMACs / 2) / (env.total_timesteps / 3600))
+                print('NMACs:', env.NMACs)
+                print('NMAC/h:', env.NMACs / (env.total_timesteps / 3600))
                 print('Total Flight Hours:', env.total_timesteps / 3600)
                 print('Current Aircraft Enroute:', env.aircraft_dict.num_aircraft)
 
-                # print('Time:')
-                # for key, item in time_dict.items():
-                #     print(key, np.mean(item))
+                # latency.report()
 
             if env.id_tracker - 1 >= 10000:
                 counter += 1
@@ -124,39 +189,50 @@ def run_experiment(env, no_episodes, render, save_path):
             if episode_time_step > 100 and env.aircraft_dict.num_aircraft == 0:
                 break
 
-        print('route 1 time:', env.route_time[0][1] + env.route_time[1][1], file=text_file)
-        print('route 2 time:', env.route_time[0][2] + env.route_time[1][2], file=text_file)
-        print('route 3 time:', env.route_time[0][3] + env.route_time[1][3], file=text_file)
+        print('Enroute Aircraft Number:', enroute_number.values(), file=text_file)
 
         print('========================== End =============================', file=text_file)
         print('========================== End =============================')
-        print('Number of conflicts:', env.conflicts / 2)
+        print('Number of conflicts:', env.conflicts)
         print('Total Aircraft Genrated:', env.id_tracker)
         print('Goal Aircraft:', env.goals)
-        print('NMACs:', env.NMACs / 2)
+        print('NMACs:', env.NMACs)
         print('Current Aircraft Enroute:', env.aircraft_dict.num_aircraft)
-        for key, item in time_dict.items():
-            print('%d aircraft: %.2f' % (key, np.mean(item)))
+        latency.report()
+
+        if recorder is not None:
+            recorder.close()
+        if exporter is not None:
+            exporter.close()
 
         # print training information for each training episode
-        epi_returns.append(info)
         conflicts_list.append(env.conflicts)
+        NMACs_list.append(env.NMACs)
+        goals_list.append(env.goals)
+        generated_list.append(env.id_tracker)
         print('Training Episode:', episode)
         print('Cumulative Reward:', episode_reward)
 
-    time_list = time_dict.values()
-    flat_list = [item for sublist in time_list for item in sublist]
     print('----------------------------------------')
     print('Number of aircraft:', Config.num_aircraft)
     print('Search depth:', Config.search_depth)
     print('Simulations:', Config.no_simulations)
-    print('Time:', sum(flat_list) / float(len(flat_list)))
-    print('NMAC prob:', epi_returns.count('n') / no_episodes)
-    print('Goal prob:', epi_returns.count('g') / no_episodes)
+    if stats is not None:
+        print('Search:', stats.totals)
+    print('Time:', latency.epochs.summary()['mean'])
+    latency.report()
+    latency.report(text_file)
+    latency.save(os.path.splitext(save_path)[0] + '_latency.json')
+    print('NMAC prob:', sum(NMACs > 0 for NMACs in NMACs_list) / no_episodes)
+    print('Goal prob:', sum(goals_list) / float(max(sum(generated_list), 1)))
     print('Average Conflicts per episode:',
-          sum(conflicts_list) / float(len(conflicts_list)) / 2)  # / 2 to ignore duplication
+          sum(conflicts_list) / float(len(conflicts_list)))
     env.close()
     text_file.close()
+    logger.close()
+    if dataset is not None:
+        dataset.close()
+        print('Decisions logged:', dataset.total)
 
 
 def main():
@@ -166,6 +242,26 @@ def main():
     parser.add_argument('--save_path', '-p', type=str, default='output/seed2.txt')
     parser.add_argument('--debug', '-d', action='store_true')
     parser.add_argument('--render', '-r', action='store_true')
+    parser.add_argument('--record_dir', type=str, default=None,
+                        help='stream the per-step fleet state, actions and conflict events to this directory')
+    parser.add_argument('--frame_dir', type=str, default=None,
+                        help='draw frames headless (no display needed) and write them to this directory')
+    parser.add_argument('--frame_format', type=str, default='ppm', choices=['ppm', 'raw'])
+    parser.add_argument('--frame_skip', type=int, default=1, help='write one frame every frame_skip time steps')
+    parser.add_argument('--fast_forward', action='store_true',
+                        help='integrate the time steps between decision epochs in bulk when no conflict, goal, '
+                             'sector change or departure can happen')
+    parser.add_argument('--cpa', action='store_true',
+                        help='choose full searches and the simulated intruders from the predicted closest point of '
+                             'approach of each aircraft pair instead of the current distances')
+    parser.add_argument('--search_stats', action='store_true',
+                        help='count and time the phases of every search (simulations, expansions, rollout outcomes, '
+                             'selection/expansion/rollout/backprop time, root visits). The last epoch is written to '
+                             'the "search" field of the _metrics.jsonl record every 100 time steps and the totals '
+                             'are printed at the end')
+    parser.add_argument('--dataset', type=str, default=None,
+                        help='log the decision of every search to shards in this directory, to train a policy with '
+                             'distill.py')
     args = parser.parse_args()
 
     import random
@@ -174,7 +270,9 @@ def main():
     np.random.seed(args.seed)
 
     env = MultiAircraftEnv(args.seed, args.debug)
-    run_experiment(env, args.no_episodes, args.render, args.save_path)
+    run_experiment(env, args.no_episodes, args.render, args.save_path, args.record_dir, args.frame_dir,
+                   args.frame_format, args.frame_skip, args.fast_forward, args.cpa, args.search_stats,
+                   args.dataset)
 
 
 if __name__ == '__main__':
@@ -1,26 +1,278 @@
 import argparse
 import numpy as np
+import os
 import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 
 import sys
 
 sys.path.extend(['../Simulators'])
-from nodesHexSecGatePlus import MultiAircraftNode, MultiAircraftState
-from search_multi import MCTS
+from nodesHexSecGatePlus import MultiAircraftNode, make_root_state, sector_futures
+from search_multi import MCTS, SearchStats
+from policy_net import encode, load_cached
+from distill import DatasetWriter
+from latency import LatencyRecorder
+from rng import GLOBAL_RNG
 from config_hex_sec import Config
 from MultiAircraftVertiHexSecGatePlusTwoStageEnv import MultiAircraftEnv
+from trajectory_recorder import TrajectoryRecorder
+from offscreen import FrameExporter
+from run_logger import RunLogger, env_record
 
 np.set_printoptions(linewidth=9999, precision=3, threshold=99999, suppress=True)
 
 
-def run_experiment(env, no_episodes, render, save_path):
+def stage_evaluations(ob, num_considered_aircraft, config, dataset=None):
+    # the PUCT network (config.policy_net) and its (priors, values) of the roots of the first
+    # num_considered_aircraft rows of ob, the priors of the distilled policy (config.distilled_policy) and the
+    # encodings of these rows, evaluated in one batch
+    net = load_cached(config.policy_net) if config.policy_net is not None else None
+    policy = load_cached(config.distilled_policy) if config.distilled_policy is not None else None
+    if (net is None and policy is None and dataset is None) or num_considered_aircraft == 0:
+        return net, None, None, None
+    features = np.stack([encode(ob, index, config) for index in range(num_considered_aircraft)])
+    root_evals = net.evaluate(features) if net is not None else None
+    policy_priors = policy.evaluate(features)[0] if policy is not None else None
+    return net, root_evals, policy_priors, features
+
+
+def plan_high(sector_ob, info, alert_ids, stats, config, rng, sector_id, dataset=None):
+    """
+    high priority stage of a sector: search the actions of the high priority aircraft.
+    return the actions {id: action} and the actions of all rows of the high priority observation
+    """
+    ob_high_in, id_high, goal_exit_id_high, ob_high_out, _, _, _, _ = sector_ob
+    action_by_id = {}
+    ob_high = np.concatenate([ob_high_in, ob_high_out])
+    num_considered_aircraft = len(id_high)
+    num_existing_aircraft = ob_high.shape[0]
+    action_high = np.ones(num_existing_aircraft, dtype=np.int32)
+    # the other aircraft are simulated once for all ownships of each stage
+    futures = sector_futures(ob_high, action_high, config, rng) if config.sector_futures else None
+    net, root_evals, policy_priors, features = stage_evaluations(ob_high, num_considered_aircraft, config, dataset)
+
+    for index in range(num_considered_aircraft):
+        if alert_ids is not None:
+            full_search = id_high[index] in alert_ids
+        else:
+            full_search = info[id_high[index]] < config.full_search_dist_two_stage
+        if policy_priors is not None and not full_search and \
+                policy_priors[index].max() >= config.policy_min_confidence:
+            action_high[index] = np.argmax(policy_priors[index])
+            action_by_id[id_high[index]] = action_high[index]
+            continue
+        if full_search:
+            simulations, search_depth = config.no_simulations, config.search_depth
+        else:
+            simulations, search_depth = config.no_simulations_lite, config.search_depth_lite
+        state = make_root_state(ob_high, index, action_high, sector_id, goal_exit_id_high[index], search_depth, config,
+                                rng, futures)
+        root = MultiAircraftNode(state=state)
+        root_eval = (root_evals[0][index], root_evals[1][index]) if root_evals is not None else None
+        mcts = MCTS(root, stats, net, config.c_puct, config.leaf_batch, root_eval)
+        best_node = mcts.best_action(simulations, search_depth)
+
+        # if id_list[index] == 103 or id_list[index] == 123:
+        #     if env.id_tracker > 130:
+        #         import ipdb; ipdb.set_trace()
+
+        action_high[index] = best_node.state.prev_action[index]
+        action_by_id[id_high[index]] = best_node.state.prev_action[index]
+        if dataset is not None:
+            dataset.add(features[index], root, action_high[index])
+
+    return action_by_id, action_high
+
+
+def plan_low(sector_ob, action_high, info, alert_ids, stats, config, rng, sector_id, dataset=None):
+    """
+    low priority stage of a sector: search the actions of the low priority aircraft given the high priority
+    actions action_high (plan_high). return the actions {id: action}
+    """
+    ob_high_in, _, _, ob_high_out, ob_in, id, goal_exit_id, ob_out = sector_ob
+    action_by_id = {}
+    ob = np.concatenate([ob_in, ob_high_in, ob_high_out, ob_out])
+    num_considered_aircraft = len(id)
+    if not ob_in.shape[0] == num_considered_aircraft:
+        raise ValueError('error dimension')
+    num_existing_aircraft = ob.shape[0]
+    action = np.ones(num_existing_aircraft, dtype=np.int32)
+    action[num_considered_aircraft:num_considered_aircraft + action_high.shape[0]] = action_high
+    futures = sector_futures(ob, action, config, rng) if config.sector_futures else None
+    net, root_evals, policy_priors, features = stage_evaluations(ob, num_considered_aircraft, config, dataset)
+
+    for index in range(num_considered_aircraft):
+        if alert_ids is not None:
+            full_search = id[index] in alert_ids
+        else:
+            full_search = info[id[index]] < config.full_search_dist_two_stage
+        if policy_priors is not None and not full_search and \
+                policy_priors[index].max() >= config.policy_min_confidence:
+            action[index] = np.argmax(policy_priors[index])
+            action_by_id[id[index]] = action[index]
+            continue
+        if full_search:
+            simulations, search_depth = config.no_simulations, config.search_depth
+        else:
+            simulations, search_depth = config.no_simulations_lite, config.search_depth_lite
+        state = make_root_state(ob, index, action, sector_id, goal_exit_id[index], search_depth, config, rng, futures)
+        root = MultiAircraftNode(state=state)
+        root_eval = (root_evals[0][index], root_evals[1][index]) if root_evals is not None else None
+        mcts = MCTS(root, stats, net, config.c_puct, config.leaf_batch, root_eval)
+        best_node = mcts.best_action(simulations, search_depth)
+
+        action[index] = best_node.state.prev_action[index]
+        action_by_id[id[index]] = best_node.state.prev_action[index]
+        if dataset is not None:
+            dataset.add(features[index], root, action[index])
+
+    return action_by_id
+
+
+def plan_epoch(last_observation, info, alert_ids=None, stats=None, config=Config, rng=GLOBAL_RNG, dataset=None):
+    """
+    run one decision epoch: in each sector, search the actions of the high priority aircraft first, then those
+    of the low priority aircraft given the high priority actions.
+    alert_ids (ids predicted to come close to another aircraft, with --cpa) get the full search, otherwise the
+    full search is decided by the current distance in info.
+    with config.sector_futures, sampled futures of the aircraft are drawn once per stage of each sector and
+    shared by the searches of its ownships.
+    with config.policy_net, the searches run in PUCT mode with that network (see policy_net.py).
+    with config.distilled_policy, the aircraft that would get the lite search take the action of that policy
+    (see distill.py) instead, unless its prior is below config.policy_min_confidence.
+    with a DatasetWriter dataset (distill.py), the decision of every search is logged to it.
+    with a SearchStats stats, the counters and timers of every search are recorded in it.
+    config and rng: Config class and random number generator of the planner (see rng.py).
+    return the actions {id: action}, the decision time (ms) and the number of low priority aircraft of each sector,
+    and the stage times {'high': [ms of each sector], 'low': [...], 'epoch': ms}. The sectors plan in parallel in
+    the concept of operations, so the epoch takes the slowest sector
+    """
+    action_by_id = {}
+    time_list = []
+    num_list = []
+    stage_ms = {'high': [], 'low': []}
+    for i in range(len(last_observation)):
+        time_before = time.perf_counter()
+
+        # make decision for high priority aircraft
+        # ----------------------------------------
+        action_high_by_id, action_high = plan_high(last_observation[i], info, alert_ids, stats, config, rng, i,
+                                                   dataset)
+        action_by_id.update(action_high_by_id)
+        time_high = time.perf_counter()
+
+        # make decision for low priority aircraft
+        # ---------------------------------------
+        action_by_id.update(plan_low(last_observation[i], action_high, info, alert_ids, stats, config, rng, i,
+                                     dataset))
+
+        # decision making end
+
+        time_after = time.perf_counter()
+
+        stage_ms['high'].append((time_high - time_before) * 1000)
+        stage_ms['low'].append((time_after - time_high) * 1000)
+        time_list.append((time_after - time_before) * 1000)
+        num_list.append(len(last_observation[i][5]))
+
+    stage_ms['epoch'] = max(time_list)
+    return action_by_id, time_list, num_list, stage_ms
+
+
+# planner config of the pipeline worker processes, set by init_pipeline_worker
+worker_config = Config
+
+
+def config_overrides(config):
+    # the parameters set with Config.replace() on top of the module Config, to rebuild config in another process
+    return dict(config.replaced)
+
+
+def init_pipeline_worker(overrides):
+    global worker_config
+    worker_config = Config.replace(**overrides)
+
+
+def make_pipeline(workers, config=Config):
+    # worker processes for plan_epoch_pipelined, planning with config
+    return ProcessPoolExecutor(workers, initializer=init_pipeline_worker, initargs=(config_overrides(config),))
+
+
+def run_stage(task):
+    # one stage of one sector in a worker process, with a random stream of its own
+    stage, sector_id, sector_ob, action_high, info, alert_ids, seed, search_stats = task
+    rng = np.random.default_rng(seed)
+    stats = SearchStats() if search_stats else None
+    time_before = time.perf_counter()
+    if stage == 'high':
+        action_by_id, action_high = plan_high(sector_ob, info, alert_ids, stats, worker_config, rng, sector_id)
+    else:
+        action_by_id = plan_low(sector_ob, action_high, info, alert_ids, stats, worker_config, rng, sector_id)
+    ms = (time.perf_counter() - time_before) * 1000
+    return stage, sector_id, action_by_id, action_high, ms, stats.searches if stats is not None else None
+
+
+def plan_epoch_pipelined(executor, last_observation, info, alert_ids=None, stats=None, rng=GLOBAL_RNG):
+    """
+    plan_epoch in the worker processes of executor (make_pipeline): the high priority stages of all sectors
+    are submitted at once, and the low priority stage of a sector as soon as its high priority actions are
+    ready. Every stage gets a seed drawn from rng in a fixed order, so the actions do not depend on the
+    scheduling. Return like plan_epoch, the epoch time being the measured time of the whole pipeline
+    """
+    time_before = time.perf_counter()
+    seeds = rng.integers(0, 2 ** 63 - 1, size=(len(last_observation), 2))
+    search_stats = stats is not None
+    pending = set()
+    for i in range(len(last_observation)):
+        # only the distances of the aircraft of the sector are sent along
+        ob = last_observation[i]
+        sector_info = None if info is None else {id: info[id] for id in list(ob[1]) + list(ob[5])}
+        pending.add(executor.submit(run_stage, ('high', i, ob, None, sector_info, alert_ids, int(seeds[i, 0]),
+                                                search_stats)))
+
+    action_by_id = {}
+    stage_ms = {'high': [0.] * len(last_observation), 'low': [0.] * len(last_observation)}
+    searches = {}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            stage, i, stage_actions, action_high, ms, stage_searches = future.result()
+            action_by_id.update(stage_actions)
+            stage_ms[stage][i] = ms
+            searches[(i, stage)] = stage_searches
+            if stage == 'high':
+                ob = last_observation[i]
+                sector_info = None if info is None else {id: info[id] for id in list(ob[1]) + list(ob[5])}
+                pending.add(executor.submit(run_stage, ('low', i, ob, action_high, sector_info, alert_ids,
+                                                        int(seeds[i, 1]), search_stats)))
+    if search_stats:
+        # in sector and stage order, as plan_epoch records them
+        for key in sorted(searches):
+            stats.searches.extend(searches[key])
+
+    time_list = [high + low for high, low in zip(stage_ms['high'], stage_ms['low'])]
+    num_list = [len(last_observation[i][5]) for i in range(len(last_observation))]
+    stage_ms['epoch'] = (time.perf_counter() - time_before) * 1000
+    return action_by_id, time_list, num_list, stage_ms
+
+
+def run_experiment(env, no_episodes, render, save_path, record_dir=None, frame_dir=None, frame_format='ppm',
+                   frame_skip=1, fast_forward=False, use_cpa=False, search_stats=False, pipeline=0,
+                   dataset_dir=None):
     text_file = open(save_path, "w")  # save all non-terminal print statements in a txt file
+    logger = RunLogger(os.path.splitext(save_path)[0] + '_metrics.jsonl')  # metrics every 100 time steps
     episode = 0
-    epi_returns = []
     conflicts_list = []
+    NMACs_list = []
+    goals_list = []
+    generated_list = []
     num_aircraft = Config.num_aircraft
-    time_dict = {}
-    route_time = {1: [], 2: [], 3: []}
+    latency = LatencyRecorder(Config.decision_deadline)
+    stats = SearchStats() if search_stats else None
+    epoch_stats = None
+    dataset = DatasetWriter(dataset_dir) if dataset_dir is not None else None
+    # with --pipeline, the stages of the sectors are planned in worker processes
+    executor = make_pipeline(pipeline) if pipeline else None
 
     while episode < no_episodes:
         # at the beginning of each episode, set done to False, set time step in this episode to 0
@@ -30,6 +282,12 @@ def run_experiment(env, no_episodes, render, save_path):
         episode_time_step = 0
         episode_reward = 0
         last_observation = env.reset()
+        recorder = None
+        if record_dir is not None:
+            recorder = TrajectoryRecorder(os.path.join(record_dir, 'episode_%04d' % episode), env)
+        exporter = None
+        if frame_dir is not None:
+            exporter = FrameExporter(os.path.join(frame_dir, 'episode_%04d' % episode), env, frame_format, frame_skip)
         action = np.ones(num_aircraft)
         info = None
         near_end = False
@@ -41,106 +299,55 @@ def run_experiment(env, no_episodes, render, save_path):
             if episode_time_step % 5 == 0:
                 # if env.id_tracker > 1300 and env.debug:
                 #     import ipdb; ipdb.set_trace()
-                action_by_id = {}
-                for i in range(7):
-
-                    ob_high_in, id_high, goal_exit_id_high, ob_high_out, \
-                    ob_in, id, goal_exit_id, ob_out = last_observation[i]
-
-                    time_before = int(round(time.time() * 1000))
-
-                    # make decision for high priority aircraft
-                    # ----------------------------------------
-                    ob_high = np.concatenate([ob_high_in, ob_high_out])
-                    num_considered_aircraft = len(id_high)
-                    num_existing_aircraft = ob_high.shape[0]
-                    action_high = np.ones(num_existing_aircraft, dtype=np.int32)
-
-                    for index in range(num_considered_aircraft):
-                        state = MultiAircraftState(state=ob_high,
-                                                   index=index,
-                                                   init_action=action_high,
-                                                   sector_id=i,
-                                                   goal_exit_id=goal_exit_id_high[index])
-                        root = MultiAircraftNode(state=state)
-                        mcts = MCTS(root)
-                        if info[id_high[index]] < 5 * Config.minimum_separation:
-                            best_node = mcts.best_action(Config.no_simulations, Config.search_depth)
-                        else:
-                            best_node = mcts.best_action(Config.no_simulations_lite, Config.search_depth_lite)
-
-                        # if id_list[index] == 103 or id_list[index] == 123:
-                        #     if env.id_tracker > 130:
-                        #         import ipdb; ipdb.set_trace()
-
-                        action_high[index] = best_node.state.prev_action[index]
-                        action_by_id[id_high[index]] = best_node.state.prev_action[index]
-
-                    # make decision for low priority aircraft
-                    # ---------------------------------------
-                    ob = np.concatenate([ob_in, ob_high_in, ob_high_out, ob_out])
-                    num_considered_aircraft = len(id)
-                    if not ob_in.shape[0] == num_considered_aircraft:
-                        raise ValueError('error dimension')
-                    num_existing_aircraft = ob.shape[0]
-                    action = np.ones(num_existing_aircraft, dtype=np.int32)
-                    action[num_considered_aircraft:num_considered_aircraft + action_high.shape[0]] = action_high
-
-                    for index in range(num_considered_aircraft):
-                        state = MultiAircraftState(state=ob,
-                                                   index=index,
-                                                   init_action=action,
-                                                   sector_id=i,
-                                                   goal_exit_id=goal_exit_id[index])
-                        root = MultiAircraftNode(state=state)
-                        mcts = MCTS(root)
-                        if info[id[index]] < 5 * Config.minimum_separation:
-                            best_node = mcts.best_action(Config.no_simulations, Config.search_depth)
-                        else:
-                            best_node = mcts.best_action(Config.no_simulations_lite, Config.search_depth_lite)
-
-                        action[index] = best_node.state.prev_action[index]
-                        action_by_id[id[index]] = best_node.state.prev_action[index]
-
-                    # decision making end
-
-                    time_after = int(round(time.time() * 1000))
-                    if num_considered_aircraft in time_dict:
-                        time_dict[num_considered_aircraft].append(time_after - time_before)
-                    else:
-                        time_dict[num_considered_aircraft] = [time_after - time_before]
-
-            observation, reward, done, info = env.step(action_by_id, near_end)
+                # with --cpa, aircraft predicted to come close to another one get the full search
+                alert_ids = env.predict_conflicts().alert_ids(Config.cpa_alert_dist) if use_cpa else None
+                if executor is not None:
+                    action_by_id, time_list, num_list, stage_ms = plan_epoch_pipelined(executor, last_observation, info,
+                                                                                       alert_ids, stats)
+                else:
+                    action_by_id, time_list, num_list, stage_ms = plan_epoch(last_observation, info, alert_ids, stats,
+                                                                             dataset=dataset)
+                if stats is not None:
+                    epoch_stats = stats.epoch()
+
+                latency.record_epoch(stage_ms['epoch'], env.aircraft_dict.num_aircraft, time_list, stage_ms)
+
+            steps = 1
+            if fast_forward and not render:
+                # fly to the next decision epoch in one go if nothing can happen before it
+                steps = max(env.safe_steps(5 - episode_time_step % 5, near_end), 1)
+            if steps > 1:
+                observation, reward, done, info = env.fast_forward(action_by_id, steps)
+            else:
+                observation, reward, done, info = env.step(action_by_id, near_end)
+            if recorder is not None:
+                recorder.record_step(env, episode_time_step, action_by_id)
+            if exporter is not None:
+                exporter.submit(env, episode_time_step)
 
             episode_reward += reward
             last_observation = observation
-            episode_time_step += 1
+            episode_time_step += steps
 
             if episode_time_step % 100 == 0:
-                print('========================== Time Step: %d =============================' % episode_time_step,
-                      file=text_file)
-                print('Number of conflicts:', env.conflicts / 2, file=text_file)
-                print('Total Aircraft Genrated:', env.id_tracker, file=text_file)
-                print('Goal Aircraft:', env.goals, file=text_file)
-                print('NMACs:', env.NMACs / 2, file=text_file)
-                print('NMAC/h:', (env.NMACs / 2) / (env.total_timesteps / 3600), file=text_file)
-                print('Current Aircraft Enroute:', env.aircraft_dict.num_aircraft, file=text_file)
+                route_time = {priority: {route: env.route_time[priority][route].summary() for route in (1, 2, 3)}
+                              for priority in (0, 1)}
+                logger.log(env_record(env, episode=episode, step=episode_time_step,
+                                      decision_ms=latency.epochs.summary(), search=epoch_stats, route_time=route_time))
 
                 print('========================== Time Step: %d =============================' % episode_time_step)
-                print('Number of conflicts:', env.conflicts / 2)
+                print('Number of conflicts:', env.conflicts)
                 print('Total Aircraft Genrated:', env.id_tracker)
                 print('Goal Aircraft:', env.goals)
-                print('NMACs:', env.NMACs / 2)
-                print('NMAC/h:', (env.NMACs / 2) / (env.total_timesteps / 3600))
+                print('NMACs:', env.NMACs)
+                print('NMAC/h:', env.NMACs / (env.total_timesteps / 3600))
                 print('Current Aircraft Enroute:', env.aircraft_dict.num_aircraft)
 
                 print('Clear', np.array([305, 540, 610]))
                 print('High Priority Route Time:',
-                      np.array([np.mean(env.route_time[1][1]), np.mean(env.route_time[1][2]),
-                                np.mean(env.route_time[1][3])]))
+                      np.array([env.route_time[1][route].mean for route in (1, 2, 3)]))
                 print('Low  Priority Route Time:',
-                      np.array([np.mean(env.route_time[0][1]), np.mean(env.route_time[0][2]),
-                                np.mean(env.route_time[0][3])]))
+                      np.array([env.route_time[0][route].mean for route in (1, 2, 3)]))
 
             if env.id_tracker - 1 >= 10000:
                 counter += 1
@@ -149,40 +356,55 @@ def run_experiment(env, no_episodes, render, save_path):
             if episode_time_step > 10 and env.aircraft_dict.num_aircraft == 0:
                 break
 
+        if recorder is not None:
+            recorder.close()
+        if exporter is not None:
+            exporter.close()
+
         # print('clear route time:', env.route_time)
-        print('route 1 time:', env.route_time[0][1] + env.route_time[1][1], file=text_file)
-        print('route 2 time:', env.route_time[0][2] + env.route_time[1][2], file=text_file)
-        print('route 3 time:', env.route_time[0][3] + env.route_time[1][3], file=text_file)
+        for route in (1, 2, 3):
+            print('route %d time:' % route, env.route_time[0][route].merge(env.route_time[1][route]), file=text_file)
+
+        conflicts_list.append(env.conflicts)
+        NMACs_list.append(env.NMACs)
+        goals_list.append(env.goals)
+        generated_list.append(env.id_tracker)
 
         # print('========================== End =============================', file=text_file)
         # print('========================== End =============================')
-        # print('Number of conflicts:', env.conflicts / 2)
+        # print('Number of conflicts:', env.conflicts)
         # print('Total Aircraft Genrated:', env.id_tracker)
         # print('Goal Aircraft:', env.goals)
-        # print('NMACs:', env.NMACs / 2)
+        # print('NMACs:', env.NMACs)
         # print('Current Aircraft Enroute:', env.aircraft_dict.num_aircraft)
-        # for key, item in time_dict.items():
-        #     print('%d aircraft: %.2f' % (key, np.mean(item)))
+        # latency.report()
         #
         # # print training information for each training episode
-        # epi_returns.append(info)
-        # conflicts_list.append(env.conflicts)
         # print('Training Episode:', episode)
         # print('Cumulative Reward:', episode_reward)
 
-    time_list = time_dict.values()
-    flat_list = [item for sublist in time_list for item in sublist]
     print('----------------------------------------')
     print('Number of aircraft:', Config.num_aircraft)
     print('Search depth:', Config.search_depth)
     print('Simulations:', Config.no_simulations)
-    print('Time:', sum(flat_list) / float(len(flat_list)))
-    print('NMAC prob:', epi_returns.count('n') / no_episodes)
-    print('Goal prob:', epi_returns.count('g') / no_episodes)
+    if stats is not None:
+        print('Search:', stats.totals)
+    print('Time:', latency.epochs.summary()['mean'])
+    latency.report()
+    latency.report(text_file)
+    latency.save(os.path.splitext(save_path)[0] + '_latency.json')
+    print('NMAC prob:', sum(NMACs > 0 for NMACs in NMACs_list) / no_episodes)
+    print('Goal prob:', sum(goals_list) / float(max(sum(generated_list), 1)))
     print('Average Conflicts per episode:',
-          sum(conflicts_list) / float(len(conflicts_list)) / 2)  # / 2 to ignore duplication
+          sum(conflicts_list) / float(len(conflicts_list)))
     env.close()
     text_file.close()
+    logger.close()
+    if dataset is not None:
+        dataset.close()
+        print('Decisions logged:', dataset.total)
+    if executor is not None:
+        executor.shutdown()
 
 
 def main():
@@ -192,14 +414,42 @@ def main():
     parser.add_argument('--save_path', '-p', type=str, default='output/seed2.txt')
     parser.add_argument('--debug', '-d', action='store_true')
     parser.add_argument('--render', '-r', action='store_true')
+    parser.add_argument('--record_dir', type=str, default=None,
+                        help='stream the per-step fleet state, actions and conflict events to this directory')
+    parser.add_argument('--frame_dir', type=str, default=None,
+                        help='draw frames headless (no display needed) and write them to this directory')
+    parser.add_argument('--frame_format', type=str, default='ppm', choices=['ppm', 'raw'])
+    parser.add_argument('--frame_skip', type=int, default=1, help='write one frame every frame_skip time steps')
+    parser.add_argument('--fast_forward', action='store_true',
+                        help='integrate the time steps between decision epochs in bulk when no conflict, goal, '
+                             'sector change or departure can happen')
+    parser.add_argument('--cpa', action='store_true',
+                        help='choose full searches from the predicted closest point of approach of each aircraft '
+                             'pair instead of the current distances')
+    parser.add_argument('--search_stats', action='store_true',
+                        help='count and time the phases of every search (simulations, expansions, rollout outcomes, '
+                             'selection/expansion/rollout/backprop time, root visits). The last epoch is written to '
+                             'the "search" field of the _metrics.jsonl record every 100 time steps and the totals '
+                             'are printed at the end')
+    parser.add_argument('--pipeline', type=int, default=0,
+                        help='plan in this many worker processes: the high priority stages of all sectors run in '
+                             'parallel and the low priority stage of a sector starts as soon as its high priority '
+                             'actions are ready')
+    parser.add_argument('--dataset', type=str, default=None,
+                        help='log the decision of every search to shards in this directory, to train a policy with '
+                             'distill.py')
     args = parser.parse_args()
+    if args.pipeline and args.dataset is not None:
+        parser.error('--dataset logs the searches of this process, it cannot be used with --pipeline')
 
     import random
     random.seed(args.seed)
     np.random.seed(args.seed)
 
     env = MultiAircraftEnv(args.seed, args.debug)
-    run_experiment(env, args.no_episodes, args.render, args.save_path)
+    run_experiment(env, args.no_episodes, args.render, args.save_path, args.record_dir, args.frame_dir,
+                   args.frame_format, args.frame_skip, args.fast_forward, args.cpa, args.search_stats,
+                   args.pipeline, args.dataset)
 
 
 if __name__ == '__main__':
@@ -1,24 +1,90 @@
 import argparse
 import numpy as np
+import os
 import time
 
 import sys
 
 sys.path.extend(['../Simulators'])
 from nodes_multi import MultiAircraftNode, MultiAircraftState
-from search_multi import MCTS
+from search_multi import MCTS, SearchStats
+from policy_net import encode, load_cached
+from distill import DatasetWriter
+from latency import LatencyRecorder
+from rng import GLOBAL_RNG
 from config_vertiport import Config
 from MultiAircraftVertiportEnv import MultiAircraftEnv
-
-
-def run_experiment(env, no_episodes, render, save_path):
+from trajectory_recorder import TrajectoryRecorder
+from offscreen import FrameExporter
+from run_logger import RunLogger, env_record
+
+
+def plan_epoch(last_observation, id_list, info, stats=None, config=Config, rng=GLOBAL_RNG, dataset=None):
+    """
+    run one decision epoch: search an action for every aircraft, aircraft close to another one (info) get the
+    full search.
+    with config.policy_net, the searches run in PUCT mode with that network (see policy_net.py).
+    with config.distilled_policy, the aircraft that would get the lite search take the action of that policy
+    (see distill.py) instead, unless its prior is below config.policy_min_confidence.
+    with a DatasetWriter dataset (distill.py), the decision of every search is logged to it.
+    with a SearchStats stats, the counters and timers of every search are recorded in it.
+    config and rng: Config class and random number generator of the planner (see rng.py).
+    return the actions {id: action} and the decision time (ms)
+    """
+    time_before = time.perf_counter()
+    num_existing_aircraft = last_observation.shape[0]
+    action = np.ones(num_existing_aircraft, dtype=np.int32)
+    action_by_id = {}
+    net = load_cached(config.policy_net) if config.policy_net is not None else None
+    policy = load_cached(config.distilled_policy) if config.distilled_policy is not None else None
+    root_evals = None
+    policy_priors = None
+    if (net is not None or policy is not None or dataset is not None) and num_existing_aircraft > 0:
+        # all aircraft are encoded and evaluated by the networks in one batch
+        features = np.stack([encode(last_observation, index, config) for index in range(num_existing_aircraft)])
+        if net is not None:
+            root_evals = net.evaluate(features)
+        if policy is not None:
+            policy_priors = policy.evaluate(features)[0]
+
+    for index in range(num_existing_aircraft):
+        if policy_priors is not None and info[index] >= config.full_search_dist and \
+                policy_priors[index].max() >= config.policy_min_confidence:
+            action[index] = np.argmax(policy_priors[index])
+            action_by_id[id_list[index]] = action[index]
+            continue
+        state = MultiAircraftState(state=last_observation, index=index, init_action=action, config=config,
+                                   rng=rng)
+        root = MultiAircraftNode(state=state)
+        root_eval = (root_evals[0][index], root_evals[1][index]) if root_evals is not None else None
+        mcts = MCTS(root, stats, net, config.c_puct, config.leaf_batch, root_eval)
+        if info[index] < config.full_search_dist:
+            best_node = mcts.best_action(config.no_simulations, config.search_depth)
+        else:
+            best_node = mcts.best_action(config.no_simulations_lite, config.search_depth_lite)
+        action[index] = best_node.state.prev_action[index]
+        action_by_id[id_list[index]] = best_node.state.prev_action[index]
+        if dataset is not None:
+            dataset.add(features[index], root, action[index])
+
+    time_after = time.perf_counter()
+    return action_by_id, (time_after - time_before) * 1000
+
+
+def run_experiment(env, no_episodes, render, save_path, record_dir=None, frame_dir=None, frame_format='ppm',
+                   frame_skip=1, search_stats=False, dataset_dir=None):
     text_file = open(save_path, "w")  # save all non-terminal print statements in a txt file
+    logger = RunLogger(os.path.splitext(save_path)[0] + '_metrics.jsonl')  # metrics every 100 time steps
     episode = 0
-    epi_returns = []
     conflicts_list = []
     NMACs_list = []
+    goals_list = []
+    generated_list = []
     num_aircraft = Config.num_aircraft
-    time_dict = {}
+    latency = LatencyRecorder(Config.decision_deadline)
+    stats = SearchStats() if search_stats else None
+    epoch_stats = None
+    dataset = DatasetWriter(dataset_dir) if dataset_dir is not None else None
 
     while episode < no_episodes:
         # at the beginning of each episode, set done to False, set time step in this episode to 0
@@ -28,6 +94,12 @@ def run_experiment(env, no_episodes, render, save_path):
         episode_time_step = 1
         episode_reward = 0
         last_observation, id_list = env.reset()
+        recorder = None
+        if record_dir is not None:
+            recorder = TrajectoryRecorder(os.path.join(record_dir, 'episode_%04d' % episode), env)
+        exporter = None
+        if frame_dir is not None:
+            exporter = FrameExporter(os.path.join(frame_dir, 'episode_%04d' % episode), env, frame_format, frame_skip)
         action_by_id = {}
         info = None
 
@@ -35,57 +107,36 @@ def run_experiment(env, no_episodes, render, save_path):
             if render:
                 env.render()
             if episode_time_step % 5 == 0:
-
-                time_before = int(round(time.time() * 1000))
                 num_existing_aircraft = last_observation.shape[0]
-                action = np.ones(num_existing_aircraft, dtype=np.int32)
-                action_by_id = {}
-
-                for index in range(num_existing_aircraft):
-                    state = MultiAircraftState(state=last_observation, index=index, init_action=action)
-                    root = MultiAircraftNode(state=state)
-                    mcts = MCTS(root)
-                    if info[index] < 3 * Config.minimum_separation:
-                        best_node = mcts.best_action(Config.no_simulations, Config.search_depth)
-                    else:
-                        best_node = mcts.best_action(Config.no_simulations_lite, Config.search_depth_lite)
-                    action[index] = best_node.state.prev_action[index]
-                    action_by_id[id_list[index]] = best_node.state.prev_action[index]
-
-                time_after = int(round(time.time() * 1000))
-                if num_existing_aircraft in time_dict:
-                    time_dict[num_existing_aircraft].append(time_after - time_before)
-                else:
-                    time_dict[num_existing_aircraft] = [time_after - time_before]
+                action_by_id, decision_time = plan_epoch(last_observation, id_list, info, stats, dataset=dataset)
+                if stats is not None:
+                    epoch_stats = stats.epoch()
+
+                latency.record_epoch(decision_time, num_existing_aircraft)
             (observation, id_list), reward, done, info = env.step(action_by_id)
+            if recorder is not None:
+                recorder.record_step(env, episode_time_step, action_by_id)
+            if exporter is not None:
+                exporter.submit(env, episode_time_step)
 
             episode_reward += reward
             last_observation = observation
             episode_time_step += 1
 
             if episode_time_step % 100 == 0:
-                print('========================== Time Step: %d =============================' % episode_time_step,
-                      file=text_file)
-                print('Number of conflicts:', env.conflicts / 2, file=text_file)
-                print('Total Aircraft Genrated:', env.id_tracker, file=text_file)
-                print('Goal Aircraft:', env.goals, file=text_file)
-                print('NMACs:', env.NMACs / 2, file=text_file)
-                print('NMAC/h:', (env.NMACs / 2) / (env.total_timesteps / 3600), file=text_file)
-                print('Total Flight Hours:', env.total_timesteps / 3600, file=text_file)
-                print('Current Aircraft Enroute:', env.aircraft_dict.num_aircraft, file=text_file)
+                logger.log(env_record(env, episode=episode, step=episode_time_step,
+                                      decision_ms=latency.epochs.summary(), search=epoch_stats))
 
                 print('========================== Time Step: %d =============================' % episode_time_step)
-                print('Number of conflicts:', env.conflicts / 2)
+                print('Number of conflicts:', env.conflicts)
                 print('Total Aircraft Genrated:', env.id_tracker)
                 print('Goal Aircraft:', env.goals)
-                print('NMACs:', env.NMACs / 2)
-                print('NMAC/h:', (env.NMACs / 2) / (env.total_timesteps / 3600))
+                print('NMACs:', env.NMACs)
+                print('NMAC/h:', env.NMACs / (env.total_timesteps / 3600))
                 print('Total Flight Hours:', env.total_timesteps / 3600)
                 print('Current Aircraft Enroute:', env.aircraft_dict.num_aircraft)
 
-                # print('Time:')
-                # for key, item in time_dict.items():
-                #     print(key, np.mean(item))
+                # latency.report()
 
             if episode_time_step > 100 and env.aircraft_dict.num_aircraft == 0:
                 break
@@ -96,34 +147,46 @@ def run_experiment(env, no_episodes, render, save_path):
 
         # print('========================== End =============================', file=text_file)
         print('========================== End =============================')
-        print('Number of conflicts:', env.conflicts / 2)
+        print('Number of conflicts:', env.conflicts)
         print('Total Aircraft Generated:', env.id_tracker)
         print('Goal Aircraft:', env.goals)
-        print('NMACs:', env.NMACs / 2)
+        print('NMACs:', env.NMACs)
         print('Current Aircraft Enroute:', env.aircraft_dict.num_aircraft)
-        for key, item in time_dict.items():
-            print('%d aircraft: %.2f' % (key, np.mean(item)))
+        latency.report()
+
+        if recorder is not None:
+            recorder.close()
+        if exporter is not None:
+            exporter.close()
 
         # print training information for each training episode
-        epi_returns.append(info)
         conflicts_list.append(env.conflicts)
         NMACs_list.append(env.NMACs)
+        goals_list.append(env.goals)
+        generated_list.append(env.id_tracker)
         print('Training Episode:', episode)
         print('Cumulative Reward:', episode_reward)
 
-    time_list = time_dict.values()
-    flat_list = [item for sublist in time_list for item in sublist]
     print('----------------------------------------')
     print('Number of aircraft:', Config.num_aircraft)
     print('Search depth:', Config.search_depth)
     print('Simulations:', Config.no_simulations)
-    print('Time:', sum(flat_list) / float(len(flat_list)))
-    print('NMAC prob:', epi_returns.count('n') / no_episodes)
-    print('Goal prob:', epi_returns.count('g') / no_episodes)
-    print('Avg Conflicts/episode:', sum(conflicts_list) / float(len(conflicts_list)) / 2, file=text_file)  # / 2 to ignore duplication
-    print('Avg NMACs/episode:', sum(NMACs_list) / float(len(NMACs_list)) / 2, file=text_file)  # /2 to remove duplication
+    if stats is not None:
+        print('Search:', stats.totals)
+    print('Time:', latency.epochs.summary()['mean'])
+    latency.report()
+    latency.report(text_file)
+    latency.save(os.path.splitext(save_path)[0] + '_latency.json')
+    print('NMAC prob:', sum(NMACs > 0 for NMACs in NMACs_list) / no_episodes)
+    print('Goal prob:', sum(goals_list) / float(max(sum(generated_list), 1)))
+    print('Avg Conflicts/episode:', sum(conflicts_list) / float(len(conflicts_list)), file=text_file)
+    print('Avg NMACs/episode:', sum(NMACs_list) / float(len(NMACs_list)), file=text_file)
     env.close()
     text_file.close()
+    logger.close()
+    if dataset is not None:
+        dataset.close()
+        print('Decisions logged:', dataset.total)
 
 
 def main():
@@ -133,6 +196,20 @@ def main():
     parser.add_argument('--save_path', '-p', type=str, default='output/seed2.txt')
     parser.add_argument('--debug', '-d', action='store_true')
     parser.add_argument('--render', '-r', action='store_true')
+    parser.add_argument('--record_dir', type=str, default=None,
+                        help='stream the per-step fleet state, actions and conflict events to this directory')
+    parser.add_argument('--frame_dir', type=str, default=None,
+                        help='draw frames headless (no display needed) and write them to this directory')
+    parser.add_argument('--frame_format', type=str, default='ppm', choices=['ppm', 'raw'])
+    parser.add_argument('--frame_skip', type=int, default=1, help='write one frame every frame_skip time steps')
+    parser.add_argument('--search_stats', action='store_true',
+                        help='count and time the phases of every search (simulations, expansions, rollout outcomes, '
+                             'selection/expansion/rollout/backprop time, root visits). The last epoch is written to '
+                             'the "search" field of the _metrics.jsonl record every 100 time steps and the totals '
+                             'are printed at the end')
+    parser.add_argument('--dataset', type=str, default=None,
+                        help='log the decision of every search to shards in this directory, to train a policy with '
+                             'distill.py')
     args = parser.parse_args()
 
     import random
@@ -141,7 +218,8 @@ def main():
     np.random.seed(args.seed)
 
     env = MultiAircraftEnv(args.seed)
-    run_experiment(env, args.no_episodes, args.render, args.save_path)
+    run_experiment(env, args.no_episodes, args.render, args.save_path, args.record_dir, args.frame_dir,
+                   args.frame_format, args.frame_skip, args.search_stats, args.dataset)
 
 
 if __name__ == '__main__':
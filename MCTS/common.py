@@ -1,9 +1,15 @@
 import numpy as np
 
+from rng import GLOBAL_RNG
+
 
 class MCTSState:
-    def __init__(self, state):
+    # tree states and nodes are created by the thousand in every search, __slots__ keeps them small
+    __slots__ = ('state', 'rng')
+
+    def __init__(self, state, rng=GLOBAL_RNG):
         self.state = state
+        self.rng = rng  # random number generator of the search (see rng.py)
 
     def reward(self):
         raise NotImplemented("Implement game_result function")
@@ -19,6 +25,8 @@ class MCTSState:
 
 
 class MCTSNode:
+    __slots__ = ('parent', 'children', 'q', 'n')
+
     def __init__(self, parent=None):
         self.parent = parent
         self.children = []
@@ -60,7 +68,7 @@ class MCTSNode:
         best_indices = np.flatnonzero(b == b.max())
         if c_param < 0.1 and len(best_indices) > 1:
             return self.children[1]
-        return self.children[np.random.choice(best_indices)]
+        return self.children[self.state.rng.choice(best_indices)]
 
     # def best_child(self, c_param=1.4):
     #     choices_weights = [
@@ -86,4 +94,4 @@ class MCTSNode:
     #     return self.children[np.random.choice(best_indices)]
 
     def rollout_policy(self, possible_moves):
-        return possible_moves[np.random.randint(len(possible_moves))]
+        return possible_moves[self.state.rng.integers(len(possible_moves))]
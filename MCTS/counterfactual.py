@@ -0,0 +1,184 @@
+"""
+Counterfactual evaluation of planner configurations.
+
+The simulation runs --warmup time steps, then forks one child process per variant (a dict of Config overrides).
+The children share the simulator snapshot copy-on-write, so every variant starts on identical traffic. Each
+child plans with Config.replace(**variant) for --horizon time steps and reports its conflicts, NMACs, goals and
+decision time. The variants configure the planner: the forked simulator keeps the configuration of the
+snapshot.
+
+    python counterfactual.py --warmup 600 --horizon 300 -v '[{}, {"no_simulations": 50}]'
+"""
+
+import argparse
+import json
+import os
+import pickle
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.extend(['../Simulators'])
+from Agent_vertiHexSecGatePlus import plan_epoch
+from config_hex_sec import Config
+from rng import GLOBAL_RNG, spawn_rngs
+from MultiAircraftVertiHexSecGatePlusEnv import MultiAircraftEnv
+
+
+def run_horizon(env, last_observation, info, horizon, action_by_id=None, decision_interval=5, epoch_offset=0,
+                config=Config, rng=GLOBAL_RNG):
+    """
+    continue the simulation from the current env state for a fixed number of time steps, planning with
+    plan_epoch (config, rng) every decision_interval steps, and return the conflict/NMAC/goal metrics of this
+    horizon
+    """
+    conflicts_before = env.conflicts
+    NMACs_before = env.NMACs
+    goals_before = env.goals
+    generated_before = env.id_tracker
+    timesteps_before = env.total_timesteps
+
+    action_by_id = {} if action_by_id is None else action_by_id
+    decision_ms = []
+    for step in range(horizon):
+        if (step + epoch_offset) % decision_interval == 0:
+            time_before = time.perf_counter()
+            action_by_id, _ = plan_epoch(last_observation, info, config=config, rng=rng)
+            decision_ms.append((time.perf_counter() - time_before) * 1000)
+
+        last_observation, reward, done, info = env.step(action_by_id)
+
+    flight_hours = (env.total_timesteps - timesteps_before) / 3600
+    NMACs = env.NMACs - NMACs_before
+    return {
+        'steps': horizon,
+        'conflicts': env.conflicts - conflicts_before,
+        'NMACs': NMACs,
+        'NMAC/h': NMACs / flight_hours if flight_hours > 0 else 0.,
+        'goals': env.goals - goals_before,
+        'generated': env.id_tracker - generated_before,
+        'enroute': env.aircraft_dict.num_aircraft,
+        'flight_hours': flight_hours,
+        'decision_ms': float(np.mean(decision_ms)) if decision_ms else 0.,
+    }
+
+
+def fork_evaluate(env, last_observation, info, variants, horizon, action_by_id=None, seed=None, epoch_offset=0,
+                  max_workers=None):
+    """
+    evaluate several planner configurations from the same simulator snapshot.
+
+    every variant (a dict of Config overrides, e.g. {'no_simulations': 50}) runs in a child process
+    created with os.fork, so the children share the parent's env state copy-on-write and start on
+    identical traffic. Each child runs run_horizon with the planner config Config.replace(**variant) and a
+    planner rng of its own (from seed), and sends its metrics back through a pipe.
+    return a list of {'variant': ..., 'metrics': ...} (or {'variant': ..., 'error': ...}) in variant order
+    """
+    if not hasattr(os, 'fork'):
+        raise RuntimeError('counterfactual evaluation needs os.fork, which is not available on this platform')
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    results = []
+    for batch_start in range(0, len(variants), max_workers):
+        # flush before fork so buffered output is not written twice
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        children = []
+        for variant in variants[batch_start:batch_start + max_workers]:
+            read_fd, write_fd = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.close(read_fd)
+                try:
+                    env.viewer = None  # never draw into the parent's window
+                    config = Config.replace(**variant)
+                    rng = GLOBAL_RNG
+                    if seed is not None:
+                        # the simulator draws from the global streams, the planner from a stream of its own
+                        np.random.seed(seed)
+                        random.seed(seed)
+                        rng = spawn_rngs(seed, 1)[0]
+                    result = {'variant': variant,
+                              'metrics': run_horizon(env, last_observation, info, horizon, action_by_id,
+                                                     epoch_offset=epoch_offset, config=config, rng=rng)}
+                except BaseException as e:
+                    result = {'variant': variant, 'error': repr(e)}
+                with os.fdopen(write_fd, 'wb') as f:
+                    pickle.dump(result, f)
+                os._exit(0)
+
+            os.close(write_fd)
+            children.append((pid, read_fd))
+
+        for pid, read_fd in children:
+            with os.fdopen(read_fd, 'rb') as f:
+                try:
+                    result = pickle.load(f)
+                except EOFError:
+                    result = None
+            _, status = os.waitpid(pid, 0)
+            if result is None:
+                result = {'variant': None, 'error': 'worker %d exited with status %d' % (pid, status)}
+            results.append(result)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seed', type=int, default=2)
+    parser.add_argument('--warmup', '-w', type=int, default=600, help='time steps simulated before the fork')
+    parser.add_argument('--horizon', type=int, default=300, help='time steps simulated by each variant')
+    parser.add_argument('--variants', '-v', type=str, default=None,
+                        help='JSON list of Config overrides, e.g. \'[{"no_simulations": 50}, {"search_depth": 2}]\'')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--save_path', '-p', type=str, default=None)
+    args = parser.parse_args()
+
+    if args.variants is None:
+        variants = [{},
+                    {'no_simulations': Config.no_simulations // 2},
+                    {'search_depth': Config.search_depth - 1},
+                    {'no_simulations_lite': Config.no_simulations_lite * 2}]
+    else:
+        variants = json.loads(args.variants)
+
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+
+    env = MultiAircraftEnv(args.seed)
+    last_observation = env.reset()
+    info = None
+    action_by_id = {}
+    for step in range(args.warmup):
+        if step % 5 == 0:
+            action_by_id, _ = plan_epoch(last_observation, info)
+        last_observation, reward, done, info = env.step(action_by_id)
+
+    print('forking %d variants at time step %d (%d aircraft enroute)'
+          % (len(variants), args.warmup, env.aircraft_dict.num_aircraft))
+    results = fork_evaluate(env, last_observation, info, variants, args.horizon, action_by_id, seed=args.seed,
+                            epoch_offset=args.warmup % 5, max_workers=args.workers)
+
+    for result in results:
+        print('----------------------------------------')
+        print('Variant:', result['variant'])
+        if 'error' in result:
+            print('Error:', result['error'])
+            continue
+        for key, value in result['metrics'].items():
+            print('%s: %s' % (key, value))
+
+    if args.save_path is not None:
+        with open(args.save_path, 'w') as f:
+            json.dump({'seed': args.seed, 'warmup': args.warmup, 'horizon': args.horizon, 'results': results},
+                      f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""
+Distillation of the search into a policy.
+
+DatasetWriter logs the decisions of the searches (encounter encoding of policy_net.encode, visit counts of the
+root actions, chosen action, mean reward of the root) to shards of fixed size, shard_00000.npz, ... in a
+directory; the drivers write one with --dataset. train() fits a PolicyValueNet to the shards on the CPU (cross
+entropy to the visit distribution plus the squared error of the value), and the weights can then be used as
+Config.distilled_policy (fast policy mode of the drivers) or Config.policy_net (PUCT search).
+
+    python distill.py output/dataset -o output/policy.npz --epochs 20
+"""
+
+import argparse
+import glob
+import json
+import math
+import os
+import time
+
+import numpy as np
+
+from policy_net import INPUT_SIZE, PolicyValueNet
+
+
+def root_visits(root):
+    # visit counts of the ownship actions at the root of a search
+    visits = np.zeros(3, dtype=np.float32)
+    for child in root.children:
+        visits[int(child.state.prev_action[root.state.index])] = child.n
+    return visits
+
+
+class DatasetWriter:
+    """
+    append decisions to path in shards of shard_size rows. Shards already in path are kept, new ones are
+    numbered after them
+    """
+
+    def __init__(self, path, shard_size=16384):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.features = np.zeros((shard_size, INPUT_SIZE), dtype=np.float32)
+        self.visits = np.zeros((shard_size, 3), dtype=np.float32)
+        self.action = np.zeros(shard_size, dtype=np.int8)
+        self.value = np.zeros(shard_size, dtype=np.float32)
+        self.rows = 0  # rows of the current shard
+        self.shards = len(glob.glob(os.path.join(path, 'shard_*.npz')))
+        self.total = 0
+
+    def add(self, features, root, action):
+        # one decision: encoding of the ownship (policy_net.encode), root node of its search and chosen action
+        self.features[self.rows] = features
+        self.visits[self.rows] = root_visits(root)
+        self.action[self.rows] = action
+        self.value[self.rows] = root.q / root.n if root.n else 0.
+        self.rows += 1
+        self.total += 1
+        if self.rows == self.action.shape[0]:
+            self.flush()
+
+    def flush(self):
+        if self.rows == 0:
+            return
+        np.savez(os.path.join(self.path, 'shard_%05d.npz' % self.shards), features=self.features[:self.rows],
+                 visits=self.visits[:self.rows], action=self.action[:self.rows], value=self.value[:self.rows])
+        self.shards += 1
+        self.rows = 0
+
+    def close(self):
+        self.flush()
+
+
+def load_dataset(path):
+    """
+    features, visit distributions, actions and values of all shards under path (subdirectories included)
+    """
+    files = sorted(glob.glob(os.path.join(path, '**', 'shard_*.npz'), recursive=True))
+    if not files:
+        raise ValueError('no shard_*.npz under %s' % path)
+    tables = {'features': [], 'visits': [], 'action': [], 'value': []}
+    for file in files:
+        with np.load(file) as shard:
+            for key in tables:
+                tables[key].append(shard[key])
+    data = {key: np.concatenate(arrays) for key, arrays in tables.items()}
+    # searches without any expanded root child carry no target
+    total = data['visits'].sum(axis=1, keepdims=True)
+    keep = total[:, 0] > 0
+    data = {key: array[keep] for key, array in data.items()}
+    data['visits'] = data['visits'] / total[keep]
+    return data
+
+
+def loss_and_gradients(net, x, target_policy, target_value, value_weight):
+    # cross entropy to target_policy plus value_weight times the squared value error, averaged over the batch
+    h1, h2, logits, value_logits = net.forward(x)
+    logits = logits - logits.max(axis=1, keepdims=True)
+    policy = np.exp(logits)
+    policy /= policy.sum(axis=1, keepdims=True)
+    value = 1. / (1. + np.exp(-value_logits))
+    batch = x.shape[0]
+    loss = -np.sum(target_policy * np.log(policy + 1e-12)) / batch + \
+        value_weight * np.mean((value - target_value) ** 2)
+
+    d_logits = (policy - target_policy) / batch
+    d_value_logits = value_weight * 2 * (value - target_value) * value * (1 - value) / batch
+    d_h2 = d_logits @ net.w_policy.T + d_value_logits[:, None] @ net.w_value.T
+    d_a2 = d_h2 * (1 - h2 ** 2)
+    d_a1 = (d_a2 @ net.w2.T) * (1 - h1 ** 2)
+    gradients = {'w_policy': h2.T @ d_logits, 'b_policy': d_logits.sum(axis=0),
+                 'w_value': h2.T @ d_value_logits[:, None], 'b_value': d_value_logits.sum(keepdims=True),
+                 'w2': h1.T @ d_a2, 'b2': d_a2.sum(axis=0),
+                 'w1': x.T @ d_a1, 'b1': d_a1.sum(axis=0)}
+    return loss, gradients
+
+
+def accuracy(net, data):
+    # fraction of the decisions where the policy picks the action of the search
+    if data['action'].shape[0] == 0:
+        return 0.
+    priors, _ = net.evaluate(data['features'])
+    return float(np.mean(np.argmax(priors, axis=1) == data['action']))
+
+
+def train(data, hidden=64, epochs=20, batch_size=256, learning_rate=1e-3, value_weight=1., validation=0.1,
+          seed=0, net=None):
+    """
+    fit a PolicyValueNet (a new one with hidden units, or net) to data (load_dataset) with Adam.
+    validation: fraction of the decisions held out. Return the network and the history of the epochs
+    """
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(data['action'].shape[0])
+    num_validation = int(len(order) * validation)
+    held_out = {key: array[order[:num_validation]] for key, array in data.items()}
+    train_set = {key: array[order[num_validation:]] for key, array in data.items()}
+    net = PolicyValueNet.random(hidden, seed) if net is None else net
+
+    weights = net.weights()
+    moments = {key: np.zeros_like(value) for key, value in weights.items()}
+    squares = {key: np.zeros_like(value) for key, value in weights.items()}
+    beta1, beta2 = 0.9, 0.999
+    step = 0
+    history = []
+    for epoch in range(1, epochs + 1):
+        time_before = time.time()
+        permutation = rng.permutation(train_set['action'].shape[0])
+        losses = []
+        for start in range(0, permutation.shape[0], batch_size):
+            batch = permutation[start:start + batch_size]
+            loss, gradients = loss_and_gradients(net, train_set['features'][batch], train_set['visits'][batch],
+                                                 train_set['value'][batch], value_weight)
+            losses.append(loss)
+            step += 1
+            for key, gradient in gradients.items():
+                # the arrays of weights are the ones of net, updated in place
+                moments[key] = beta1 * moments[key] + (1 - beta1) * gradient
+                squares[key] = beta2 * squares[key] + (1 - beta2) * gradient ** 2
+                weights[key] -= learning_rate * (moments[key] / (1 - beta1 ** step)) / \
+                    (np.sqrt(squares[key] / (1 - beta2 ** step)) + 1e-8)
+        record = {'epoch': epoch, 'loss': float(np.mean(losses)) if losses else math.nan,
+                  'train_accuracy': accuracy(net, train_set), 'validation_accuracy': accuracy(net, held_out),
+                  'seconds': time.time() - time_before}
+        history.append(record)
+        print('epoch %d: loss %.4f, accuracy %.3f (train) %.3f (validation), %.1f s'
+              % (epoch, record['loss'], record['train_accuracy'], record['validation_accuracy'], record['seconds']))
+    return net, history
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dataset', type=str, help='directory of shards written with --dataset')
+    parser.add_argument('--output', '-o', type=str, default='output/policy.npz')
+    parser.add_argument('--hidden', type=int, default=64)
+    parser.add_argument('--epochs', type=int, default=20)
+    parser.add_argument('--batch_size', type=int, default=256)
+    parser.add_argument('--learning_rate', type=float, default=1e-3)
+    parser.add_argument('--value_weight', type=float, default=1.)
+    parser.add_argument('--validation', type=float, default=0.1, help='fraction of the decisions held out')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    data = load_dataset(args.dataset)
+    print('%d decisions' % data['action'].shape[0])
+    net, history = train(data, args.hidden, args.epochs, args.batch_size, args.learning_rate, args.value_weight,
+                         args.validation, args.seed)
+    net.save(args.output)
+    with open(os.path.splitext(args.output)[0] + '_history.json', 'w') as f:
+        json.dump(history, f, indent=2)
+    print('weights written to', args.output)
+
+
+if __name__ == '__main__':
+    main()
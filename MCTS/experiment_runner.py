@@ -0,0 +1,295 @@
+import argparse
+import importlib
+import json
+import math
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.extend(['../Simulators'])
+from search_multi import SearchStats
+from distill import DatasetWriter
+from latency import LatencyRecorder
+from rng import GLOBAL_RNG, spawn_rngs
+
+# driver (plan_epoch), simulator and config module of each case study
+CASES = {
+    'hex': ('Agent_vertiHexSecGatePlus', 'MultiAircraftVertiHexSecGatePlusEnv', 'config_hex_sec'),
+    'two_stage': ('Agent_vertiHexSecGatePlusTwoStage', 'MultiAircraftVertiHexSecGatePlusTwoStageEnv', 'config_hex_sec'),
+    'vertiport': ('Agent_vertiport', 'MultiAircraftVertiportEnv', 'config_vertiport'),
+}
+
+# options of a configuration that are run options of the episode loop rather than Config parameters
+RUN_OPTIONS = ('fast_forward', 'cpa', 'search_stats', 'pipeline', 'dataset')
+
+# two-sided 95% Student t quantiles by degrees of freedom, the normal quantile is used beyond 30
+T_95 = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262, 10: 2.228,
+        11: 2.201, 12: 2.179, 13: 2.160, 14: 2.145, 15: 2.131, 16: 2.120, 17: 2.110, 18: 2.101, 19: 2.093,
+        20: 2.086, 21: 2.080, 22: 2.074, 23: 2.069, 24: 2.064, 25: 2.060, 26: 2.056, 27: 2.052, 28: 2.048,
+        29: 2.045, 30: 2.042}
+
+
+def episode_seed(seed, episode):
+    # independent stream for every (seed, episode) so that results do not depend on the worker or the order
+    return int(np.random.SeedSequence([seed, episode]).generate_state(1)[0])
+
+
+def run_episode(case, seed, episode, variant, max_steps):
+    """
+    run one episode of a case study with the Config overrides in variant (plus the run options fast_forward,
+    cpa, search_stats, pipeline and dataset) for at most max_steps time steps, and return its metrics.
+    with dataset, the decisions of the searches are logged to <dataset>/seed<seed>_episode<episode> (distill.py)
+    """
+    driver_name, env_name, config_name = CASES[case]
+    driver = importlib.import_module(driver_name)
+    Config = importlib.import_module(config_name).Config
+    MultiAircraftEnv = importlib.import_module(env_name).MultiAircraftEnv
+
+    options = {key: variant[key] for key in RUN_OPTIONS if key in variant}
+    if case == 'vertiport' and (options.get('fast_forward') or options.get('cpa')):
+        # the vertiport driver has no bulk stepping and no conflict prediction
+        raise ValueError('fast_forward and cpa are run options of the hex and two_stage cases')
+    # the simulator and the planner get a configuration and a random stream of their own, so that the result
+    # does not depend on what else runs in this process
+    config = Config.replace(**{key: value for key, value in variant.items() if key not in RUN_OPTIONS})
+    sd = episode_seed(seed, episode)
+    env_rng, planner_rng = spawn_rngs(sd, 2)
+    env = MultiAircraftEnv(sd, config=config, rng=env_rng)
+    executor = None
+    if options.get('pipeline'):
+        if case != 'two_stage':
+            raise ValueError('pipeline is a run option of the two_stage case')
+        if options.get('dataset'):
+            raise ValueError('the dataset run option logs the searches of this process, not of the pipeline')
+        executor = driver.make_pipeline(options['pipeline'], config)
+    dataset = None
+    if options.get('dataset'):
+        dataset = DatasetWriter(os.path.join(options['dataset'], 'seed%d_episode%d' % (seed, episode)))
+    try:
+        return run_loop(case, driver, config, env, max_steps, options.get('fast_forward', False),
+                        options.get('cpa', False), options.get('search_stats', False), planner_rng, executor,
+                        dataset)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if dataset is not None:
+            dataset.close()
+
+
+def run_loop(case, driver, config, env, max_steps, fast_forward=False, use_cpa=False, search_stats=False,
+             rng=GLOBAL_RNG, executor=None, dataset=None):
+    # the guidance loop of run_experiment without the prints, planning with config and rng
+    # (in the worker processes of executor for the pipelined two_stage planner), the searches logged to dataset
+    wall_before = time.time()
+    if case == 'vertiport':
+        last_observation, id_list = env.reset()
+        episode_time_step = 1
+    else:
+        last_observation = env.reset()
+        episode_time_step = 0
+    action_by_id = {}
+    info = None
+    near_end = False
+    latency = LatencyRecorder(config.decision_deadline)
+    stats = SearchStats() if search_stats else None
+
+    while episode_time_step < max_steps:
+        if episode_time_step % 5 == 0:
+            if case == 'hex':
+                cpa = env.predict_conflicts() if use_cpa else None
+                action_by_id, time_list = driver.plan_epoch(last_observation, info, cpa, stats, config, rng, dataset)
+                # the sectors plan in parallel in the concept of operations, so the epoch takes the slowest one
+                latency.record_epoch(max(time_list), env.aircraft_dict.num_aircraft, time_list)
+            elif case == 'two_stage':
+                alert_ids = env.predict_conflicts().alert_ids(config.cpa_alert_dist) if use_cpa else None
+                if executor is not None:
+                    action_by_id, time_list, _, stage_ms = driver.plan_epoch_pipelined(executor, last_observation,
+                                                                                       info, alert_ids, stats, rng)
+                else:
+                    action_by_id, time_list, _, stage_ms = driver.plan_epoch(last_observation, info, alert_ids, stats,
+                                                                             config, rng, dataset)
+                latency.record_epoch(stage_ms['epoch'], env.aircraft_dict.num_aircraft, time_list, stage_ms)
+            else:
+                action_by_id, decision_time = driver.plan_epoch(last_observation, id_list, info, stats, config, rng,
+                                                                dataset)
+                latency.record_epoch(decision_time, last_observation.shape[0])
+            if stats is not None:
+                stats.epoch()
+
+        steps = 1
+        if case == 'vertiport':
+            (observation, id_list), reward, done, info = env.step(action_by_id)
+        else:
+            if fast_forward:
+                steps = max(env.safe_steps(5 - episode_time_step % 5, near_end), 1)
+            if steps > 1:
+                observation, reward, done, info = env.fast_forward(action_by_id, steps)
+            else:
+                observation, reward, done, info = env.step(action_by_id, near_end)
+            if env.id_tracker - 1 >= 10000:
+                near_end = True
+        last_observation = observation
+        episode_time_step += steps
+
+        if done or (episode_time_step > 100 and env.aircraft_dict.num_aircraft == 0):
+            break
+
+    flight_hours = env.total_timesteps / 3600
+    decision = latency.epochs.summary()
+    metrics = {
+        'steps': episode_time_step,
+        'conflicts': env.conflicts,
+        'NMACs': env.NMACs,
+        'NMAC/h': env.NMACs / flight_hours if flight_hours > 0 else 0.,
+        'flight_hours': flight_hours,
+        'goals': env.goals,
+        'generated': env.id_tracker,
+        'enroute': env.aircraft_dict.num_aircraft,
+        'decision_ms': decision['mean'],
+        'decision_ms_p50': decision['p50'],
+        'decision_ms_p95': decision['p95'],
+        'decision_ms_p99': decision['p99'],
+        'decision_ms_max': decision['max'],
+        'deadline_misses': latency.deadline_misses,
+        'wall_s': time.time() - wall_before,
+    }
+    for stage, histogram in latency.by_stage.items():
+        # decision time of each stage of a sector, two_stage only
+        stage_summary = histogram.summary()
+        metrics['%s_stage_ms' % stage] = stage_summary['mean']
+        metrics['%s_stage_ms_p95' % stage] = stage_summary['p95']
+    if stats is not None:
+        metrics.update(stats.flat())
+    if hasattr(env, 'route_time'):
+        # mean time (s) from departure to goal of each route, both priorities
+        for route in (1, 2, 3):
+            times = env.route_time[0][route].merge(env.route_time[1][route])
+            metrics['route_%d_time' % route] = times.mean if times.count else None
+    env.close()
+    return metrics
+
+
+def run_task(task):
+    # pool entry point, errors are returned so that one failing episode does not stop the sweep
+    name, case, seed, episode, variant, max_steps = task
+    try:
+        metrics = run_episode(case, seed, episode, variant, max_steps)
+        return {'config': name, 'seed': seed, 'episode': episode, 'metrics': metrics}
+    except Exception as e:
+        return {'config': name, 'seed': seed, 'episode': episode, 'error': repr(e)}
+
+
+def confidence_interval(values):
+    """
+    mean, sample standard deviation and 95% confidence interval of the mean of values (None are skipped)
+    """
+    values = np.array([value for value in values if value is not None], dtype=np.float64)
+    n = values.shape[0]
+    if n == 0:
+        return {'n': 0, 'mean': None, 'std': None, 'ci95': None}
+    mean = float(values.mean())
+    if n == 1:
+        return {'n': 1, 'mean': mean, 'std': 0., 'ci95': [mean, mean]}
+    std = float(values.std(ddof=1))
+    half_width = T_95.get(n - 1, 1.960) * std / math.sqrt(n)
+    return {'n': n, 'mean': mean, 'std': std, 'ci95': [mean - half_width, mean + half_width]}
+
+
+def summarize(runs):
+    """
+    per-metric statistics over the episodes of one configuration. NMAC/h is also pooled over all flight hours,
+    and NMAC prob is the fraction of episodes with at least one NMAC
+    """
+    runs = [run['metrics'] for run in runs if 'metrics' in run]
+    summary = {'episodes': len(runs)}
+    if not runs:
+        return summary
+    for key in runs[0]:
+        summary[key] = confidence_interval([run.get(key) for run in runs])
+    flight_hours = sum(run['flight_hours'] for run in runs)
+    summary['NMAC/h pooled'] = sum(run['NMACs'] for run in runs) / flight_hours if flight_hours > 0 else 0.
+    summary['NMAC prob'] = sum(run['NMACs'] > 0 for run in runs) / float(len(runs))
+    return summary
+
+
+def run_configs(case, configs, seeds, episodes, max_steps, workers=None):
+    """
+    run every configuration ({name: Config overrides}) on every seed x episode in a process pool.
+    return {name: {'variant': ..., 'summary': ..., 'runs': [...]}}
+    """
+    tasks = [(name, case, seed, episode, variant, max_steps)
+             for name, variant in configs.items() for seed in seeds for episode in range(1, episodes + 1)]
+
+    runs = {name: [] for name in configs}
+    if workers != 1 and any(variant.get('pipeline') for variant in configs.values()):
+        # the pool workers are daemonic and cannot start the processes of the pipeline
+        raise ValueError('the pipeline run option needs --workers 1')
+    if workers == 1:
+        results = map(run_task, tasks)
+    else:
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap_unordered(run_task, tasks)
+    for done, result in enumerate(results, 1):
+        runs[result['config']].append(result)
+        if 'error' in result:
+            print('[%d/%d] %s seed %d episode %d failed: %s'
+                  % (done, len(tasks), result['config'], result['seed'], result['episode'], result['error']))
+        else:
+            print('[%d/%d] %s seed %d episode %d: %d conflicts, %d NMACs, %.2f flight hours'
+                  % (done, len(tasks), result['config'], result['seed'], result['episode'],
+                     result['metrics']['conflicts'], result['metrics']['NMACs'], result['metrics']['flight_hours']))
+    if workers != 1:
+        pool.close()
+        pool.join()
+
+    output = {}
+    for name, variant in configs.items():
+        config_runs = sorted(runs[name], key=lambda run: (run['seed'], run['episode']))
+        output[name] = {'variant': variant, 'summary': summarize(config_runs), 'runs': config_runs}
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--case', type=str, default='hex', choices=sorted(CASES))
+    parser.add_argument('--seeds', type=int, nargs='+', default=[2])
+    parser.add_argument('--episodes', '-e', type=int, default=1, help='episodes per seed')
+    parser.add_argument('--max_steps', type=int, default=3600, help='time steps per episode at most')
+    parser.add_argument('--configs', '-c', type=str, default=None,
+                        help='JSON dict of named Config overrides, e.g. \'{"base": {}, "lite": {"no_simulations": 50}}\''
+                             ', "fast_forward", "cpa", "search_stats", "pipeline" (worker processes of the two_stage '
+                             'planner) and "dataset" (directory the searches are logged to, see distill.py) select '
+                             'the run options')
+    parser.add_argument('--workers', type=int, default=None, help='pool size, 1 runs in this process')
+    parser.add_argument('--output', '-o', type=str, default='output/experiments.json')
+    args = parser.parse_args()
+
+    configs = {'default': {}} if args.configs is None else json.loads(args.configs)
+
+    time_before = time.time()
+    results = run_configs(args.case, configs, args.seeds, args.episodes, args.max_steps, args.workers)
+
+    for name, result in results.items():
+        summary = result['summary']
+        print('----------------------------------------')
+        print('Config:', name, result['variant'])
+        print('Episodes:', summary['episodes'])
+        if summary['episodes'] == 0:
+            continue
+        for key in ('conflicts', 'NMACs', 'NMAC/h', 'flight_hours', 'goals', 'decision_ms'):
+            stats = summary[key]
+            print('%s: %.3f [%.3f, %.3f]' % (key, stats['mean'], stats['ci95'][0], stats['ci95'][1]))
+        print('NMAC/h pooled:', summary['NMAC/h pooled'])
+        print('NMAC prob:', summary['NMAC prob'])
+
+    with open(args.output, 'w') as f:
+        json.dump({'case': args.case, 'seeds': args.seeds, 'episodes': args.episodes, 'max_steps': args.max_steps,
+                   'wall_s': time.time() - time_before, 'configs': results}, f, indent=2)
+    print('results written to', args.output)
+
+
+if __name__ == '__main__':
+    main()
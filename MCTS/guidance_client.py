@@ -0,0 +1,116 @@
+"""
+Stand-in client of the guidance server.
+
+Replays a recording written with --record_dir: at every decision epoch of the recording, the observation of
+each sector (case hex, the aircraft of the sector and those of the other sectors within nearby_dist) or of the
+whole fleet (case vertiport) is sent to the server as one /decide request, all requests of an epoch at once.
+Prints the request latency and how often the server chose the recorded action.
+"""
+
+import argparse
+import json
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.extend(['../Simulators'])
+from latency import LatencyHistogram
+from replay import TrajectoryReader
+
+
+def epoch_requests(fleet, case, nearby_dist):
+    # (request, recorded actions of its indices) of every sector of the recorded fleet rows
+    state = np.stack([fleet['x'], fleet['y'], fleet['vx'], fleet['vy'], fleet['speed'], fleet['heading'],
+                      fleet['sgx'] if case == 'hex' else fleet['gx'],
+                      fleet['sgy'] if case == 'hex' else fleet['gy']], axis=1).astype(np.float64)
+    if case == 'vertiport':
+        return [({'state': state.tolist(), 'indices': list(range(state.shape[0]))}, fleet['action'].tolist())]
+
+    requests = []
+    for sector_id in np.unique(fleet['sector_id']):
+        if sector_id < 0:
+            continue
+        own = np.flatnonzero(fleet['sector_id'] == sector_id)
+        others = np.flatnonzero(fleet['sector_id'] != sector_id)
+        if others.shape[0] > 0:
+            gaps = np.hypot(fleet['x'][others, None] - fleet['x'][None, own],
+                            fleet['y'][others, None] - fleet['y'][None, own])
+            others = others[gaps.min(axis=1) < nearby_dist]
+        rows = np.concatenate([own, others])
+        requests.append(({'state': state[rows].tolist(), 'indices': list(range(own.shape[0])),
+                          'sector_id': int(sector_id), 'goal_exit_ids': fleet['goal_exit_id'][own].tolist()},
+                         fleet['action'][own].tolist()))
+    return requests
+
+
+def post(url, request):
+    data = json.dumps(request).encode()
+    http_request = urllib.request.Request(url + '/decide', data, {'Content-Type': 'application/json'})
+    time_before = time.perf_counter()
+    with urllib.request.urlopen(http_request) as response:
+        result = json.loads(response.read())
+    result['latency_ms'] = (time.perf_counter() - time_before) * 1000
+    return result
+
+
+def replay(reader, url, case='hex', every=5, nearby_dist=float('inf'), concurrency=8, max_epochs=None):
+    """
+    send the epochs of reader to the server at url, return the latency histogram, the number of decided
+    aircraft and how many got the recorded action
+    """
+    latency = LatencyHistogram()
+    decided = 0
+    same = 0
+    epochs = 0
+    with ThreadPoolExecutor(concurrency) as pool:
+        for step, fleet in reader.window(reader.first_step, reader.last_step):
+            if step % every != 0 or fleet.shape[0] == 0:
+                continue
+            requests = epoch_requests(np.asarray(fleet), case, nearby_dist)
+            results = list(pool.map(lambda request: post(url, request[0]), requests))
+            for (_, recorded), result in zip(requests, results):
+                latency.record(result['latency_ms'])
+                decided += len(result['actions'])
+                same += sum(action == recorded_action for action, recorded_action in zip(result['actions'], recorded))
+            epochs += 1
+            if max_epochs is not None and epochs >= max_epochs:
+                break
+    return latency, decided, same
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('record_dir', type=str, help='episode directory written by --record_dir')
+    parser.add_argument('--url', type=str, default='http://127.0.0.1:8765')
+    parser.add_argument('--case', type=str, default='hex', choices=['hex', 'vertiport'])
+    parser.add_argument('--every', type=int, default=5, help='time steps between decision epochs')
+    parser.add_argument('--nearby_dist', type=float, default=None,
+                        help='aircraft of other sectors closer than this are sent along (default: '
+                             '3 * Config.minimum_separation, as the simulator does)')
+    parser.add_argument('--concurrency', type=int, default=8, help='requests in flight at once')
+    parser.add_argument('--max_epochs', type=int, default=None)
+    args = parser.parse_args()
+
+    nearby_dist = args.nearby_dist
+    if nearby_dist is None and args.case == 'hex':
+        from config_hex_sec import Config
+        nearby_dist = 3 * Config.minimum_separation
+
+    reader = TrajectoryReader(args.record_dir)
+    time_before = time.time()
+    latency, decided, same = replay(reader, args.url, args.case, args.every, nearby_dist, args.concurrency,
+                                    args.max_epochs)
+    summary = latency.summary()
+    print('%d requests, %d aircraft decided in %.1f s' % (summary['count'], decided, time.time() - time_before))
+    print('request latency (ms): mean %.2f, p50 %.2f, p95 %.2f, p99 %.2f, max %.2f'
+          % (summary['mean'], summary['p50'], summary['p95'], summary['p99'], summary['max']))
+    print('recorded action chosen: %.1f%%' % (100. * same / max(decided, 1)))
+    with urllib.request.urlopen(args.url + '/health') as response:
+        print('server:', json.loads(response.read()))
+
+
+if __name__ == '__main__':
+    main()
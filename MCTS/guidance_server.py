@@ -0,0 +1,286 @@
+"""
+Local guidance server.
+
+A long-running planner process for simulators outside this repository. The configuration and the search
+modules are loaded once in a pool of worker processes, and decisions are served over HTTP on localhost:
+
+    POST /decide  {"state": [[x, y, vx, vy, speed, heading, gx, gy], ...],  rows of the aircraft of the sector
+                   "indices": [0, 1, ...],                                  rows to decide, in this order
+                   "sector_id": 3, "goal_exit_ids": [2, 5, ...],           case hex only, one per index
+                   "full_search": [true, false, ...]}                       optional
+              ->  {"actions": [0|1|2, ...], "ms": compute time, "batch": requests dispatched together}
+    GET /health   request and batch counters
+
+As in the drivers, the rows are decided one after the other and each search sees the actions already decided.
+Without full_search an aircraft gets the full search when another row is closer than Config.full_search_dist.
+In case hex, (gx, gy) is the exit gate of the sector (the sub-goal); in case vertiport it is the goal.
+
+Requests that arrive within window_ms of each other (at most max_batch) are collected into a batch and each one
+is submitted to the pool as a task of its own, so that a burst of sector requests is spread over the workers at
+once. Every request is answered as soon as its own task is done; the batch only sets the seeds and counters.
+"""
+
+import argparse
+import importlib
+import json
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+sys.path.extend(['../Simulators'])
+from search_multi import MCTS
+
+# search nodes and config module of each case
+KERNELS = {
+    'hex': ('nodesHexSecGatePlus', 'config_hex_sec'),
+    'vertiport': ('nodes_multi', 'config_vertiport'),
+}
+
+# case, Config and node module of this process, set by load_kernels
+kernels = {}
+
+
+def load_kernels(case, overrides):
+    node_name, config_name = KERNELS[case]
+    kernels['case'] = case
+    kernels['config'] = importlib.import_module(config_name).Config.replace(**overrides)
+    kernels['nodes'] = importlib.import_module(node_name)
+
+
+def warm_up(_):
+    # keeps a worker busy for a moment, so that every warm-up task starts a process of its own
+    time.sleep(0.1)
+    return kernels['case']
+
+
+def decide(request, config, nodes, case, rng):
+    """
+    actions of the rows request['indices'] of request['state'] (see the module docstring)
+    """
+    state = np.asarray(request['state'], dtype=np.float64).reshape(-1, 8)
+    indices = [int(index) for index in request['indices']]
+    if any(index < 0 or index >= state.shape[0] for index in indices):
+        raise ValueError('indices must be rows of state')
+    if case == 'hex':
+        goal_exit_ids = request['goal_exit_ids']
+        if len(goal_exit_ids) != len(indices):
+            raise ValueError('one goal_exit_id per index is needed')
+    full_search = request.get('full_search')
+    if full_search is None:
+        # distance to the nearest other row, as the simulators report it in info
+        gaps = np.hypot(state[:, None, 0] - state[None, :, 0], state[:, None, 1] - state[None, :, 1])
+        np.fill_diagonal(gaps, np.inf)
+        nearest = gaps.min(axis=1) if state.shape[0] > 1 else np.full(state.shape[0], np.inf)
+        full_search = [nearest[index] < config.full_search_dist for index in indices]
+
+    action = np.ones(state.shape[0], dtype=np.int32)
+    actions = []
+    for k, index in enumerate(indices):
+        if full_search[k]:
+            simulations, search_depth = config.no_simulations, config.search_depth
+        else:
+            simulations, search_depth = config.no_simulations_lite, config.search_depth_lite
+        if case == 'hex':
+            root_state = nodes.make_root_state(state, index, action, int(request['sector_id']), int(goal_exit_ids[k]),
+                                               search_depth, config, rng)
+        else:
+            root_state = nodes.MultiAircraftState(state=state, index=index, init_action=action, config=config,
+                                                  rng=rng)
+        best_node = MCTS(nodes.MultiAircraftNode(state=root_state)).best_action(simulations, search_depth)
+        action[index] = best_node.state.prev_action[index]
+        actions.append(int(action[index]))
+    return actions
+
+
+def decide_task(task):
+    # worker entry point, errors are returned so that one bad request does not fail its batch
+    request, seed = task
+    time_before = time.perf_counter()
+    try:
+        actions = decide(request, kernels['config'], kernels['nodes'], kernels['case'], np.random.default_rng(seed))
+    except Exception as e:
+        return {'error': repr(e)}
+    return {'actions': actions, 'ms': (time.perf_counter() - time_before) * 1000}
+
+
+def resolver(future, batch):
+    # done callback of a pool task that resolves future, the one handed out by MicroBatcher.submit
+    def resolve(task_future):
+        try:
+            result = task_future.result()
+        except Exception as e:
+            future.set_exception(e)
+            return
+        result['batch'] = batch
+        future.set_result(result)
+    return resolve
+
+
+class MicroBatcher:
+    """
+    collect the requests that arrive within window_ms of the first one, at most max_batch, and submit each one
+    to executor (or run them in this thread without one). Every request gets a seed drawn from rng in arrival
+    order and its future is resolved when its own task is done, while the next window is being collected
+    """
+
+    def __init__(self, executor=None, window_ms=5., max_batch=32, rng=None):
+        self.executor = executor
+        self.window_ms = window_ms
+        self.max_batch = max_batch
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.queue = queue.Queue()
+        self.requests = 0
+        self.batches = 0
+        self.thread = threading.Thread(target=self._dispatch_loop, name='micro-batcher', daemon=True)
+        self.thread.start()
+
+    def submit(self, request):
+        # a Future of the decide_task result of request
+        future = Future()
+        self.queue.put((request, future))
+        return future
+
+    def _dispatch_loop(self):
+        done = False
+        while not done:
+            item = self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.perf_counter() + self.window_ms / 1000.
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    done = True
+                    break
+                batch.append(item)
+
+            seeds = self.rng.integers(0, 2 ** 63 - 1, size=len(batch))
+            self.requests += len(batch)
+            self.batches += 1
+            for (request, future), seed in zip(batch, seeds):
+                task = (request, int(seed))
+                if self.executor is None:
+                    try:
+                        result = decide_task(task)
+                    except Exception as e:
+                        future.set_exception(e)
+                        continue
+                    result['batch'] = len(batch)
+                    future.set_result(result)
+                    continue
+                try:
+                    task_future = self.executor.submit(decide_task, task)
+                except Exception as e:
+                    # the pool itself failed (e.g. a worker died)
+                    future.set_exception(e)
+                    continue
+                task_future.add_done_callback(resolver(future, len(batch)))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+class GuidanceHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/health':
+            self.reply(404, {'error': 'unknown path %s' % self.path})
+            return
+        batcher = self.server.batcher
+        self.reply(200, {'case': self.server.case, 'requests': batcher.requests, 'batches': batcher.batches,
+                         'mean_batch': batcher.requests / float(batcher.batches) if batcher.batches else 0.})
+
+    def do_POST(self):
+        if self.path != '/decide':
+            self.reply(404, {'error': 'unknown path %s' % self.path})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            if not isinstance(request, dict):
+                raise TypeError('the request must be a JSON object')
+            if 'state' not in request or 'indices' not in request:
+                raise ValueError('state and indices are needed')
+        except (TypeError, ValueError) as e:
+            self.reply(400, {'error': str(e)})
+            return
+        result = self.server.batcher.submit(request).result()
+        self.reply(400 if 'error' in result else 200, result)
+
+    def reply(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(case='hex', host='127.0.0.1', port=8765, workers=2, window_ms=5., max_batch=32, overrides=None,
+                seed=None):
+    """
+    HTTP server of case with a warm pool of workers processes (0 decides in the batcher thread) planning
+    with the Config overrides. Call serve_forever() to serve and close_server() to stop
+    """
+    overrides = {} if overrides is None else overrides
+    if workers > 0:
+        executor = ProcessPoolExecutor(workers, initializer=load_kernels, initargs=(case, overrides))
+        list(executor.map(warm_up, range(workers)))
+    else:
+        load_kernels(case, overrides)
+        executor = None
+    server = ThreadingHTTPServer((host, port), GuidanceHandler)
+    server.daemon_threads = True
+    server.case = case
+    server.executor = executor
+    server.batcher = MicroBatcher(executor, window_ms, max_batch, np.random.default_rng(seed))
+    return server
+
+
+def close_server(server):
+    server.server_close()
+    server.batcher.close()
+    if server.executor is not None:
+        server.executor.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--case', type=str, default='hex', choices=sorted(KERNELS))
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=2, help='planner processes, 0 plans in the server process')
+    parser.add_argument('--window_ms', type=float, default=5., help='requests arriving within this window are batched')
+    parser.add_argument('--max_batch', type=int, default=32)
+    parser.add_argument('--config', type=str, default=None, help='JSON dict of Config overrides')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    overrides = {} if args.config is None else json.loads(args.config)
+    server = make_server(args.case, args.host, args.port, args.workers, args.window_ms, args.max_batch, overrides,
+                         args.seed)
+    print('guidance server (%s) on http://%s:%d' % (args.case, args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        close_server(server)
+
+
+if __name__ == '__main__':
+    main()
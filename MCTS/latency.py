@@ -0,0 +1,128 @@
+"""
+Decision latency recorder of the drivers.
+
+Decision times are measured with time.perf_counter() and kept in fixed-memory histograms with logarithmic
+bins (20 per decade, so a percentile is within about 12% of the exact value) instead of growing lists: one
+over all epochs, one per fleet size bucket, one per sector and one per planning stage (two-stage planner). Epochs slower than the deadline are counted.
+"""
+
+import json
+
+import numpy as np
+
+# upper edges of the bins, in ms, from 10 us to 1000 s
+BIN_EDGES = np.logspace(-2, 6, 8 * 20 + 1)
+
+# lower bounds of the fleet size buckets
+BUCKET_EDGES = (0, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = np.zeros(BIN_EDGES.shape[0] + 1, dtype=np.int64)  # the last bin is above 1000 s
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def record(self, ms):
+        ms = float(ms)
+        self.counts[np.searchsorted(BIN_EDGES, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, q):
+        # upper edge of the bin holding the q-th percentile, never above the largest value
+        if self.count == 0:
+            return 0.
+        rank = int(np.ceil(q / 100. * self.count))
+        index = int(np.searchsorted(np.cumsum(self.counts), max(rank, 1)))
+        return float(min(BIN_EDGES[min(index, BIN_EDGES.shape[0] - 1)], self.max))
+
+    def summary(self):
+        return {'count': self.count,
+                'mean': self.total / self.count if self.count else 0.,
+                'p50': self.percentile(50),
+                'p95': self.percentile(95),
+                'p99': self.percentile(99),
+                'max': self.max}
+
+
+def bucket_label(num_aircraft):
+    index = int(np.searchsorted(BUCKET_EDGES, num_aircraft, side='right')) - 1
+    if index == len(BUCKET_EDGES) - 1:
+        return '%d+' % BUCKET_EDGES[index]
+    return '%d-%d' % (BUCKET_EDGES[index], BUCKET_EDGES[index + 1] - 1)
+
+
+class LatencyRecorder:
+    """
+    decision epochs of a run. deadline_ms: an epoch that takes longer is counted as a deadline miss
+    (Config.decision_deadline, None to not count)
+    """
+
+    def __init__(self, deadline_ms=None):
+        self.deadline_ms = deadline_ms
+        self.epochs = LatencyHistogram()
+        self.by_aircraft = {}
+        self.by_sector = {}
+        self.by_stage = {}
+        self.deadline_misses = 0
+
+    def record_epoch(self, epoch_ms, num_aircraft, sector_ms=None, stage_ms=None):
+        """
+        epoch_ms: decision time of the epoch, num_aircraft: aircraft enroute,
+        sector_ms: decision time of each sector (the sectors decide in parallel, epoch_ms is the slowest one),
+        stage_ms: {stage: [decision time of the stage in each sector]}, other keys are ignored
+        """
+        self.epochs.record(epoch_ms)
+        label = bucket_label(num_aircraft)
+        if label not in self.by_aircraft:
+            self.by_aircraft[label] = LatencyHistogram()
+        self.by_aircraft[label].record(epoch_ms)
+        if sector_ms is not None:
+            for sector_id, ms in enumerate(sector_ms):
+                if sector_id not in self.by_sector:
+                    self.by_sector[sector_id] = LatencyHistogram()
+                self.by_sector[sector_id].record(ms)
+        if stage_ms is not None:
+            for stage in ('high', 'low'):
+                if stage not in stage_ms:
+                    continue
+                if stage not in self.by_stage:
+                    self.by_stage[stage] = LatencyHistogram()
+                for ms in stage_ms[stage]:
+                    self.by_stage[stage].record(ms)
+        if self.deadline_ms is not None and epoch_ms > self.deadline_ms:
+            self.deadline_misses += 1
+
+    def summary(self):
+        return {'deadline_ms': self.deadline_ms,
+                'deadline_misses': self.deadline_misses,
+                'miss_rate': self.deadline_misses / float(self.epochs.count) if self.epochs.count else 0.,
+                'epochs': self.epochs.summary(),
+                'by_aircraft': {label: self.by_aircraft[label].summary()
+                                for label in sorted(self.by_aircraft, key=lambda label: int(label.split('-')[0]
+                                                                                            .rstrip('+')))},
+                'by_sector': {str(sector_id): self.by_sector[sector_id].summary()
+                              for sector_id in sorted(self.by_sector)},
+                'by_stage': {stage: self.by_stage[stage].summary() for stage in sorted(self.by_stage)}}
+
+    def report(self, file=None):
+        # print the latency table to the run log
+        summary = self.summary()
+        print('Decision latency (ms): %d epochs, %d over the %s ms deadline'
+              % (summary['epochs']['count'], summary['deadline_misses'], summary['deadline_ms']), file=file)
+        print('%12s %8s %10s %10s %10s %10s %10s' % ('', 'count', 'mean', 'p50', 'p95', 'p99', 'max'), file=file)
+        rows = [('all', summary['epochs'])]
+        rows += [('%s ac' % label, stats) for label, stats in summary['by_aircraft'].items()]
+        rows += [('sector %s' % sector_id, stats) for sector_id, stats in summary['by_sector'].items()]
+        rows += [('%s stage' % stage, stats) for stage, stats in summary['by_stage'].items()]
+        for name, stats in rows:
+            print('%12s %8d %10.2f %10.2f %10.2f %10.2f %10.2f'
+                  % (name, stats['count'], stats['mean'], stats['p50'], stats['p95'], stats['p99'], stats['max']),
+                  file=file)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
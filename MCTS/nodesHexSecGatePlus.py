@@ -1,4 +1,3 @@
-import copy
 import math
 import numpy as np
 # from shapely.geometry import Polygon, Point
@@ -6,12 +5,16 @@ import matplotlib.path as mpltPath
 
 from common import MCTSNode, MCTSState
 from config_hex_sec import Config
+from rng import GLOBAL_RNG
 
 
 # from config_multi import Config
 
 
 class MultiAircraftState(MCTSState):
+    __slots__ = ('config', 'index', 'init_action', 'sector_id', 'goal_exit_id', 'hit_wall', 'conflict', 'reach_goal',
+                 'reach_subgoal', 'prev_action', 'depth', 'frames', 'nearest_x', 'nearest_y')
+
     def __init__(self,
                  state,
                  index,
@@ -23,8 +26,13 @@ class MultiAircraftState(MCTSState):
                  reach_goal=False,
                  reach_subgoal=False,
                  prev_action=None,
-                 depth=0):
-        MCTSState.__init__(self, state)
+                 depth=0,
+                 frames=0,
+                 config=Config,
+                 rng=GLOBAL_RNG):
+        # config and rng: Config class and random number generator of the planner (see rng.py)
+        MCTSState.__init__(self, state, rng)
+        self.config = config
         self.index = index
         self.init_action = init_action
         self.sector_id = sector_id
@@ -35,9 +43,7 @@ class MultiAircraftState(MCTSState):
         self.reach_subgoal = reach_subgoal
         self.prev_action = prev_action
         self.depth = depth
-
-        self.G = Config.G
-        self.scale = Config.scale
+        self.frames = frames  # time steps simulated from the root of the search
 
         self.nearest_x = -1
         self.nearest_y = -1
@@ -83,18 +89,22 @@ class MultiAircraftState(MCTSState):
     def _move(self, a):
         # state: dimension: n by 8
         # [aircraft: x, y, vx, vy, v, heading, gx, gy]
-        state = copy.deepcopy(self.state)
+        config = self.config
+        rng = self.rng
+        state = self.state.copy()
         hit_wall = False
         conflict = False
         reach_goal = False
         reach_subgoal = self.reach_subgoal
 
-        for _ in range(Config.simulate_frame):
+        frames = 0
+        for _ in range(config.simulate_frame):
+            frames += 1
             for index in range(state.shape[0]):
-                heading = state[index, 5] + (a[index] - 1) * Config.d_heading \
-                          + np.random.normal(0, Config.heading_sigma)
-                speed = Config.init_speed + np.random.normal(0, Config.speed_sigma)
-                speed = max(Config.min_speed, min(speed, Config.max_speed))  # restrict to range
+                heading = state[index, 5] + (a[index] - 1) * config.d_heading \
+                          + rng.normal(0, config.heading_sigma)
+                speed = config.init_speed + rng.normal(0, config.speed_sigma)
+                speed = max(config.min_speed, min(speed, config.max_speed))  # restrict to range
                 vx = speed * math.cos(heading)
                 vy = speed * math.sin(heading)
                 state[index, 0] += vx
@@ -110,30 +120,30 @@ class MultiAircraftState(MCTSState):
             goalx = state[self.index][6]
             goaly = state[self.index][7]
 
-            # if self.dist_intruder(state, ownx, owny) < Config.minimum_separation:
+            # if self.dist_intruder(state, ownx, owny) < config.minimum_separation:
             if self.conflict_intruder(state, ownx, owny):
                 conflict = True
                 break
 
             # if not sub goal and aircraft reaches goal
-            if self.goal_exit_id == -1 and self.metric(ownx, owny, goalx, goaly) < Config.goal_radius:
+            if self.goal_exit_id == -1 and self.metric(ownx, owny, goalx, goaly) < config.goal_radius:
                 reach_goal = True
                 break
 
             # if aircraft close to sector exit gate, sub_goal = True
             if not self.goal_exit_id == -1 and \
                 pnt2line(np.array([ownx, owny]),
-                         Config.sector_len_exits[self.sector_id][self.goal_exit_id][1],
-                         Config.sector_len_exits[self.sector_id][self.goal_exit_id][2])[0] < 4:
+                         config.sector_len_exits[self.sector_id][self.goal_exit_id][1],
+                         config.sector_len_exits[self.sector_id][self.goal_exit_id][2])[0] < 4:
                 reach_subgoal = True
 
-            # if not Polygon(Config.sector_vertices[self.sector_id]).contains(Point(ownx, owny)) and not reach_subgoal:
-            # if not self.in_hull([ownx, owny], Config.sector_vertices[self.sector_id]) and not reach_subgoal:
-            if not mpltPath.Path(Config.sector_vertices[self.sector_id]).contains_point([ownx, owny]) and not reach_subgoal:
+            # if not Polygon(config.sector_vertices[self.sector_id]).contains(Point(ownx, owny)) and not reach_subgoal:
+            # if not self.in_hull([ownx, owny], config.sector_vertices[self.sector_id]) and not reach_subgoal:
+            if not mpltPath.Path(config.sector_vertices[self.sector_id]).contains_point([ownx, owny]) and not reach_subgoal:
                 hit_wall = True
                 break
 
-            # if self.dist_entries(ownx, owny, Config.sector_entries[self.sector_id]) < 2 * Config.minimum_separation:
+            # if self.dist_entries(ownx, owny, config.sector_entries[self.sector_id]) < 2 * config.minimum_separation:
             #     hit_wall = True
             #     break
 
@@ -147,7 +157,10 @@ class MultiAircraftState(MCTSState):
                                   reach_goal=reach_goal,
                                   reach_subgoal=reach_subgoal,
                                   prev_action=a,
-                                  depth=self.depth + 1)
+                                  depth=self.depth + 1,
+                                  frames=self.frames + frames,
+                                  config=config,
+                                  rng=rng)
         return MultiAircraftState(state, self.index, 'random', hit_wall, conflict, reach_goal, a, self.depth + 1)
 
     # def in_hull(self, p, hull):
@@ -234,7 +247,7 @@ class MultiAircraftState(MCTSState):
             otherx = state[i][0]
             othery = state[i][1]
             dist = self.metric(ownx, owny, otherx, othery)
-            if dist < Config.minimum_separation:
+            if dist < self.config.minimum_separation:
                 return True
         return False
 
@@ -255,6 +268,17 @@ class MultiAircraftState(MCTSState):
         dy = y1 - y2
         return math.sqrt(dx ** 2 + dy ** 2)
 
+    @property
+    def num_aircraft(self):
+        return self.state.shape[0]
+
+    def full_state(self):
+        return self.state
+
+    def branch(self, a):
+        # move of a new node by expand (a new sampled future for compact states)
+        return self.move(a)
+
     # state: (x, y, vx, vy, heading angle, gx, gy)
     @property
     def ownx(self):
@@ -289,7 +313,212 @@ class MultiAircraftState(MCTSState):
         return s
 
 
+class SharedFutures:
+    """
+    sampled futures of all aircraft of an observation, flown once and shared by the search trees of compact
+    states. rows[k, f] is the n by 8 state of the k-th of samples futures after f time steps (float32).
+    random_moves=False: every aircraft keeps its init_action (one future for the search of one ownship).
+    random_moves=True: init_action for the first move (simulate_frame time steps), then an action drawn at random
+    every move, as the other aircraft move in MultiAircraftState searches (futures of a whole sector).
+    """
+    __slots__ = ('rows', 'drawn')
+
+    def __init__(self, state, init_action, frames, samples=1, random_moves=False, config=Config, rng=GLOBAL_RNG):
+        n = state.shape[0]
+        rows = np.empty((samples, frames + 1, n, 8), dtype=np.float32)
+        rows[:, 0] = state
+        rows[:, :, :, 6:] = state[:, 6:]
+        x = np.repeat(state[None, :, 0], samples, axis=0)
+        y = np.repeat(state[None, :, 1], samples, axis=0)
+        heading = np.repeat(state[None, :, 5], samples, axis=0)
+        turns = np.repeat((np.asarray(init_action)[None, :] - 1) * config.d_heading, samples, axis=0)
+        # the same noise model as MultiAircraftState._move, one frame of every future at a time
+        for f in range(1, frames + 1):
+            if random_moves and f > config.simulate_frame and (f - 1) % config.simulate_frame == 0:
+                turns = (rng.integers(0, 3, size=(samples, n)) - 1) * config.d_heading
+            heading = heading + turns + rng.normal(0, config.heading_sigma, size=(samples, n))
+            speed = np.clip(config.init_speed + rng.normal(0, config.speed_sigma, size=(samples, n)),
+                            config.min_speed, config.max_speed)
+            vx = speed * np.cos(heading)
+            vy = speed * np.sin(heading)
+            x = x + vx
+            y = y + vy
+            rows[:, f, :, 0] = x
+            rows[:, f, :, 1] = y
+            rows[:, f, :, 2] = vx
+            rows[:, f, :, 3] = vy
+            rows[:, f, :, 4] = speed
+            rows[:, f, :, 5] = heading
+        self.rows = rows
+        self.drawn = 0
+
+    @property
+    def samples(self):
+        return self.rows.shape[0]
+
+    @property
+    def nbytes(self):
+        return self.rows.nbytes
+
+    def next_sample(self):
+        # futures are handed out in turn to the simulations of the searches
+        self.drawn += 1
+        return self.drawn % self.rows.shape[0]
+
+    def intruders(self, index, columns=None):
+        # positions of the other aircraft in every future (samples, frames + 1, m, 2), for the separation checks
+        # of ownship index (a row of columns, the rows of the observation in the search, all by default)
+        positions = self.rows[:, :, :, :2] if columns is None else self.rows[:, :, columns, :2]
+        return np.ascontiguousarray(np.delete(positions, index, axis=2))
+
+
+class CompactAircraftState(MultiAircraftState):
+    """
+    search state that keeps only the ownship row (float32, in state) and references to futures of the other
+    aircraft shared by the search tree (or by all searches of a sector), instead of a copy of all n rows per
+    node. Only the ownship is simulated. Each simulation flies against one of the futures: the sample is
+    drawn once, when the simulation expands a new node (branch), and kept by the rollout from it (move). The
+    nodes of the selection path keep the sample they were expanded with. full_state() rebuilds the n by 8
+    state.
+    """
+    __slots__ = ('futures', 'intruders', 'columns', 'sample', 'n')
+
+    def __init__(self, own, futures, intruders, columns, sample, n, index, init_action, sector_id, goal_exit_id,
+                 hit_wall=False, conflict=False, reach_goal=False, reach_subgoal=False, prev_action=None, depth=0,
+                 frames=0, config=Config, rng=GLOBAL_RNG):
+        MultiAircraftState.__init__(self, own, index, init_action, sector_id, goal_exit_id, hit_wall, conflict,
+                                    reach_goal, reach_subgoal, prev_action, depth, frames, config, rng)
+        self.futures = futures
+        self.intruders = intruders
+        self.columns = columns
+        self.sample = sample
+        self.n = n
+
+    @property
+    def num_aircraft(self):
+        return self.n
+
+    def full_state(self):
+        state = self.futures.rows[self.sample, self.frames]
+        state = state.copy() if self.columns is None else state[self.columns]
+        state[self.index] = self.state
+        return state
+
+    def branch(self, a):
+        return self._move(a, self.futures.next_sample())
+
+    def _move(self, a, sample=None):
+        config = self.config
+        rng = self.rng
+        sample = self.sample if sample is None else sample
+        x, y, _, _, speed, heading, goalx, goaly = self.state.tolist()
+        intruders = self.intruders[sample]
+        hit_wall = False
+        conflict = False
+        reach_goal = False
+        reach_subgoal = self.reach_subgoal
+        path = mpltPath.Path(config.sector_vertices[self.sector_id])
+        gate = config.sector_len_exits[self.sector_id][self.goal_exit_id] if self.goal_exit_id != -1 else None
+
+        frames = 0
+        for _ in range(config.simulate_frame):
+            frames += 1
+            heading = heading + (a[self.index] - 1) * config.d_heading + rng.normal(0, config.heading_sigma)
+            speed = config.init_speed + rng.normal(0, config.speed_sigma)
+            speed = max(config.min_speed, min(speed, config.max_speed))  # restrict to range
+            vx = speed * math.cos(heading)
+            vy = speed * math.sin(heading)
+            x += vx
+            y += vy
+
+            others = intruders[min(self.frames + frames, intruders.shape[0] - 1)]
+            if others.shape[0] and (np.square(others[:, 0] - x) + np.square(others[:, 1] - y)).min() \
+                    < config.minimum_separation ** 2:
+                conflict = True
+                break
+
+            if self.goal_exit_id == -1 and self.metric(x, y, goalx, goaly) < config.goal_radius:
+                reach_goal = True
+                break
+
+            if not self.goal_exit_id == -1 and pnt2line(np.array([x, y]), gate[1], gate[2])[0] < 4:
+                reach_subgoal = True
+
+            if not path.contains_point([x, y]) and not reach_subgoal:
+                hit_wall = True
+                break
+
+        return CompactAircraftState(own=np.array([x, y, vx, vy, speed, heading, goalx, goaly], dtype=np.float32),
+                                    futures=self.futures,
+                                    intruders=self.intruders,
+                                    columns=self.columns,
+                                    sample=sample,
+                                    n=self.n,
+                                    index=self.index,
+                                    init_action='random',
+                                    sector_id=self.sector_id,
+                                    goal_exit_id=self.goal_exit_id,
+                                    hit_wall=hit_wall,
+                                    conflict=conflict,
+                                    reach_goal=reach_goal,
+                                    reach_subgoal=reach_subgoal,
+                                    prev_action=a,
+                                    depth=self.depth + 1,
+                                    frames=self.frames + frames,
+                                    config=config,
+                                    rng=rng)
+
+    def dist_intruder(self, state, ownx, owny):
+        return MultiAircraftState.dist_intruder(self, self.full_state(), ownx, owny)
+
+    @property
+    def ownx(self):
+        return self.state[0]
+
+    @property
+    def owny(self):
+        return self.state[1]
+
+    @property
+    def goalx(self):
+        return self.state[6]
+
+    @property
+    def goaly(self):
+        return self.state[7]
+
+
+def sector_futures(state, init_action, config=Config, rng=GLOBAL_RNG):
+    """
+    config.sector_futures sampled futures of every aircraft of a sector observation, long enough for the deepest
+    search, to share between the searches of all ownships of the sector (make_root_state(futures=...))
+    """
+    frames = max(config.search_depth, config.search_depth_lite) * config.simulate_frame
+    return SharedFutures(state, init_action, frames, config.sector_futures, True, config, rng)
+
+
+def make_root_state(state, index, init_action, sector_id, goal_exit_id, search_depth, config=Config,
+                    rng=GLOBAL_RNG, futures=None, columns=None):
+    """
+    root of the search of ownship index: a CompactAircraftState flying against futures (sector_futures() of the
+    observation, state being its rows columns) if given, against one future of search_depth moves of its own
+    if config.compact_nodes, otherwise a MultiAircraftState
+    """
+    if futures is None:
+        if not config.compact_nodes:
+            return MultiAircraftState(state=state, index=index, init_action=init_action, sector_id=sector_id,
+                                      goal_exit_id=goal_exit_id, config=config, rng=rng)
+        futures = SharedFutures(state, init_action, search_depth * config.simulate_frame, config=config, rng=rng)
+        columns = None
+    return CompactAircraftState(own=state[index].astype(np.float32), futures=futures,
+                                intruders=futures.intruders(index, columns), columns=columns, sample=0,
+                                n=state.shape[0], index=index, init_action=init_action, sector_id=sector_id,
+                                goal_exit_id=goal_exit_id, config=config, rng=rng)
+
+
 class MultiAircraftNode(MCTSNode):
+    __slots__ = ('state', '_untried_actions')
+
     def __init__(self, state: MultiAircraftState, parent=None):
         MCTSNode.__init__(self, parent)
         self.state = state
@@ -304,15 +533,19 @@ class MultiAircraftNode(MCTSNode):
     def reward(self):
         return self.q / self.n if self.n else 0
 
-    def expand(self):
-        a = self.untried_actions.pop()
-        if self.state.init_action == 'random':
-            all_action = np.random.randint(0, 3, size=self.state.state.shape[0])
+    def expand(self, a=None):
+        # child of ownship action a, the last untried action by default
+        if a is None:
+            a = self.untried_actions.pop()
+        else:
+            self.untried_actions.remove(a)
+        if isinstance(self.state.init_action, str):  # 'random'
+            all_action = self.state.rng.integers(0, 3, size=self.state.num_aircraft)
             # print('rand1')
         else:
             all_action = self.state.init_action.copy()
         all_action[self.state.index] = a
-        next_state = self.state.move(all_action)
+        next_state = self.state.branch(all_action)
         child_node = MultiAircraftNode(next_state, parent=self)
         self.children.append(child_node)
         return child_node
@@ -321,13 +554,19 @@ class MultiAircraftNode(MCTSNode):
         return self.state.is_terminal_state(search_depth)
 
     def rollout(self, search_depth):
+        return self.rollout_state(search_depth).reward()
+
+    def rollout_state(self, search_depth):
+        # terminal state of a random rollout from this node
+        # (the node was just expanded by this simulation, or is terminal: the rollout keeps the sampled future
+        # drawn by expand, with move)
         current_rollout_state = self.state
         while not current_rollout_state.is_terminal_state(search_depth):
             # possible_moves = current_rollout_state.get_legal_actions()
             # action = self.rollout_policy(possible_moves)
-            action = np.random.randint(0, 3, size=self.state.state.shape[0])
+            action = self.state.rng.integers(0, 3, size=self.state.num_aircraft)
             current_rollout_state = current_rollout_state.move(action)
-        return current_rollout_state.reward()
+        return current_rollout_state
 
     def backpropagate(self, result):
         self.n += 1
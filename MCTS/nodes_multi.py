@@ -1,13 +1,15 @@
-import copy
 import math
-import numpy as np
 
 from common import MCTSNode, MCTSState
 from config_vertiport import Config
+from rng import GLOBAL_RNG
 # from config_multi import Config
 
 
 class MultiAircraftState(MCTSState):
+    __slots__ = ('config', 'index', 'init_action', 'hit_wall', 'conflict', 'reach_goal', 'prev_action', 'depth',
+                 'frames', 'nearest_x', 'nearest_y')
+
     def __init__(self,
                  state,
                  index,
@@ -16,8 +18,13 @@ class MultiAircraftState(MCTSState):
                  conflict=False,
                  reach_goal=False,
                  prev_action=None,
-                 depth=0):
-        MCTSState.__init__(self, state)
+                 depth=0,
+                 frames=0,
+                 config=Config,
+                 rng=GLOBAL_RNG):
+        # config and rng: Config class and random number generator of the planner (see rng.py)
+        MCTSState.__init__(self, state, rng)
+        self.config = config
         self.index = index
         self.init_action = init_action
         self.hit_wall = hit_wall
@@ -25,9 +32,7 @@ class MultiAircraftState(MCTSState):
         self.reach_goal = reach_goal
         self.prev_action = prev_action
         self.depth = depth
-
-        self.G = Config.G
-        self.scale = Config.scale
+        self.frames = frames  # time steps simulated from the root of the search
 
         self.nearest_x = -1
         self.nearest_y = -1
@@ -62,16 +67,20 @@ class MultiAircraftState(MCTSState):
     def _move(self, a):
         # state: dimension: n by 8
         # [aircraft: x, y, vx, vy, v, heading, gx, gy]
-        state = copy.deepcopy(self.state)
+        config = self.config
+        rng = self.rng
+        state = self.state.copy()
         hit_wall = False
         conflict = False
         reach_goal = False
 
-        for _ in range(Config.simulate_frame):
+        frames = 0
+        for _ in range(config.simulate_frame):
+            frames += 1
             for index in range(state.shape[0]):
-                heading = state[index, 5] + (a[index] - 1) * Config.d_heading  # degree
-                speed = state[index, 4] + np.random.normal(0, Config.speed_sigma)
-                speed = max(Config.min_speed, min(speed, Config.max_speed))  # project to range
+                heading = state[index, 5] + (a[index] - 1) * config.d_heading  # degree
+                speed = state[index, 4] + rng.normal(0, config.speed_sigma)
+                speed = max(config.min_speed, min(speed, config.max_speed))  # project to range
                 vx = speed * math.cos(heading)
                 vy = speed * math.sin(heading)
                 state[index, 0] += vx
@@ -87,18 +96,19 @@ class MultiAircraftState(MCTSState):
             goalx = state[self.index][6]
             goaly = state[self.index][7]
 
-            if not 0 < ownx < Config.window_width or not 0 < owny < Config.window_height:
+            if not 0 < ownx < config.window_width or not 0 < owny < config.window_height:
                 hit_wall = True
                 break
 
-            if self.dist_intruder(state, ownx, owny) < Config.minimum_separation:
+            if self.dist_intruder(state, ownx, owny) < config.minimum_separation:
                 conflict = True
                 break
 
-            if self.metric(ownx, owny, goalx, goaly) < Config.goal_radius:
+            if self.metric(ownx, owny, goalx, goaly) < config.goal_radius:
                 reach_goal = True
 
-        return MultiAircraftState(state, self.index, 'random', hit_wall, conflict, reach_goal, a, self.depth+1)
+        return MultiAircraftState(state, self.index, 'random', hit_wall, conflict, reach_goal, a, self.depth+1,
+                                  self.frames + frames, config, rng)
 
     def get_legal_actions(self):
         return [0, 1, 2]
@@ -125,6 +135,13 @@ class MultiAircraftState(MCTSState):
         dy = y1 - y2
         return math.sqrt(dx**2 + dy**2)
 
+    @property
+    def num_aircraft(self):
+        return self.state.shape[0]
+
+    def full_state(self):
+        return self.state
+
     # state: (x, y, vx, vy, heading angle, gx, gy)
     @property
     def ownx(self):
@@ -160,6 +177,8 @@ class MultiAircraftState(MCTSState):
 
 
 class MultiAircraftNode(MCTSNode):
+    __slots__ = ('state', '_untried_actions')
+
     def __init__(self, state: MultiAircraftState, parent=None):
         MCTSNode.__init__(self, parent)
         self.state = state
@@ -174,10 +193,14 @@ class MultiAircraftNode(MCTSNode):
     def reward(self):
         return self.q / self.n if self.n else 0
 
-    def expand(self):
-        a = self.untried_actions.pop()
-        if self.state.init_action == 'random':
-            all_action = np.random.randint(0, 3, size=self.state.state.shape[0])
+    def expand(self, a=None):
+        # child of ownship action a, the last untried action by default
+        if a is None:
+            a = self.untried_actions.pop()
+        else:
+            self.untried_actions.remove(a)
+        if isinstance(self.state.init_action, str):  # 'random'
+            all_action = self.state.rng.integers(0, 3, size=self.state.num_aircraft)
             # print('rand1')
         else:
             all_action = self.state.init_action.copy()
@@ -191,13 +214,17 @@ class MultiAircraftNode(MCTSNode):
         return self.state.is_terminal_state(search_depth)
 
     def rollout(self, search_depth):
+        return self.rollout_state(search_depth).reward()
+
+    def rollout_state(self, search_depth):
+        # terminal state of a random rollout from this node
         current_rollout_state = self.state
         while not current_rollout_state.is_terminal_state(search_depth):
             # possible_moves = current_rollout_state.get_legal_actions()
             # action = self.rollout_policy(possible_moves)
-            action = np.random.randint(0, 3, size=self.state.state.shape[0])
+            action = self.state.rng.integers(0, 3, size=self.state.num_aircraft)
             current_rollout_state = current_rollout_state.move(action)
-        return current_rollout_state.reward()
+        return current_rollout_state
 
     def backpropagate(self, result):
         self.n += 1
@@ -0,0 +1,155 @@
+"""
+Prior and value network of the PUCT search.
+
+PolicyValueNet is a small NumPy-only MLP: an ownship-centric encoding of an encounter (encode) goes through two
+tanh hidden layers into a policy head (priors of the 3 actions, softmax) and a value head (expected reward of
+the search, sigmoid, in [0, 1] like MultiAircraftState.reward()). Inputs are evaluated in batches, one matrix
+product per layer for all leaves of a search batch. Weights are stored in .npz files (save/load).
+
+    python policy_net.py --init weights.npz --hidden 64    writes randomly initialized weights
+"""
+
+import argparse
+import math
+
+import numpy as np
+
+# intruders in the encoding, nearest first
+NUM_INTRUDERS = 4
+# ownship features, then features of each intruder
+OWN_FEATURES = 4
+INTRUDER_FEATURES = 5
+INPUT_SIZE = OWN_FEATURES + NUM_INTRUDERS * INTRUDER_FEATURES
+
+
+def encode(rows, index, config, out=None):
+    """
+    ownship-centric encoding of aircraft index of the state rows (x, y, vx, vy, speed, heading, gx, gy):
+        distance to the goal (in window widths), cos and sin of the goal bearing relative to the heading,
+        speed scaled to [0, 1] over the speed range
+    and for each of the NUM_INTRUDERS nearest other aircraft (zeros when there are fewer):
+        position and velocity relative to the ownship in its heading frame (in 10 minimum separations and in
+        max speeds), and 1 for a present intruder
+    """
+    out = np.zeros(INPUT_SIZE) if out is None else out
+    own = rows[index]
+    heading = own[5]
+    cos_h, sin_h = math.cos(heading), math.sin(heading)
+    goal_dx, goal_dy = own[6] - own[0], own[7] - own[1]
+    goal_dist = math.hypot(goal_dx, goal_dy)
+    out[0] = goal_dist / config.window_width
+    if goal_dist > 0:
+        out[1] = (goal_dx * cos_h + goal_dy * sin_h) / goal_dist
+        out[2] = (goal_dy * cos_h - goal_dx * sin_h) / goal_dist
+    else:
+        out[1] = 1.
+        out[2] = 0.
+    out[3] = (own[4] - config.min_speed) / (config.max_speed - config.min_speed)
+
+    out[OWN_FEATURES:] = 0.
+    if rows.shape[0] > 1:
+        dx = rows[:, 0] - own[0]
+        dy = rows[:, 1] - own[1]
+        dist = np.hypot(dx, dy)
+        dist[index] = np.inf
+        nearest = np.argsort(dist)[:min(NUM_INTRUDERS, rows.shape[0] - 1)]
+        position_scale = 1. / (10 * config.minimum_separation)
+        speed_scale = 1. / config.max_speed
+        dvx = rows[nearest, 2] - own[2]
+        dvy = rows[nearest, 3] - own[3]
+        intruders = out[OWN_FEATURES:].reshape(NUM_INTRUDERS, INTRUDER_FEATURES)
+        k = nearest.shape[0]
+        intruders[:k, 0] = (dx[nearest] * cos_h + dy[nearest] * sin_h) * position_scale
+        intruders[:k, 1] = (dy[nearest] * cos_h - dx[nearest] * sin_h) * position_scale
+        intruders[:k, 2] = (dvx * cos_h + dvy * sin_h) * speed_scale
+        intruders[:k, 3] = (dvy * cos_h - dvx * sin_h) * speed_scale
+        intruders[:k, 4] = 1.
+    return out
+
+
+def encode_states(states, out=None):
+    # encodings of search states (MultiAircraftState or CompactAircraftState) as a (len(states), INPUT_SIZE) array
+    out = np.zeros((len(states), INPUT_SIZE)) if out is None else out[:len(states)]
+    for k, state in enumerate(states):
+        encode(state.full_state(), state.index, state.config, out[k])
+    return out
+
+
+class PolicyValueNet:
+    """
+    MLP INPUT_SIZE -> hidden -> hidden (tanh) -> 3 action logits and 1 value logit
+    """
+
+    def __init__(self, weights):
+        self.w1, self.b1 = weights['w1'], weights['b1']
+        self.w2, self.b2 = weights['w2'], weights['b2']
+        self.w_policy, self.b_policy = weights['w_policy'], weights['b_policy']
+        self.w_value, self.b_value = weights['w_value'], weights['b_value']
+        if self.w1.shape[0] != INPUT_SIZE:
+            raise ValueError('weights for %d inputs, the encoding has %d' % (self.w1.shape[0], INPUT_SIZE))
+
+    @classmethod
+    def random(cls, hidden=64, seed=None):
+        rng = np.random.default_rng(seed)
+
+        def layer(n_in, n_out):
+            return rng.normal(0, 1 / math.sqrt(n_in), size=(n_in, n_out)), np.zeros(n_out)
+        weights = {}
+        weights['w1'], weights['b1'] = layer(INPUT_SIZE, hidden)
+        weights['w2'], weights['b2'] = layer(hidden, hidden)
+        weights['w_policy'], weights['b_policy'] = layer(hidden, 3)
+        weights['w_value'], weights['b_value'] = layer(hidden, 1)
+        return cls(weights)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as weights:
+            return cls({key: weights[key] for key in weights.files})
+
+    def weights(self):
+        return {'w1': self.w1, 'b1': self.b1, 'w2': self.w2, 'b2': self.b2, 'w_policy': self.w_policy,
+                'b_policy': self.b_policy, 'w_value': self.w_value, 'b_value': self.b_value}
+
+    def save(self, path):
+        np.savez(path, **self.weights())
+
+    def forward(self, x):
+        # hidden activations and the policy and value logits of the (batch, INPUT_SIZE) inputs x
+        h1 = np.tanh(x @ self.w1 + self.b1)
+        h2 = np.tanh(h1 @ self.w2 + self.b2)
+        return h1, h2, h2 @ self.w_policy + self.b_policy, (h2 @ self.w_value + self.b_value)[:, 0]
+
+    def evaluate(self, x):
+        """
+        action priors (batch, 3) and values (batch,) of the (batch, INPUT_SIZE) inputs x
+        """
+        _, _, logits, value_logits = self.forward(np.atleast_2d(x))
+        logits = logits - logits.max(axis=1, keepdims=True)
+        priors = np.exp(logits)
+        priors /= priors.sum(axis=1, keepdims=True)
+        return priors, 1. / (1. + np.exp(-value_logits))
+
+
+# networks loaded by load_cached, by path
+networks = {}
+
+
+def load_cached(path):
+    # the network of a weights file, loaded once per process
+    if path not in networks:
+        networks[path] = PolicyValueNet.load(path)
+    return networks[path]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--init', type=str, required=True, help='write randomly initialized weights to this file')
+    parser.add_argument('--hidden', type=int, default=64)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    PolicyValueNet.random(args.hidden, args.seed).save(args.init)
+    print('weights written to', args.init)
+
+
+if __name__ == '__main__':
+    main()
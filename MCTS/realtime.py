@@ -0,0 +1,228 @@
+"""
+Real-time guidance loop.
+
+The drivers stop the simulation while they plan. RealtimeController keeps the simulator running on a clock
+and plans in an executor at the same time: at each decision epoch the planner gets the observation predicted
+for the moment its plan is expected to be ready, and the aircraft keep flying their last command meanwhile.
+A plan is applied as soon as it is ready, unless it is older than max_age time steps (stale, discarded).
+An epoch that comes while the planner is still busy is late and the aircraft keep their last command.
+
+clock='wall': a time step lasts step_ms of wall time and the planner runs concurrently with the simulator.
+clock='simulated': the simulator does not wait, the measured compute time of a plan is converted into time
+steps (step_ms per step) and the plan is applied that many steps after it was started, so runs take the
+compute time of the planner only and still see its latency.
+"""
+
+import argparse
+import asyncio
+import importlib
+import math
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.extend(['../Simulators'])
+from experiment_runner import CASES
+from latency import LatencyRecorder
+from rng import GLOBAL_RNG, spawn_rngs
+from run_logger import RunLogger, env_record
+
+
+def predicted_observation(env, action_by_id, steps):
+    """
+    the observation of env steps time steps ahead, every aircraft flying its action in action_by_id (straight
+    without one) without noise. The simulator is left as it was
+    """
+    fleet = list(env.aircraft_dict.ac_dict.values())
+    saved = [(aircraft.position.copy(), aircraft.velocity, aircraft.heading) for aircraft in fleet]
+    row_ids = getattr(env, 'ob_row_ids', None)
+    try:
+        for aircraft in fleet:
+            turn = (action_by_id.get(aircraft.id, 1) - 1) * env.config.d_heading
+            for _ in range(steps):
+                aircraft.heading += turn
+                aircraft.velocity = aircraft.speed * np.array([math.cos(aircraft.heading), math.sin(aircraft.heading)])
+                aircraft.position += aircraft.velocity
+        return env._get_ob()
+    finally:
+        for aircraft, (position, velocity, heading) in zip(fleet, saved):
+            aircraft.position[:] = position
+            aircraft.velocity = velocity
+            aircraft.heading = heading
+        if row_ids is not None:
+            env.ob_row_ids = row_ids
+
+
+def plan(case, driver, observation, info, config, rng):
+    # one decision epoch of the driver of case, return the actions and the compute time (ms)
+    time_before = time.perf_counter()
+    if case == 'vertiport':
+        ob, id_list = observation
+        action_by_id = driver.plan_epoch(ob, id_list, info, None, config, rng)[0]
+    else:
+        action_by_id = driver.plan_epoch(observation, info, None, None, config, rng)[0]
+    return action_by_id, (time.perf_counter() - time_before) * 1000
+
+
+class RealtimeController:
+    """
+    guidance loop of env with the planner of case (see experiment_runner.CASES) running in executor (a single
+    planner thread by default). config and rng: Config class and random number generator of the planner.
+    logger: RunLogger of the plan events, or None
+    """
+
+    def __init__(self, case, env, config, rng=GLOBAL_RNG, clock='simulated', step_ms=1000., max_age=10,
+                 executor=None, logger=None):
+        if clock not in ('simulated', 'wall'):
+            raise ValueError('clock must be simulated or wall, not %r' % clock)
+        self.case = case
+        self.driver = importlib.import_module(CASES[case][0])
+        self.env = env
+        self.config = config
+        self.rng = rng
+        self.clock = clock
+        self.step_ms = step_ms
+        self.max_age = max_age
+        self.executor = executor if executor is not None else ThreadPoolExecutor(1)
+        self.logger = logger
+
+        self.action_by_id = {}  # last command
+        self.pending = None  # plan in flight: [future, started step, ready step (simulated clock)]
+        self.lead = 1  # time steps between the start and the application of a plan, from the last one
+        self.latency = LatencyRecorder(config.decision_deadline)
+        self.plans = 0
+        self.applied = 0
+        self.stale = 0
+        self.late = 0
+        self.busy_ms = 0.
+
+    def log(self, event, step, **fields):
+        if self.logger is not None:
+            fields.update(event=event, step=step)
+            self.logger.log(fields)
+
+    def start_plan(self, step, observation, info):
+        if self.pending is not None:
+            # the planner is still busy with the last epoch, the aircraft keep their last command
+            self.late += 1
+            self.log('late', step, started=self.pending[1])
+            return
+        if self.case == 'vertiport' and observation[0].shape[0] == 0:
+            return
+        observation = predicted_observation(self.env, self.action_by_id, self.lead)
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, plan, self.case, self.driver, observation, info, self.config,
+                                      self.rng)
+        self.pending = [future, step, None]
+        self.plans += 1
+
+    async def collect_plan(self, step):
+        # apply the plan in flight if it is ready at this time step
+        if self.pending is None:
+            return
+        future, started, ready = self.pending
+        if self.clock == 'simulated':
+            if ready is None:
+                # the simulator waits for the plan, which is then ready after its compute time in time steps
+                await future
+                ready = started + max(1, math.ceil(future.result()[1] / self.step_ms))
+                self.pending[2] = ready
+            if step < ready:
+                return
+        elif not future.done():
+            return
+        self.pending = None
+        action_by_id, ms = future.result()
+        age = step - started
+        self.busy_ms += ms
+        self.latency.record_epoch(ms, self.env.aircraft_dict.num_aircraft)
+        self.lead = min(max(1, math.ceil(ms / self.step_ms)), self.max_age)
+        if age > self.max_age:
+            self.stale += 1
+            self.log('stale', step, started=started, age=age, ms=ms)
+            return
+        self.action_by_id = action_by_id
+        self.applied += 1
+        self.log('applied', step, started=started, age=age, ms=ms)
+
+    async def run(self, max_steps):
+        """
+        run one episode of at most max_steps time steps, return its metrics
+        """
+        env = self.env
+        observation = env.reset()
+        info = None
+        near_end = False
+        wall_before = time.time()
+        start = asyncio.get_running_loop().time()
+        # the vertiport planner needs the distances (info) of a first time step, as in its driver
+        step = 1 if self.case == 'vertiport' else 0
+        while step < max_steps:
+            if self.clock == 'wall':
+                await asyncio.sleep(max(0., start + step * self.step_ms / 1000. - asyncio.get_running_loop().time()))
+            await self.collect_plan(step)
+            if step % 5 == 0:
+                self.start_plan(step, observation, info)
+                if self.clock == 'simulated':
+                    # get the compute time of the plan, which tells when it is ready
+                    await self.collect_plan(step)
+
+            if self.case == 'vertiport':
+                observation, reward, done, info = env.step(self.action_by_id)
+            else:
+                observation, reward, done, info = env.step(self.action_by_id, near_end)
+                if env.id_tracker - 1 >= 10000:
+                    near_end = True
+            step += 1
+            if done or (step > 100 and env.aircraft_dict.num_aircraft == 0):
+                break
+
+        if self.pending is not None:
+            await self.pending[0]
+            self.pending = None
+        wall_s = time.time() - wall_before
+        decision = self.latency.epochs.summary()
+        return env_record(env, steps=step, clock=self.clock, step_ms=self.step_ms, plans=self.plans,
+                          applied=self.applied, stale=self.stale, late=self.late, decision_ms=decision['mean'],
+                          decision_ms_p95=decision['p95'], deadline_misses=self.latency.deadline_misses,
+                          planner_busy=self.busy_ms / 1000. / wall_s if self.clock == 'wall' else None,
+                          wall_s=wall_s)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--case', type=str, default='hex', choices=sorted(CASES))
+    parser.add_argument('--seed', type=int, default=2)
+    parser.add_argument('--max_steps', type=int, default=3600, help='time steps of the episode at most')
+    parser.add_argument('--clock', type=str, default='simulated', choices=['simulated', 'wall'])
+    parser.add_argument('--step_ms', type=float, default=1000.,
+                        help='duration of a time step in ms: wall time per step, or compute time that counts as one '
+                             'step with the simulated clock')
+    parser.add_argument('--max_age', type=int, default=10, help='plans older than this many time steps are discarded')
+    parser.add_argument('--log', type=str, default=None, help='write the plan events to this JSON-lines file')
+    args = parser.parse_args()
+
+    _, env_name, config_name = CASES[args.case]
+    Config = importlib.import_module(config_name).Config
+    MultiAircraftEnv = importlib.import_module(env_name).MultiAircraftEnv
+    env_rng, planner_rng = spawn_rngs(args.seed, 2)
+    env = MultiAircraftEnv(args.seed, config=Config, rng=env_rng)
+    logger = RunLogger(args.log) if args.log is not None else None
+
+    controller = RealtimeController(args.case, env, Config, planner_rng, args.clock, args.step_ms, args.max_age,
+                                    logger=logger)
+    metrics = asyncio.run(controller.run(args.max_steps))
+    controller.executor.shutdown()
+    env.close()
+    if logger is not None:
+        logger.close()
+
+    for key, value in metrics.items():
+        print('%s: %s' % (key, value))
+    controller.latency.report()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,154 @@
+import math
+import time
+
+from policy_net import encode_states
+
 # from nodes_multi import MultiAircraftNode
 # from nodes_secHex import MultiAircraftNode
 
+# rollout outcomes counted by SearchStats
+OUTCOMES = ('conflict', 'goal', 'wall', 'depth')
+
+
+class SearchStats:
+    """
+    opt-in counters and timers of the searches run with MCTS(root, stats). One record is appended to
+    searches per best_action call, epoch() sums the records of the decision epoch into the totals and starts
+    the next epoch.
+    """
+
+    def __init__(self):
+        self.searches = []  # records of the current epoch
+        self.totals = summarize_searches([])
+
+    def record(self, mcts, simulations, search_depth, expanded, frames, outcomes, times):
+        root = mcts.root
+        self.searches.append({
+            'simulations': simulations,
+            'search_depth': search_depth,
+            'expanded': expanded,
+            'tree_size': expanded + 1,
+            'rollout_frames': frames,
+            'outcomes': dict(zip(OUTCOMES, outcomes)),
+            'selection_ms': times[0] * 1000,
+            'expansion_ms': times[1] * 1000,
+            'rollout_ms': times[2] * 1000,
+            'backprop_ms': times[3] * 1000,
+            # visits of each action at the root
+            'root_visits': {int(child.state.prev_action[root.state.index]): child.n for child in root.children},
+        })
+
+    def epoch(self):
+        # summary of the searches of the epoch that ends
+        summary = summarize_searches(self.searches)
+        self.totals = add_summaries(self.totals, summary)
+        self.searches = []
+        return summary
+
+    def flat(self):
+        # totals as one level of 'search_*' numbers, for the run metrics
+        flat = {}
+        for key, value in self.totals.items():
+            if isinstance(value, dict):
+                for sub_key, sub_value in value.items():
+                    flat['search_%s_%s' % (key, sub_key)] = sub_value
+            else:
+                flat['search_' + key] = value
+        return flat
+
+
+def summarize_searches(searches):
+    summary = {'searches': len(searches)}
+    for key in ('simulations', 'expanded', 'tree_size', 'rollout_frames', 'selection_ms', 'expansion_ms',
+                'rollout_ms', 'backprop_ms'):
+        summary[key] = sum(search[key] for search in searches)
+    summary['outcomes'] = {outcome: sum(search['outcomes'][outcome] for search in searches) for outcome in OUTCOMES}
+    summary['root_visits'] = {action: sum(search['root_visits'].get(action, 0) for search in searches)
+                              for action in (0, 1, 2)}
+    return summary
+
+
+def add_summaries(a, b):
+    return {key: add_summaries(value, b[key]) if isinstance(value, dict) else value + b[key]
+            for key, value in a.items()}
+
 
 class MCTS:
+    """
+    search from the root node. With a PolicyValueNet net (policy_net.py) the search runs in PUCT mode
+    (best_action_puct): children are chosen with the priors of the network, and leaves are valued by the
+    network instead of random rollouts, leaf_batch leaves per network evaluation. root_eval: (priors, value)
+    of the root already evaluated, e.g. in one batch for all ownships of a sector
+    """
+
     # def __init__(self, node: MultiAircraftNode):
-    def __init__(self, node):
+    def __init__(self, node, stats=None, net=None, c_puct=1.5, leaf_batch=8, root_eval=None):
         self.root = node
+        self.stats = stats
+        self.net = net
+        self.c_puct = c_puct
+        self.leaf_batch = leaf_batch
+        self.priors = {}  # PUCT mode: action priors of the evaluated nodes
+        self.values = {}  # PUCT mode: network values of the evaluated nodes
+        if root_eval is not None:
+            self.priors[node] = root_eval[0]
+            node.n += 1
+            node.q += root_eval[1]
 
     def best_action(self, simulations, search_depth):
+        if self.net is not None:
+            return self.best_action_puct(simulations, search_depth)
+        if self.stats is not None:
+            return self.best_action_with_stats(simulations, search_depth)
         for _ in range(simulations):
             v = self.tree_policy(search_depth)
             reward = v.rollout(search_depth)
             v.backpropagate(reward)
         return self.root.best_child(c_param=0.)
 
+    def best_action_with_stats(self, simulations, search_depth):
+        # same search as best_action, timing each phase and counting the expansions and rollout outcomes
+        expanded = 0
+        frames = 0
+        outcomes = [0, 0, 0, 0]
+        times = [0., 0., 0., 0.]
+        for _ in range(simulations):
+            time_0 = time.perf_counter()
+            current_node = self.root
+            expand = False
+            while not current_node.is_terminal_node(search_depth):
+                if not current_node.is_fully_expanded():
+                    expand = True
+                    break
+                current_node = current_node.best_child()
+            time_1 = time.perf_counter()
+            if expand:
+                current_node = current_node.expand()
+                expanded += 1
+            time_2 = time.perf_counter()
+            terminal = current_node.rollout_state(search_depth)
+            reward = terminal.reward()
+            time_3 = time.perf_counter()
+            current_node.backpropagate(reward)
+            time_4 = time.perf_counter()
+
+            frames += terminal.frames - current_node.state.frames
+            if terminal.conflict:
+                outcomes[0] += 1
+            elif terminal.reach_goal:
+                outcomes[1] += 1
+            elif terminal.hit_wall:
+                outcomes[2] += 1
+            else:
+                outcomes[3] += 1
+            times[0] += time_1 - time_0
+            times[1] += time_2 - time_1
+            times[2] += time_3 - time_2
+            times[3] += time_4 - time_3
+
+        self.stats.record(self, simulations, search_depth, expanded, frames, outcomes, times)
+        return self.root.best_child(c_param=0.)
+
     def tree_policy(self, search_depth):
         current_node = self.root
         while not current_node.is_terminal_node(search_depth):
@@ -22,3 +157,110 @@ class MCTS:
             else:
                 current_node = current_node.best_child()
         return current_node
+
+    def best_action_puct(self, simulations, search_depth):
+        """
+        PUCT search: every simulation descends by the PUCT score until a node that was never evaluated (or a
+        terminal node), expanding at most one new child on the way. The leaves of up to leaf_batch simulations
+        are evaluated together and their value is added along the path. The path of a pending leaf holds a visit
+        without value and the descents skip pending leaves, so every leaf is evaluated once; the batch ends
+        early when every descent leads to a pending leaf. Return the most visited root child
+        """
+        expanded = 0
+        outcomes = [0, 0, 0, 0]
+        times = [0., 0., 0., 0.]
+        if self.root not in self.priors and not self.root.is_terminal_node(search_depth):
+            # without root_eval the root is evaluated on its own, every descent of a batch would stop at it
+            priors, values = self.net.evaluate(encode_states([self.root.state]))
+            self.priors[self.root] = priors[0]
+            self.root.n += 1
+            self.root.q += float(values[0])
+        done = 0
+        while done < simulations:
+            time_0 = time.perf_counter()
+            leaves = []
+            pending = set()
+            for _ in range(min(self.leaf_batch, simulations - done)):
+                leaf, new = self.select_puct(search_depth, pending)
+                if leaf is None:
+                    break
+                expanded += new
+                node = leaf
+                while node is not None:
+                    node.n += 1
+                    node = node.parent
+                leaves.append(leaf)
+                state = leaf.state
+                if not (state.is_terminal_state(search_depth) and
+                        (state.conflict or state.reach_goal or state.hit_wall)):
+                    pending.add(leaf)
+            time_1 = time.perf_counter()
+
+            values = [0.] * len(leaves)
+            evaluate = []
+            for k, leaf in enumerate(leaves):
+                state = leaf.state
+                if leaf not in pending:
+                    values[k] = state.reward()
+                    outcomes[0 if state.conflict else 1 if state.reach_goal else 2] += 1
+                elif leaf in self.values:
+                    # a leaf at the search depth, evaluated in an earlier batch
+                    values[k] = self.values[leaf]
+                    outcomes[3] += 1
+                else:
+                    evaluate.append(k)
+                    outcomes[3] += 1
+            if evaluate:
+                priors, leaf_values = self.net.evaluate(encode_states([leaves[k].state for k in evaluate]))
+                for j, k in enumerate(evaluate):
+                    self.priors[leaves[k]] = priors[j]
+                    self.values[leaves[k]] = values[k] = float(leaf_values[j])
+            time_2 = time.perf_counter()
+
+            for leaf, value in zip(leaves, values):
+                node = leaf
+                while node is not None:
+                    node.q += value
+                    node = node.parent
+            time_3 = time.perf_counter()
+            times[0] += time_1 - time_0
+            times[2] += time_2 - time_1
+            times[3] += time_3 - time_2
+            done += len(leaves)
+
+        if self.stats is not None:
+            self.stats.record(self, simulations, search_depth, expanded, 0, outcomes, times)
+        return max(self.root.children, key=lambda child: (child.n, child.q))
+
+    def select_puct(self, search_depth, pending=()):
+        # leaf of one PUCT descent, and 1 if it is a new child. Children in pending (leaves of the current
+        # batch) are skipped, (None, 0) when the descent has nowhere else to go
+        node = self.root
+        if node in pending:
+            return None, 0
+        while True:
+            if node.is_terminal_node(search_depth) or node not in self.priors:
+                return node, 0
+            priors = self.priors[node]
+            index = node.state.index
+            children = {int(child.state.prev_action[index]): child for child in node.children}
+            # unvisited children are valued at the mean of their parent
+            parent_value = node.q / node.n if node.n else 0.
+            scale = self.c_puct * math.sqrt(node.n)
+            best_score = -math.inf
+            for action in range(3):
+                child = children.get(action)
+                if child in pending:
+                    continue
+                if child is None or child.n == 0:
+                    score = parent_value + scale * priors[action]
+                else:
+                    score = child.q / child.n + scale * priors[action] / (1 + child.n)
+                if score > best_score:
+                    best_action, best_score = action, score
+            if best_score == -math.inf:
+                return None, 0
+            child = children.get(best_action)
+            if child is None:
+                return node.expand(best_action), 1
+            node = child
@@ -0,0 +1,237 @@
+"""
+Parameter sweeps of the planner and simulator configuration.
+
+Configurations come from a grid (--grid, every combination of {parameter: [values]}) and/or random draws
+(--random, {parameter: [low, high]} uniform, integers if both bounds are integers, or {"choice": [values]};
+--samples draws seeded with --sweep_seed). Every configuration runs on every seed x episode with the episode
+loop of experiment_runner.py, in a process pool. Each finished cell is cached as JSON under --cache_dir
+(MCTS/sweep_cache by default), keyed by the SHA-1 of the case, configuration, seed, episode, max_steps and the
+hash of the MCTS and Simulators sources. Rerunning the same sweep resumes it: cached cells are read back,
+failed or missing ones are run, and any source change invalidates the cache. The summary of every
+configuration and the Pareto front of throughput, decision time and pooled NMAC/h go to --output.
+
+    python sweep.py --grid '{"no_simulations": [50, 100], "search_depth": [2, 3]}' --max_steps 1800
+"""
+
+import argparse
+import glob
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import random
+
+from experiment_runner import run_task, summarize
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sweep_cache')
+SOURCE_DIRS = [os.path.dirname(os.path.abspath(__file__)),
+               os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Simulators')]
+
+# objectives of the Pareto front: (summary key, +1 to maximize / -1 to minimize)
+OBJECTIVES = [('throughput', 1), ('decision_ms', -1), ('NMAC/h pooled', -1)]
+
+
+def code_version():
+    # hash of the planner and simulator sources, a cell is recomputed when any of them changes
+    sha = hashlib.sha1()
+    for source_dir in SOURCE_DIRS:
+        for path in sorted(glob.glob(os.path.join(source_dir, '*.py'))):
+            sha.update(os.path.basename(path).encode())
+            with open(path, 'rb') as f:
+                sha.update(f.read())
+    return sha.hexdigest()[:12]
+
+
+def grid_space(grid):
+    # every combination of {parameter: [values]}
+    keys = sorted(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys))]
+
+
+def random_space(space, samples, seed=0):
+    """
+    samples configurations drawn from {parameter: [low, high]} (uniform, integers if both bounds are integers)
+    or {parameter: {"choice": [values]}}
+    """
+    rng = random.Random(seed)
+    variants = []
+    for _ in range(samples):
+        variant = {}
+        for key in sorted(space):
+            bounds = space[key]
+            if isinstance(bounds, dict):
+                variant[key] = rng.choice(bounds['choice'])
+            elif all(isinstance(bound, int) for bound in bounds):
+                variant[key] = rng.randint(bounds[0], bounds[1])
+            else:
+                variant[key] = rng.uniform(bounds[0], bounds[1])
+        variants.append(variant)
+    return variants
+
+
+def config_name(variant):
+    return ','.join('%s=%s' % (key, variant[key]) for key in sorted(variant)) or 'default'
+
+
+def cell_key(case, variant, seed, episode, max_steps, version):
+    # content address of one cell: the configuration, the episode and the code version
+    cell = {'case': case, 'variant': variant, 'seed': seed, 'episode': episode, 'max_steps': max_steps,
+            'code': version}
+    return hashlib.sha1(json.dumps(cell, sort_keys=True).encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    one JSON file per finished cell under cache_dir/<key[:2]>/<key>.json, written atomically so that an
+    interrupted sweep leaves only complete entries behind
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.json')
+
+    def get(self, key):
+        try:
+            with open(self.path(key)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def put(self, key, result):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(result, f)
+        os.replace(tmp_path, path)
+
+
+def pareto_front(points, objectives=OBJECTIVES):
+    """
+    names of the points ({name: summary}) that no other point beats on every objective
+    """
+    def score(summary):
+        values = []
+        for key, sign in objectives:
+            value = summary[key]
+            value = value['mean'] if isinstance(value, dict) else value
+            values.append(sign * value)
+        return values
+
+    scores = {name: score(summary) for name, summary in points.items()}
+    front = []
+    for name, own in scores.items():
+        dominated = any(all(o >= s for o, s in zip(other, own)) and other != own
+                        for other_name, other in scores.items() if other_name != name)
+        if not dominated:
+            front.append(name)
+    return front
+
+
+def run_sweep(case, variants, seeds, episodes, max_steps, workers=None, cache=None):
+    """
+    run every cell (variant x seed x episode) that is not in the cache, in a process pool, and return
+    {name: {'variant': ..., 'summary': ..., 'runs': [...]}} over the cached and new cells
+    """
+    cache = ResultCache() if cache is None else cache
+    version = code_version()
+
+    cells = {}
+    for variant in variants:
+        name = config_name(variant)
+        for seed in seeds:
+            for episode in range(1, episodes + 1):
+                key = cell_key(case, variant, seed, episode, max_steps, version)
+                cells[key] = (name, case, seed, episode, variant, max_steps)
+
+    results = {key: cache.get(key) for key in cells}
+    todo = [key for key, result in results.items() if result is None]
+    print('%d cells, %d cached, %d to run (code version %s)' % (len(cells), len(cells) - len(todo), len(todo),
+                                                               version))
+
+    if todo:
+        pool = multiprocessing.Pool(workers)
+        for done, (key, result) in enumerate(pool.imap_unordered(run_keyed_task, [(key, cells[key]) for key in todo]),
+                                             1):
+            if 'error' in result:
+                # failed cells are not cached, so that they are retried on resume
+                print('[%d/%d] %s seed %d episode %d failed: %s'
+                      % (done, len(todo), result['config'], result['seed'], result['episode'], result['error']))
+            else:
+                cache.put(key, result)
+                print('[%d/%d] %s seed %d episode %d: %d NMACs, %.1f ms'
+                      % (done, len(todo), result['config'], result['seed'], result['episode'],
+                         result['metrics']['NMACs'], result['metrics']['decision_ms']))
+            results[key] = result
+        pool.close()
+        pool.join()
+
+    output = {}
+    for key, (name, _, _, _, variant, _) in cells.items():
+        output.setdefault(name, {'variant': variant, 'runs': []})['runs'].append(results[key])
+    for name, result in output.items():
+        result['runs'].sort(key=lambda run: (run['seed'], run['episode']))
+        summary = summarize(result['runs'])
+        if summary['episodes'] > 0:
+            # aircraft reaching their goal per simulated hour
+            runs = [run['metrics'] for run in result['runs'] if 'metrics' in run]
+            summary['throughput'] = 3600. * sum(run['goals'] for run in runs) / sum(run['steps'] for run in runs)
+        result['summary'] = summary
+    return output
+
+
+def run_keyed_task(keyed_task):
+    key, task = keyed_task
+    return key, run_task(task)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--case', type=str, default='hex', choices=['hex', 'two_stage', 'vertiport'])
+    parser.add_argument('--grid', '-g', type=str, default=None,
+                        help='JSON dict of Config parameter values, e.g. \'{"no_simulations": [50, 100], '
+                             '"search_depth": [2, 3]}\'')
+    parser.add_argument('--random', type=str, default=None,
+                        help='JSON dict of Config parameter ranges, e.g. \'{"no_simulations": [20, 200], '
+                             '"time_interval_lower": {"choice": [30, 60]}}\'')
+    parser.add_argument('--samples', type=int, default=10, help='configurations drawn from --random')
+    parser.add_argument('--sweep_seed', type=int, default=0, help='seed of the --random draws')
+    parser.add_argument('--seeds', type=int, nargs='+', default=[2])
+    parser.add_argument('--episodes', '-e', type=int, default=1, help='episodes per seed')
+    parser.add_argument('--max_steps', type=int, default=3600)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--cache_dir', type=str, default=CACHE_DIR)
+    parser.add_argument('--output', '-o', type=str, default='output/sweep.json')
+    args = parser.parse_args()
+
+    variants = []
+    if args.grid is not None:
+        variants += grid_space(json.loads(args.grid))
+    if args.random is not None:
+        variants += random_space(json.loads(args.random), args.samples, args.sweep_seed)
+    if not variants:
+        variants = [{}]
+
+    results = run_sweep(args.case, variants, args.seeds, args.episodes, args.max_steps, args.workers,
+                        ResultCache(args.cache_dir))
+
+    points = {name: result['summary'] for name, result in results.items() if result['summary']['episodes'] > 0}
+    front = pareto_front(points)
+    print('----------------------------------------')
+    print('%-50s %12s %12s %14s' % ('config', 'throughput', 'decision_ms', 'NMAC/h'))
+    for name in sorted(points, key=lambda name: -points[name]['throughput']):
+        print('%-50s %12.2f %12.2f %14.4f %s'
+              % (name, points[name]['throughput'], points[name]['decision_ms']['mean'],
+                 points[name]['NMAC/h pooled'], '*' if name in front else ''))
+    print('* Pareto front (throughput vs decision time vs NMAC/h)')
+
+    with open(args.output, 'w') as f:
+        json.dump({'case': args.case, 'seeds': args.seeds, 'episodes': args.episodes, 'max_steps': args.max_steps,
+                   'code_version': code_version(), 'pareto_front': front, 'configs': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
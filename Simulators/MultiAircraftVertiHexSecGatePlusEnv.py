@@ -9,9 +9,16 @@ from collections import OrderedDict
 import matplotlib.path as mpltPath
 
 from config_hex_sec import Config
+from rng import GLOBAL_RNG, randrange
+from conflict_events import ConflictTracker
+from demand import DemandScheduler, make_arrival_process
+import fast_forward
+from cpa import ConflictTable, candidate_pairs, cpa_table
+from observation import ObservationBuffer
 
 __author__ = "Xuxi Yang <xuxiyang@iastate.edu>"
 
+
 import ipdb
 
 
@@ -27,12 +34,19 @@ class MultiAircraftEnv(gym.Env):
     The action is either applying +1, 0 or -1 for the change of heading angle of each aircraft.
     """
 
-    def __init__(self, sd, debug=False):
+    def __init__(self, sd, debug=False, config=Config, rng=None):
+        # config: the Config class (or a Config.replace() copy) of this simulator, rng: its
+        # numpy.random.Generator, by default the global random streams seeded with sd (see rng.py)
+        self.config = config
+        self.rng = GLOBAL_RNG if rng is None else rng
         self.load_config()  # read parameters from config file
         self.load_vertiports()  # set vertiports
         self.load_sectors()  # set sectors
         self.state = None
         self.viewer = None
+        self.render_cache = None
+        self.rasterizer = None
+        self.ob_buffer = None  # ObservationBuffer of _get_normalized_ob()
 
         # build observation space and action space
         self.observation_space = self.build_observation_space()
@@ -42,48 +56,54 @@ class MultiAircraftEnv(gym.Env):
             dtype=np.float32)
         self.action_space = spaces.Tuple((spaces.Discrete(3),) * self.num_aircraft)
 
+        self.time_step = 0  # simulation clock in seconds
         self.total_timesteps = 0  # total time steps in seconds
 
         self.conflicts = 0  # number of conflicts (LOS)
-        self.seed(sd)  # set seed
+        if rng is None:
+            self.seed(sd)  # set seed
 
         self.debug = debug
 
     def seed(self, seed=None):
-        np.random.seed(seed)
-        random.seed(seed)
+        if self.rng is GLOBAL_RNG:
+            np.random.seed(seed)
+            random.seed(seed)
+        else:
+            self.rng = np.random.default_rng(seed)
         # self.np_random, seed = seeding.np_random(seed)
         return [seed]
 
     def load_config(self):
         # load parameters from config file
-        self.window_width = Config.window_width
-        self.window_height = Config.window_height
-        self.num_aircraft = Config.num_aircraft
-        self.EPISODES = Config.EPISODES
-        self.G = Config.G
-        self.tick = Config.tick
-        self.scale = Config.scale  # scale: 1 pixel = ? meters in real world
-        self.minimum_separation = Config.minimum_separation  # LOS standard: 0.3 nmi
-        self.NMAC_dist = Config.NMAC_dist  # NMAC standard: 500 ft
-        self.horizon_dist = Config.horizon_dist
-        self.initial_min_dist = Config.initial_min_dist  # newly added aircraft should not be too close to existing aircraft
-        self.goal_radius = Config.goal_radius
-        self.init_speed = Config.init_speed  # cruise speed of the aircraft
-        self.min_speed = Config.min_speed
-        self.max_speed = Config.max_speed
+        self.window_width = self.config.window_width
+        self.window_height = self.config.window_height
+        self.num_aircraft = self.config.num_aircraft
+        self.EPISODES = self.config.EPISODES
+        self.G = self.config.G
+        self.tick = self.config.tick
+        self.scale = self.config.scale  # scale: 1 pixel = ? meters in real world
+        self.minimum_separation = self.config.minimum_separation  # LOS standard: 0.3 nmi
+        self.NMAC_dist = self.config.NMAC_dist  # NMAC standard: 500 ft
+        self.horizon_dist = self.config.horizon_dist
+        self.initial_min_dist = self.config.initial_min_dist  # newly added aircraft should not be too close to existing aircraft
+        self.goal_radius = self.config.goal_radius
+        self.init_speed = self.config.init_speed  # cruise speed of the aircraft
+        self.min_speed = self.config.min_speed
+        self.max_speed = self.config.max_speed
 
     def load_vertiports(self):
         # load vertiports based on locations in config file
         self.vertiport_list = []
-        for i in range(Config.vertiport_loc.shape[0]):
-            self.vertiport_list.append(VertiPort(id=i, position=Config.vertiport_loc[i]))
+        for i in range(self.config.vertiport_loc.shape[0]):
+            self.vertiport_list.append(VertiPort(id=i, position=self.config.vertiport_loc[i]))
 
     def load_sectors(self):
         # load sectors based on locations in config file
         self.sectors = []
-        for i in range(7):
-            self.sectors.append(Sector(i, Config.sector_vertices[i]))
+        for i in range(self.config.sector_vertices.shape[0]):
+            self.sectors.append(Sector(i, self.config.sector_vertices[i], self.config))
+        self.sector_edges = fast_forward.sector_edges(self.config.sector_vertices)
 
     def reset(self):
         self.aircraft_dict = AircraftDict()
@@ -92,15 +112,21 @@ class MultiAircraftEnv(gym.Env):
         self.conflicts = 0
         self.goals = 0
         self.NMACs = 0
+        self.conflict_tracker = ConflictTracker()
+        self.step_events = []  # (kind, id1, id2, dist, duration) conflict/NMAC events of the last step
+        self.demand = DemandScheduler(len(self.vertiport_list), make_arrival_process(self.config),
+                                      retry_delay=self.config.spawn_retry_delay, now=self.time_step, rng=self.rng)
 
         return self._get_ob()
 
     def _get_ob(self):
         ob = {}  # dict: {sector_id: [aircraft_info, id]}
-        for i in range(7):  # loop over all sectors
+        self.ob_row_ids = {}  # {sector_id: id of each row of aircraft_info}, nearby aircraft included
+        for i in range(len(self.sectors)):  # loop over all sectors
             s = []
             id = []
             goal_exit_id = []
+            nearby_id = []
             for aircraft_id in self.sectors[i].controlled_aircraft_id:
                 # (x, y, vx, vy, speed, heading, gx, gy)
                 aircraft = self.aircraft_dict.get_aircraft_by_id(aircraft_id)
@@ -117,30 +143,64 @@ class MultiAircraftEnv(gym.Env):
 
                 goal_exit_id.append(aircraft.goal_exit_id)
 
-            current_sector = self.sectors[i]
             # add aircraft information close to current sector
-            for sector in self.sectors:
-                if not sector.id == i:
-                    for aircraft_id in sector.controlled_aircraft_id:
-                        pos = self.aircraft_dict.get_aircraft_by_id(aircraft_id).position
-                        dist_segment_list = [
-                            pnt2line(pos, current_sector.vertices[k], current_sector.vertices[k + 1])[0]
-                            for k in range(-1, len(current_sector.vertices) - 1)]
-                        if min(dist_segment_list) < 3 * Config.minimum_separation:
-                            aircraft = self.aircraft_dict.get_aircraft_by_id(aircraft_id)
-                            s.append(aircraft.position[0])
-                            s.append(aircraft.position[1])
-                            s.append(aircraft.velocity[0])
-                            s.append(aircraft.velocity[1])
-                            s.append(aircraft.speed)
-                            s.append(aircraft.heading)
-                            s.append(aircraft.sub_goal.position[0])
-                            s.append(aircraft.sub_goal.position[1])
+            for aircraft_id in self._nearby_aircraft_id(i):
+                aircraft = self.aircraft_dict.get_aircraft_by_id(aircraft_id)
+                nearby_id.append(aircraft_id)
+                s.append(aircraft.position[0])
+                s.append(aircraft.position[1])
+                s.append(aircraft.velocity[0])
+                s.append(aircraft.velocity[1])
+                s.append(aircraft.speed)
+                s.append(aircraft.heading)
+                s.append(aircraft.sub_goal.position[0])
+                s.append(aircraft.sub_goal.position[1])
 
             ob[i] = [np.reshape(s, (-1, 8)), id, goal_exit_id]
+            self.ob_row_ids[i] = id + nearby_id
 
         return ob
 
+    def _nearby_aircraft_id(self, i):
+        # ids of the aircraft of other sectors within 3 minimum separations of the boundary of sector i
+        current_sector = self.sectors[i]
+        nearby_id = []
+        # only aircraft of the neighbouring sectors can be that close to the boundary
+        for sector in [self.sectors[j] for j in sorted(current_sector.neighbors)]:
+            if not sector.id == i:
+                for aircraft_id in sector.controlled_aircraft_id:
+                    pos = self.aircraft_dict.get_aircraft_by_id(aircraft_id).position
+                    dist_segment_list = [
+                        pnt2line(pos, current_sector.vertices[k], current_sector.vertices[k + 1])[0]
+                        for k in range(-1, len(current_sector.vertices) - 1)]
+                    if min(dist_segment_list) < 3 * self.config.minimum_separation:
+                        nearby_id.append(aircraft_id)
+        return nearby_id
+
+    def _get_normalized_ob(self, buffer=None):
+        """
+        write the observation of every sector into buffer (an ObservationBuffer, see observation.py; one is made
+        for this simulator the first time without) and return its views [SectorObservation of each sector].
+        Rows are in the order of _get_ob: the aircraft controlled by the sector, then the nearby ones
+        """
+        if buffer is None:
+            if self.ob_buffer is None:
+                self.ob_buffer = ObservationBuffer(len(self.sectors), config=self.config)
+            buffer = self.ob_buffer
+        for i in range(len(self.sectors)):
+            row = 0
+            for aircraft_id in self.sectors[i].controlled_aircraft_id:
+                aircraft = self.aircraft_dict.get_aircraft_by_id(aircraft_id)
+                buffer.write(i, row, aircraft, aircraft.sub_goal.position)
+                row += 1
+            for aircraft_id in self._nearby_aircraft_id(i):
+                aircraft = self.aircraft_dict.get_aircraft_by_id(aircraft_id)
+                buffer.write(i, row, aircraft, aircraft.sub_goal.position, controlled=False)
+                row += 1
+            buffer.end_sector(i, row)
+        buffer.normalize()
+        return buffer.views
+
     def step(self, a, near_end=False):
         # a is a dictionary: {id: action, ...}
         for id, aircraft in self.aircraft_dict.ac_dict.items():
@@ -149,42 +209,129 @@ class MultiAircraftEnv(gym.Env):
             except KeyError:
                 aircraft.step()
 
-        for vertiport in self.vertiport_list:
-            vertiport.step()  # add the vertiport clock by 1
-            if vertiport.clock_counter >= vertiport.time_next_aircraft and not near_end:
-                goal_vertiport_id = random.choice([e for e in range(len(self.vertiport_list)) if not e == vertiport.id])
-                aircraft = Aircraft(
-                    id=self.id_tracker,
-                    position=vertiport.position,
-                    speed=self.init_speed,
-                    heading=self.random_heading(),
-                    goal_pos=self.vertiport_list[goal_vertiport_id].position,
-                    goal_vertiport_id=goal_vertiport_id,
-                    sector_id=-1
-                )
-                dist_array, id_array = self.dist_to_all_aircraft(aircraft)
-                min_dist = min(dist_array) if dist_array.shape[0] > 0 else 9999
-                if min_dist > Config.start_safe_dist:
-                    # add aircraft only when it is safe
-                    self.aircraft_dict.add(aircraft)
-                    self.id_tracker += 1
-
-                    vertiport.generate_interval()
+        # serve the flight requests due by the end of this time step (see demand.py)
+        now = self.time_step + 1
+        due = [] if near_end else self.demand.pop_due(now)
+        if due:
+            positions = self.fleet_positions()
+        for request in due:
+            vertiport = self.vertiport_list[request.vertiport_id]
+            if request.goal_vertiport_id is None:
+                request.goal_vertiport_id = self.random_goal_vertiport(vertiport.id)
+            goal_vertiport_id = request.goal_vertiport_id
+            if positions.shape[0] > 0 and \
+                    np.min(np.hypot(*(positions - vertiport.position).T)) <= self.config.start_safe_dist:
+                # add aircraft only when it is safe, otherwise retry the same flight later
+                self.demand.retry(request, now)
+                continue
+            aircraft = Aircraft(
+                id=self.id_tracker,
+                position=vertiport.position,
+                speed=self.init_speed,
+                heading=self.random_heading(),
+                goal_pos=self.vertiport_list[goal_vertiport_id].position,
+                goal_vertiport_id=goal_vertiport_id,
+                sector_id=-1,
+                config=self.config,
+                rng=self.rng
+            )
+            self.aircraft_dict.add(aircraft)
+            self.id_tracker += 1
+            positions = np.vstack([positions, aircraft.position])
+            self.demand.departed(request, now)
 
         reward, terminal, info = self._terminal_reward()
 
         self.assign_sector()
 
         self.total_timesteps += self.aircraft_dict.num_aircraft
+        self.time_step += 1
 
         return self._get_ob(), reward, terminal, info
 
+    def fleet_positions(self):
+        # n by 2 array of the positions of all aircraft
+        return np.array([aircraft.position for aircraft in self.aircraft_dict.ac_dict.values()]).reshape(-1, 2)
+
+    def random_goal_vertiport(self, vertiport_id):
+        # any vertiport except the departure one
+        goal_vertiport_id = randrange(self.rng, len(self.vertiport_list) - 1)
+        return goal_vertiport_id + 1 if goal_vertiport_id >= vertiport_id else goal_vertiport_id
+
+    def predict_conflicts(self, horizon=None, radius=None):
+        """
+        table of the aircraft pairs whose closest point of approach within horizon time steps is closer than
+        radius (see cpa.py), together with the aircraft ids of the rows of the last observation
+        """
+        horizon = self.config.cpa_horizon if horizon is None else horizon
+        radius = self.config.cpa_radius if radius is None else radius
+        fleet = list(self.aircraft_dict.ac_dict.values())
+        table = cpa_table([aircraft.id for aircraft in fleet], self.fleet_positions(),
+                          np.array([aircraft.velocity for aircraft in fleet]).reshape(-1, 2),
+                          horizon, radius, self.max_speed)
+        return ConflictTable(table, self.ob_row_ids)
+
+    def safe_steps(self, limit, near_end=False):
+        """
+        number of upcoming time steps (at most limit) guaranteed to pass without conflict, NMAC, goal,
+        sector change or departure, which fast_forward() may skip over
+        """
+        if not near_end:
+            limit = min(limit, math.ceil(self.demand.next_time() - self.time_step) - 1)
+        fleet = list(self.aircraft_dict.ac_dict.values())
+        if not fleet:
+            return max(limit, 0)
+        return fast_forward.safe_steps(self.fleet_positions(),
+                                       np.array([aircraft.goal.position for aircraft in fleet]),
+                                       self.sector_edges, self.max_speed, self.minimum_separation, self.goal_radius,
+                                       limit)
+
+    def fast_forward(self, a, steps):
+        """
+        advance steps time steps at once with the actions a, integrating the noise of all aircraft in bulk.
+        Only valid for steps <= safe_steps(): nothing is checked on the way. Return like step(), with the
+        reward summed over the steps
+        """
+        fleet = list(self.aircraft_dict.ac_dict.values())
+        if fleet:
+            turns = np.array([(a.get(aircraft.id, 1) - 1) * self.config.d_heading for aircraft in fleet])
+            positions, speeds, headings, velocities = fast_forward.integrate(
+                self.fleet_positions(),
+                np.array([aircraft.speed for aircraft in fleet]),
+                np.array([aircraft.heading for aircraft in fleet]),
+                turns, steps, self.config.init_speed, self.config.speed_sigma, self.config.heading_sigma,
+                self.config.min_speed, self.config.max_speed, speed_walk=False, rng=self.rng)
+            for k, aircraft in enumerate(fleet):
+                aircraft.position[:] = positions[k]
+                aircraft.speed = speeds[k]
+                aircraft.heading = headings[k]
+                aircraft.velocity = velocities[k]
+                aircraft.reward = self.config.step_penalty
+
+        self.step_events = []
+        nearest = fast_forward.nearest_distances(self.fleet_positions(), self.config.proximity_radius)
+        info = dict(zip([aircraft.id for aircraft in fleet], nearest))
+        reward = steps * len(fleet) * self.config.step_penalty
+
+        self.total_timesteps += len(fleet) * steps
+        self.time_step += steps
+
+        return self._get_ob(), reward, False, info
+
     def assign_sector(self):
         """
-        based on the aircraft location, change its sector id to the current sector
+        based on the aircraft location, change its sector id to the current sector.
+        An aircraft is almost always still in its sector or in a neighbouring one, so these are checked first.
         """
         for id, aircraft in self.aircraft_dict.ac_dict.items():
-            for sector in self.sectors:
+            if aircraft.sector_id == -1:
+                candidates = self.sectors
+            else:
+                current_sector = self.sectors[aircraft.sector_id]
+                if current_sector.in_sector(aircraft.position):
+                    continue
+                candidates = [self.sectors[j] for j in current_sector.neighbors] + self.sectors
+            for sector in candidates:
                 if sector.in_sector(aircraft.position):
                     if not aircraft.sector_id == sector.id:
                         self.sectors[aircraft.sector_id].controlled_aircraft_id.discard(id)
@@ -210,62 +357,60 @@ class MultiAircraftEnv(gym.Env):
            else return the corresponding reward and not terminate
         """
         reward = 0
-        info_dist_dict = {}
         aircraft_to_remove = []  # add goal-aircraft and out-of-map aircraft to this list
-
-        for id, aircraft in self.aircraft_dict.ac_dict.items():
-            # calculate min_dist and dist_goal for checking terminal
-            dist_array, id_array = self.dist_to_all_aircraft(aircraft)
-            min_dist = min(dist_array) if dist_array.shape[0] > 0 else 9999
-            info_dist_dict[id] = min_dist
+        fleet = list(self.aircraft_dict.ac_dict.values())
+        ids = np.array([aircraft.id for aircraft in fleet], dtype=np.int64)
+        positions = self.fleet_positions()
+
+        # aircraft pairs closer than proximity_radius, found with a uniform grid (see cpa.py)
+        pairs = candidate_pairs(positions, self.config.proximity_radius)
+        diff = positions[pairs[:, 1]] - positions[pairs[:, 0]]
+        pair_dist = np.hypot(diff[:, 0], diff[:, 1])
+
+        # distance of each aircraft to the closest one, 9999 if there is none within proximity_radius
+        min_dist = np.full(len(fleet), 9999.0)
+        np.minimum.at(min_dist, pairs[:, 0], pair_dist)
+        np.minimum.at(min_dist, pairs[:, 1], pair_dist)
+
+        # conflicts and NMACs are tracked per aircraft pair and counted once (see conflict_events.py)
+        close = pair_dist < self.minimum_separation
+        id_pairs = np.sort(ids[pairs[close]], axis=1)
+        self.step_events = self.conflict_tracker.update(self.time_step, id_pairs, pair_dist[close], self.NMAC_dist)
+        if self.debug and close.any():
+            self.render()
+            import ipdb
+            ipdb.set_trace()
+        in_conflict = set(id_pairs.ravel().tolist())
+
+        for k, aircraft in enumerate(fleet):
             dist_goal = self.dist_goal(aircraft)
 
-            conflict = False
-            # set the conflict flag to false for aircraft
-            # elif conflict, set penalty reward and conflict flag but do NOT remove the aircraft from list
-            for id2, dist in zip(id_array, dist_array):
-                if dist >= self.minimum_separation:  # safe
-                    aircraft.conflict_id_set.discard(id2)  # discarding element not in the set won't raise error
-
-                else:  # conflict!!
-                    if self.debug:
-                        self.render()
-                        import ipdb
-                        ipdb.set_trace()
-                    conflict = True
-                    if id2 not in aircraft.conflict_id_set:
-                        self.conflicts += 1
-                        aircraft.conflict_id_set.add(id2)
-                    aircraft.reward = Config.conflict_penalty
-
             # if NMAC, set penalty reward and prepare to remove the aircraft from list
-            if min_dist < self.NMAC_dist:
-                if self.debug:
-                    self.render()
-                    import ipdb
-                    ipdb.set_trace()
-                aircraft.reward = Config.NMAC_penalty
+            if min_dist[k] < self.NMAC_dist:
+                aircraft.reward = self.config.NMAC_penalty
                 aircraft_to_remove.append(aircraft)
-                self.NMACs += 1
-                # aircraft_to_remove.append(self.aircraft_dict.get_aircraft_by_id(close_id))
 
             # give out-of-map aircraft a penalty, and prepare to remove it
             # elif not self.position_range.contains(np.array(aircraft.position)):
-            #     aircraft.reward = Config.wall_penalty
+            #     aircraft.reward = self.config.wall_penalty
             #     # info['w'].append(aircraft.id)
             #     if aircraft not in aircraft_to_remove:
             #         aircraft_to_remove.append(aircraft)
 
             # set goal-aircraft reward according to simulator, prepare to remove it
             elif dist_goal < self.goal_radius:
-                aircraft.reward = Config.goal_reward
+                aircraft.reward = self.config.goal_reward
                 self.goals += 1
                 if aircraft not in aircraft_to_remove:
                     aircraft_to_remove.append(aircraft)
 
+            # in conflict, set penalty reward but do NOT remove the aircraft from list
+            elif aircraft.id in in_conflict:
+                aircraft.reward = self.config.conflict_penalty
+
             # for aircraft without NMAC, conflict, out-of-map, goal, set its reward as simulator
-            elif not conflict:
-                aircraft.reward = Config.step_penalty
+            else:
+                aircraft.reward = self.config.step_penalty
 
             # accumulates reward
             reward += aircraft.reward
@@ -274,75 +419,73 @@ class MultiAircraftEnv(gym.Env):
         for aircraft in aircraft_to_remove:
             self.sectors[aircraft.sector_id].controlled_aircraft_id.discard(aircraft.id)
             self.aircraft_dict.remove(aircraft)
+        self.step_events += self.conflict_tracker.remove([aircraft.id for aircraft in aircraft_to_remove],
+                                                         self.time_step)
+        self.conflicts = self.conflict_tracker.conflicts
+        self.NMACs = self.conflict_tracker.NMACs
         # reward = [e.reward for e in self.aircraft_dict]
 
-        return reward, False, info_dist_dict
+        return reward, False, dict(zip(ids.tolist(), min_dist.tolist()))
 
     def render(self, mode='human'):
+        if mode == 'rgb_array':
+            # headless NumPy drawing, no display needed (see offscreen.py)
+            from offscreen import FrameRasterizer, fleet_snapshot
+            from trajectory_recorder import scene_info
+            if self.rasterizer is None:
+                self.rasterizer = FrameRasterizer(scene_info(self), num_colors=self.num_aircraft)
+            return self.rasterizer.draw(fleet_snapshot(self))
+
         from gym.envs.classic_control import rendering
-        from colour import Color
-        red = Color('red')
-        colors = list(red.range_to(Color('green'), self.num_aircraft))
+        from render_cache import RenderCache
 
         if self.viewer is None:
             self.viewer = rendering.Viewer(self.window_width, self.window_height)
             self.viewer.set_bounds(0, self.window_width, 0, self.window_height)
+            self.render_cache = RenderCache(self.viewer, self.num_aircraft)
+            self.build_static_geoms()
+        cache = self.render_cache
 
-        import os
-        __location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
-
-        # vertiport_map_img = rendering.Image(os.path.join(__location__, 'images/vertiport_map.png'), 800, 800)
-        # jtransform = rendering.Transform(rotation=0, translation=[400, 400])
-        # vertiport_map_img.add_attr(jtransform)
-        # self.viewer.onetime_geoms.append(vertiport_map_img)
-
-        # draw all aircraft
+        # draw all aircraft, reusing the sprite of each aircraft and only moving its transform
         for id, aircraft in self.aircraft_dict.ac_dict.items():
-            aircraft_img = rendering.Image(os.path.join(__location__, 'images/aircraft.png'), 32, 32)
-            jtransform = rendering.Transform(rotation=aircraft.heading - math.pi / 2, translation=aircraft.position)
-            aircraft_img.add_attr(jtransform)
-            r, g, b = colors[aircraft.id % self.num_aircraft].get_rgb()
+            r, g, b = cache.colors[aircraft.id % self.num_aircraft]
+            aircraft_img = cache.sprite(('aircraft', id), 'aircraft.png', 32)
+            aircraft_img.transform.set_translation(aircraft.position[0], aircraft.position[1])
+            aircraft_img.transform.set_rotation(aircraft.heading - math.pi / 2)
             aircraft_img.set_color(r, g, b)
-            self.viewer.onetime_geoms.append(aircraft_img)
+            self.viewer.add_onetime(aircraft_img)
 
-            goal_img = rendering.Image(os.path.join(__location__, 'images/goal.png'), 32, 32)
-            jtransform = rendering.Transform(rotation=0, translation=aircraft.goal.position)
-            goal_img.add_attr(jtransform)
+            goal_img = cache.sprite(('goal', id), 'goal.png', 32)
+            goal_img.transform.set_translation(aircraft.goal.position[0], aircraft.goal.position[1])
             goal_img.set_color(r, g, b)
-            self.viewer.onetime_geoms.append(goal_img)
+            self.viewer.add_onetime(goal_img)
+
+        cache.release(self.aircraft_dict.ac_dict)
+
+        return self.viewer.render(return_rgb_array=False)
+
+    def build_static_geoms(self):
+        # vertiports, sector gates and sector boundaries do not move, add them to the viewer only once
+        from gym.envs.classic_control import rendering
 
         # draw all vertiports
         for veriport in self.vertiport_list:
-            vertiport_img = rendering.Image(os.path.join(__location__, 'images/verti.png'), 32, 32)
-            jtransform = rendering.Transform(rotation=0, translation=veriport.position)
-            vertiport_img.add_attr(jtransform)
-            self.viewer.onetime_geoms.append(vertiport_img)
+            self.render_cache.static_sprite('verti.png', 32, veriport.position)
 
-        # draw all sectors
+        # draw all sector gates
         for sector in self.sectors:
-            if sector.id == 0:
-                for i, exit in enumerate(sector.exits):
-                    exit_img = self.viewer.draw_polygon(Config.vertices)
-                    jtransform = rendering.Transform(rotation=math.radians(60 * i - 90), translation=exit[0])
-                    exit_img.add_attr(jtransform)
-                    exit_img.set_color(255 / 255.0, 165 / 255.0, 0)
-                    self.viewer.onetime_geoms.append(exit_img)
-
-            else:
-                for i, exit in enumerate(sector.exits):
-                    exit_img = self.viewer.draw_polygon(Config.vertices)
-                    angle = 60 * (sector.id + i) + 30
-                    jtransform = rendering.Transform(rotation=math.radians(angle), translation=exit[0])
-                    exit_img.add_attr(jtransform)
-                    exit_img.set_color(255 / 255.0, 165 / 255.0, 0)
-                    self.viewer.onetime_geoms.append(exit_img)
+            for exit in sector.exits:
+                exit_img = rendering.FilledPolygon(self.config.vertices)
+                exit_img.add_attr(rendering.Transform(rotation=math.radians(gate_angle(exit)), translation=exit[0]))
+                exit_img.set_color(255 / 255.0, 165 / 255.0, 0)
+                self.viewer.add_geom(exit_img)
 
         # draw boundaries of the sectors
-        self.viewer.draw_polyline(Config.vertiport_loc[[1, 2, 3, 4, 5, 6, 1], :])
+        outline = self.config.network.outline()
+        if outline is not None:
+            self.viewer.add_geom(rendering.PolyLine(outline, False))
         for sector in self.sectors:
-            self.viewer.draw_polyline(sector.vertices[[0, 1, 2, 3, 4, 5, 0], :])
-
-        return self.viewer.render(return_rgb_array=False)
+            self.viewer.add_geom(rendering.PolyLine(sector.vertices[[0, 1, 2, 3, 4, 5, 0], :], False))
 
     def draw_point(self, point):
         # for debug
@@ -352,7 +495,7 @@ class MultiAircraftEnv(gym.Env):
             self.viewer = rendering.Viewer(self.window_width, self.window_height)
             self.viewer.set_bounds(0, self.window_width, 0, self.window_height)
 
-        img = self.viewer.draw_polygon(Config.point)
+        img = self.viewer.draw_polygon(self.config.point)
         jtransform = rendering.Transform(rotation=0, translation=point)
         img.add_attr(jtransform)
         self.viewer.onetime_geoms.append(img)
@@ -367,24 +510,16 @@ class MultiAircraftEnv(gym.Env):
             self.viewer.onetime_geoms.append(vertiport_img)
 
         for sector in self.sectors:
-            if sector.id == 0:
-                for i, exit in enumerate(sector.exits):
-                    exit_img = self.viewer.draw_polygon(Config.vertices)
-                    jtransform = rendering.Transform(rotation=math.radians(60 * i - 90), translation=exit[0])
-                    exit_img.add_attr(jtransform)
-                    exit_img.set_color(255 / 255.0, 165 / 255.0, 0)
-                    self.viewer.onetime_geoms.append(exit_img)
-
-            else:
-                for i, exit in enumerate(sector.exits):
-                    exit_img = self.viewer.draw_polygon(Config.vertices)
-                    angle = 60 * (sector.id + i) + 30
-                    jtransform = rendering.Transform(rotation=math.radians(angle), translation=exit[0])
-                    exit_img.add_attr(jtransform)
-                    exit_img.set_color(255 / 255.0, 165 / 255.0, 0)
-                    self.viewer.onetime_geoms.append(exit_img)
-
-        self.viewer.draw_polyline(Config.vertiport_loc[[1, 2, 3, 4, 5, 6, 1], :])
+            for exit in sector.exits:
+                exit_img = self.viewer.draw_polygon(self.config.vertices)
+                jtransform = rendering.Transform(rotation=math.radians(gate_angle(exit)), translation=exit[0])
+                exit_img.add_attr(jtransform)
+                exit_img.set_color(255 / 255.0, 165 / 255.0, 0)
+                self.viewer.onetime_geoms.append(exit_img)
+
+        outline = self.config.network.outline()
+        if outline is not None:
+            self.viewer.draw_polyline(outline)
         for sector in self.sectors:
             self.viewer.draw_polyline(sector.vertices[[0, 1, 2, 3, 4, 5, 0], :])
 
@@ -394,6 +529,7 @@ class MultiAircraftEnv(gym.Env):
         if self.viewer:
             self.viewer.close()
             self.viewer = None
+            self.render_cache = None
 
     def dist_to_all_aircraft(self, aircraft):
         # calculate dist of aircraft to all of the other aircraft
@@ -419,16 +555,16 @@ class MultiAircraftEnv(gym.Env):
     #     return np.linalg.norm(np.array(pos1) - np.array(pos2))
 
     def random_pos(self):
-        return np.random.uniform(
+        return self.rng.uniform(
             low=np.array([0, 0]),
             high=np.array([self.window_width, self.window_height])
         )
 
     def random_speed(self):
-        return np.random.uniform(low=self.min_speed, high=self.max_speed)
+        return self.rng.uniform(low=self.min_speed, high=self.max_speed)
 
     def random_heading(self):
-        return np.random.uniform(low=0, high=2 * math.pi)
+        return self.rng.uniform(low=0, high=2 * math.pi)
 
     def build_observation_space(self):
         s = spaces.Dict({
@@ -446,7 +582,10 @@ class MultiAircraftEnv(gym.Env):
 
 
 class Aircraft:
-    def __init__(self, id, position, speed, heading, goal_pos, goal_vertiport_id, sector_id=-1):
+    def __init__(self, id, position, speed, heading, goal_pos, goal_vertiport_id, sector_id=-1, config=Config,
+                 rng=GLOBAL_RNG):
+        self.config = config
+        self.rng = rng
         self.id = id
         self.position = np.array(position, dtype=np.float32)
         self.speed = speed
@@ -464,22 +603,20 @@ class Aircraft:
 
         self.load_config()
 
-        self.conflict_id_set = set()  # track id of the aircraft in conflict
-
         self.sector_id = sector_id
 
     def load_config(self):
-        self.G = Config.G
-        self.scale = Config.scale
-        self.min_speed = Config.min_speed
-        self.max_speed = Config.max_speed
-        self.speed_sigma = Config.speed_sigma
-        self.d_heading = Config.d_heading
+        self.G = self.config.G
+        self.scale = self.config.scale
+        self.min_speed = self.config.min_speed
+        self.max_speed = self.config.max_speed
+        self.speed_sigma = self.config.speed_sigma
+        self.d_heading = self.config.d_heading
 
     def step(self, a=1):
-        self.speed = Config.init_speed + np.random.normal(0, self.speed_sigma)
+        self.speed = self.config.init_speed + self.rng.normal(0, self.speed_sigma)
         self.speed = max(self.min_speed, min(self.speed, self.max_speed))  # project to range
-        self.heading += (a - 1) * self.d_heading + np.random.normal(0, Config.heading_sigma)
+        self.heading += (a - 1) * self.d_heading + self.rng.normal(0, self.config.heading_sigma)
         vx = self.speed * math.cos(self.heading)
         vy = self.speed * math.sin(self.heading)
         self.velocity = np.array([vx, vy])
@@ -542,68 +679,26 @@ class VertiPort:
     def __init__(self, id, position):
         self.id = id
         self.position = np.array(position)
-        self.clock_counter = 0
-        self.time_next_aircraft = np.random.uniform(0, 60)
-
-    # when the next aircraft will take off
-    def generate_interval(self):
-        self.time_next_aircraft = np.random.uniform(Config.time_interval_lower, Config.time_interval_upper)
-        self.clock_counter = 0
-
-    # add the clock counter by 1
-    def step(self):
-        self.clock_counter += 1
 
     def __repr__(self):
         return 'vertiport id: %d, pos: %s' % (self.id, self.position)
 
 
 class Sector:
-    def __init__(self, id, vertices):
-        self.id = id  # id range: 0,1,2,3,4,5,6
+    def __init__(self, id, vertices, config=Config):
+        self.config = config
+        self.id = id  # id range: 0,1,2,3,4,5,6 for one ring of sectors around the center
         self.vertices = vertices
+        self.path = mpltPath.Path(vertices)
 
         self.controlled_aircraft_id = set()
         self.exited_aircraft_id = {}
         self.set_gate()
 
     def set_gate(self):
-        # set the position of the gates of each sector
-        from shapely.geometry import LineString
-        if self.id == 0:
-            self.exits = []
-
-            for i in range(6):
-                start = self.vertices[i - 1]
-                end = self.vertices[i]
-                line = LineString([start, end])
-                angle = math.atan2((end - start)[1], (end - start)[0])
-                points = [line.interpolate((i / 3), normalized=True) for i in range(1, 3)]
-
-                self.exits.append(np.array([[points[0].x, points[0].y],
-                                            [points[0].x - Config.sector_exit_len * math.cos(angle),
-                                             points[0].y - Config.sector_exit_len * math.sin(angle)],
-                                            [points[0].x + Config.sector_exit_len * math.cos(angle),
-                                             points[0].y + Config.sector_exit_len * math.sin(angle)]]))
-
-        else:
-            self.exits = []
-            for i in range(self.id + 1, self.id + 4):
-                v1 = i
-                v2 = i + 1
-                start = self.vertices[v1 % 6]
-                end = self.vertices[v2 % 6]
-                line = LineString([start, end])
-                angle = math.atan2((end - start)[1], (end - start)[0])
-                points = [line.interpolate((i / 3), normalized=True) for i in range(1, 3)]
-
-                self.exits.append(np.array([[points[0].x, points[0].y],
-                                            [points[0].x - Config.sector_exit_len * math.cos(angle),
-                                             points[0].y - Config.sector_exit_len * math.sin(angle)],
-                                            [points[0].x + Config.sector_exit_len * math.cos(angle),
-                                             points[0].y + Config.sector_exit_len * math.sin(angle)]]))
-
-        self.exits = np.array(self.exits)
+        # gates and neighbouring sectors from the generated sector network (see hex_network.py)
+        self.exits = self.config.sector_len_exits[self.id]
+        self.neighbors = self.config.network.neighbors(self.id)
 
     def assign_exit(self, aircraft):
         # when aircraft enters this aircraft, assign an exit gate to it
@@ -625,7 +720,7 @@ class Sector:
             aircraft.sub_goal = Goal(closest_exit)
 
     def in_sector(self, point):
-        return mpltPath.Path(self.vertices).contains_point(point)
+        return self.path.contains_point(point)
         # return Polygon(self.vertices).contains(Point(point[0], point[1]))
         # return self.in_hull(point, self.vertices)
 
@@ -649,6 +744,11 @@ class Sector:
             % (self.id)
         return s
 
+def gate_angle(gate):
+    # orientation of a gate [center, end 1, end 2] in degrees
+    return math.degrees(math.atan2(gate[2][1] - gate[1][1], gate[2][0] - gate[1][0]))
+
+
 def dist(x1, y1, x2, y2):
     dx = x1 - x2
     dy = y1 - y2
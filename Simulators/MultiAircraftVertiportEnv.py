@@ -7,6 +7,10 @@ from gym.utils import seeding
 from collections import OrderedDict
 
 from config_vertiport import Config
+from rng import GLOBAL_RNG
+from cpa import candidate_pairs
+from conflict_events import ConflictTracker
+from observation import ObservationBuffer
 
 __author__ = "Xuxi Yang <xuxiyang@iastate.edu>"
 
@@ -25,10 +29,17 @@ class MultiAircraftEnv(gym.Env):
     More specifically, the action is a dictionary in form {id: action, id: action, ...}
     """
 
-    def __init__(self, sd=2, debug=False):
+    def __init__(self, sd=2, debug=False, config=Config, rng=None):
+        # config: the Config class (or a Config.replace() copy) of this simulator, rng: its
+        # numpy.random.Generator, by default the global random streams seeded with sd (see rng.py)
+        self.config = config
+        self.rng = GLOBAL_RNG if rng is None else rng
         self.load_config()  # load parameters for the simulator
         self.state = None
         self.viewer = None
+        self.render_cache = None
+        self.rasterizer = None
+        self.ob_buffer = None  # ObservationBuffer of _get_normalized_ob()
 
         # build observation space and action space
         self.observation_space = self.build_observation_space()  # observation space deprecated, not in use for MCTS
@@ -43,32 +54,36 @@ class MultiAircraftEnv(gym.Env):
         self.total_timesteps = 0
 
         self.conflicts = 0
-        self.seed(sd)
+        if rng is None:
+            self.seed(sd)
 
         self.debug = debug
 
     def seed(self, seed=None):
-        np.random.seed(seed)
-        random.seed(seed)
+        if self.rng is GLOBAL_RNG:
+            np.random.seed(seed)
+            random.seed(seed)
+        else:
+            self.rng = np.random.default_rng(seed)
         # self.np_random, seed = seeding.np_random(seed)
         return [seed]
 
     def load_config(self):
         # input dim
-        self.window_width = Config.window_width
-        self.window_height = Config.window_height  # dimension of the airspace
-        self.num_aircraft = Config.num_aircraft
-        self.EPISODES = Config.EPISODES
-        # self.tick = Config.tick
-        self.scale = Config.scale  # 1 meter = ? pixels, set to 60 here
-        self.minimum_separation = Config.minimum_separation
-        self.NMAC_dist = Config.NMAC_dist
-        # self.horizon_dist = Config.horizon_dist
-        self.initial_min_dist = Config.initial_min_dist  # when aircraft generated, is shouldn't be too close to others
-        self.goal_radius = Config.goal_radius
-        self.init_speed = Config.init_speed
-        self.min_speed = Config.min_speed
-        self.max_speed = Config.max_speed
+        self.window_width = self.config.window_width
+        self.window_height = self.config.window_height  # dimension of the airspace
+        self.num_aircraft = self.config.num_aircraft
+        self.EPISODES = self.config.EPISODES
+        # self.tick = self.config.tick
+        self.scale = self.config.scale  # 1 meter = ? pixels, set to 60 here
+        self.minimum_separation = self.config.minimum_separation
+        self.NMAC_dist = self.config.NMAC_dist
+        # self.horizon_dist = self.config.horizon_dist
+        self.initial_min_dist = self.config.initial_min_dist  # when aircraft generated, is shouldn't be too close to others
+        self.goal_radius = self.config.goal_radius
+        self.init_speed = self.config.init_speed
+        self.min_speed = self.config.min_speed
+        self.max_speed = self.config.max_speed
 
     def reset(self):
         # aircraft is stored in this dict
@@ -77,14 +92,16 @@ class MultiAircraftEnv(gym.Env):
         self.conflicts = 0
         self.goals = 0
         self.NMACs = 0
+        self.conflict_tracker = ConflictTracker()
+        self.step_events = []  # (kind, id1, id2, dist, duration) conflict/NMAC events of the last step
 
         # indicate whether each aircraft has conflict/NMAC
         self.conflict_flag = [False] * self.num_aircraft
         self.NMAC_flag = [False] * self.num_aircraft
 
         for id in range(self.num_aircraft):
-            theta = np.random.uniform(0, 2 * np.pi)
-            r2 = np.random.uniform((10000 / 60) ** 2, (15000 / 60) ** 2)
+            theta = self.rng.uniform(0, 2 * np.pi)
+            r2 = self.rng.uniform((10000 / 60) ** 2, (15000 / 60) ** 2)
             x = math.sqrt(r2) * np.cos(theta)
             y = math.sqrt(r2) * np.sin(theta)
             position = (self.window_width / 2 + x, self.window_height / 2 + y)
@@ -95,13 +112,15 @@ class MultiAircraftEnv(gym.Env):
                 position=position,
                 speed=self.init_speed,
                 heading=theta + math.pi,
-                goal_pos=goal_pos
+                goal_pos=goal_pos,
+                config=self.config,
+                rng=self.rng
             )
 
             if id > 0:
-                while np.min(self.dist_to_all_aircraft(aircraft)[0]) < 2 * Config.minimum_separation:
-                    theta = np.random.uniform(0, 2 * np.pi)
-                    r2 = np.random.uniform((10000 / 60) ** 2, (15000 / 60) ** 2)
+                while np.min(self.dist_to_all_aircraft(aircraft)[0]) < 2 * self.config.minimum_separation:
+                    theta = self.rng.uniform(0, 2 * np.pi)
+                    r2 = self.rng.uniform((10000 / 60) ** 2, (15000 / 60) ** 2)
                     x = math.sqrt(r2) * np.cos(theta)
                     y = math.sqrt(r2) * np.sin(theta)
                     position = (self.window_width / 2 + x, self.window_height / 2 + y)
@@ -112,7 +131,9 @@ class MultiAircraftEnv(gym.Env):
                         position=position,
                         speed=self.init_speed,
                         heading=theta + math.pi,
-                        goal_pos=goal_pos
+                        goal_pos=goal_pos,
+                        config=self.config,
+                        rng=self.rng
                     )
 
             self.aircraft_dict.add(aircraft)
@@ -143,6 +164,24 @@ class MultiAircraftEnv(gym.Env):
 
         return np.reshape(s, (-1, 8)), id
 
+    def _get_normalized_ob(self, buffer=None):
+        """
+        write the observation into buffer (an ObservationBuffer of one sector, see observation.py; one is made for
+        this simulator the first time without) and return its views [SectorObservation], rows in the order of
+        _get_ob
+        """
+        if buffer is None:
+            if self.ob_buffer is None:
+                self.ob_buffer = ObservationBuffer(1, config=self.config)
+            buffer = self.ob_buffer
+        row = 0
+        for aircraft in self.aircraft_dict.ac_dict.values():
+            buffer.write(0, row, aircraft, aircraft.goal.position)
+            row += 1
+        buffer.end_sector(0, row)
+        buffer.normalize()
+        return buffer.views
+
     def step(self, a):
         # a is a dictionary: {id: action, id: action, ...}
         # since MCTS is used every 5 seconds, there may be new aircraft generated during the 5 time step interval, which
@@ -167,65 +206,63 @@ class MultiAircraftEnv(gym.Env):
         1. for each aircraft:
           a. if there a conflict, return a penalty for it
           b. if there is NMAC, assign a penalty to it and prepare to remove this aircraft from dict
-          b. elif it is out of map, assign its reward as Config.wall_penalty, prepare to remove it
-          c. elif if it reaches goal, assign its reward to Config.goal_reward, prepare to remove it
-          d. else assign its reward as Config.step_penalty.
+          b. elif it is out of map, assign its reward as self.config.wall_penalty, prepare to remove it
+          c. elif if it reaches goal, assign its reward to self.config.goal_reward, prepare to remove it
+          d. else assign its reward as self.config.step_penalty.
         3. remove out-of-map aircraft and goal-aircraft
 
         """
         reward = 0
-        info_dist_list = []
         aircraft_to_remove = []  # add goal-aircraft and out-of-map aircraft to this list
-
-        for id, aircraft in self.aircraft_dict.ac_dict.items():
-            # calculate min_dist and dist_goal for checking terminal
-            dist_array, id_array = self.dist_to_all_aircraft(aircraft)
-            min_dist = min(dist_array) if dist_array.shape[0] > 0 else 9999
-            info_dist_list.append(min_dist)
+        fleet = list(self.aircraft_dict.ac_dict.values())
+        ids = np.array([aircraft.id for aircraft in fleet], dtype=np.int64)
+        positions = self.fleet_positions()
+
+        # aircraft pairs closer than proximity_radius, found with a uniform grid (see cpa.py)
+        pairs = candidate_pairs(positions, self.config.proximity_radius)
+        diff = positions[pairs[:, 1]] - positions[pairs[:, 0]]
+        pair_dist = np.hypot(diff[:, 0], diff[:, 1])
+
+        # distance of each aircraft to the closest one, 9999 if there is none within proximity_radius
+        min_dist = np.full(len(fleet), 9999.0)
+        np.minimum.at(min_dist, pairs[:, 0], pair_dist)
+        np.minimum.at(min_dist, pairs[:, 1], pair_dist)
+
+        # conflicts and NMACs are tracked per aircraft pair and counted once (see conflict_events.py)
+        close = pair_dist < self.minimum_separation
+        id_pairs = np.sort(ids[pairs[close]], axis=1)
+        self.step_events = self.conflict_tracker.update(self.time_step, id_pairs, pair_dist[close], self.NMAC_dist)
+        if self.debug and close.any():
+            self.render()
+            import ipdb
+            ipdb.set_trace()
+        in_conflict = set(id_pairs.ravel().tolist())
+        for id in in_conflict:
+            self.conflict_flag[id] = True
+
+        for k, aircraft in enumerate(fleet):
             dist_goal = self.dist_goal(aircraft)
 
-            conflict = False
-            # set the conflict flag to false for aircraft
-            # elif conflict, set penalty reward and conflict flag but do NOT remove the aircraft from list
-            for id2, dist in zip(id_array, dist_array):
-                if dist >= self.minimum_separation:  # safe
-                    aircraft.conflict_id_set.discard(id2)  # discarding element not in the set won't raise error
-
-                else:  # conflict!!
-                    if self.debug:
-                        self.render()
-                        import ipdb
-                        ipdb.set_trace()
-                    conflict = True
-                    if id2 not in aircraft.conflict_id_set:
-                        self.conflicts += 1
-                        aircraft.conflict_id_set.add(id2)
-                        self.conflict_flag[id] = True
-                        self.conflict_flag[id2] = True
-                    aircraft.reward = Config.conflict_penalty
-
             # if NMAC, set penalty reward and prepare to remove the aircraft from list
-            if min_dist < self.NMAC_dist:
-                if self.debug:
-                    self.render()
-                    import ipdb
-                    ipdb.set_trace()
-                aircraft.reward = Config.NMAC_penalty
+            if min_dist[k] < self.NMAC_dist:
+                aircraft.reward = self.config.NMAC_penalty
                 aircraft_to_remove.append(aircraft)
-                self.NMACs += 1
-                self.NMAC_flag[id] = True
-                # aircraft_to_remove.append(self.aircraft_dict.get_aircraft_by_id(close_id))
+                self.NMAC_flag[aircraft.id] = True
 
             # set goal-aircraft reward according to simulator, prepare to remove it
             elif dist_goal < self.goal_radius:
-                aircraft.reward = Config.goal_reward
+                aircraft.reward = self.config.goal_reward
                 self.goals += 1
                 if aircraft not in aircraft_to_remove:
                     aircraft_to_remove.append(aircraft)
 
+            # in conflict, set penalty reward but do NOT remove the aircraft from list
+            elif aircraft.id in in_conflict:
+                aircraft.reward = self.config.conflict_penalty
+
             # for aircraft without NMAC, conflict, out-of-map, goal, set its reward as default
-            elif not conflict:
-                aircraft.reward = Config.step_penalty
+            else:
+                aircraft.reward = self.config.step_penalty
 
             # accumulates reward
             reward += aircraft.reward
@@ -233,53 +270,62 @@ class MultiAircraftEnv(gym.Env):
         # remove all the out-of-map aircraft and goal-aircraft
         for aircraft in aircraft_to_remove:
             self.aircraft_dict.remove(aircraft)
+        self.step_events += self.conflict_tracker.remove([aircraft.id for aircraft in aircraft_to_remove],
+                                                         self.time_step)
+        self.conflicts = self.conflict_tracker.conflicts
+        self.NMACs = self.conflict_tracker.NMACs
         # reward = [e.reward for e in self.aircraft_dict]
 
-        # info_dist_list is the min_dist to other aircraft for each aircraft.
-        return reward, False, info_dist_list
+        # info is the min_dist to other aircraft for each aircraft.
+        return reward, False, min_dist.tolist()
 
     def render(self, mode='human'):
+        if mode == 'rgb_array':
+            # headless NumPy drawing, no display needed (see offscreen.py)
+            from offscreen import FrameRasterizer, fleet_snapshot
+            from trajectory_recorder import scene_info
+            if self.rasterizer is None:
+                self.rasterizer = FrameRasterizer(scene_info(self), num_colors=self.num_aircraft)
+            return self.rasterizer.draw(fleet_snapshot(self))
+
         from gym.envs.classic_control import rendering
-        from colour import Color
-        red = Color('red')
-        colors = list(red.range_to(Color('green'), self.num_aircraft))
+        from render_cache import RenderCache
 
         if self.viewer is None:
             self.viewer = rendering.Viewer(self.window_width, self.window_height)
             self.viewer.set_bounds(0, self.window_width, 0, self.window_height)
-
-        import os
-        __location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+            self.render_cache = RenderCache(self.viewer, self.num_aircraft)
+        cache = self.render_cache
 
         # plot the annulus
-        # inner_circle_img = rendering.make_circle(radius=10000 / Config.scale, res=50, filled=False)
-        # outer_circle_img = rendering.make_circle(radius=15000 / Config.scale, res=50, filled=False)
+        # inner_circle_img = rendering.make_circle(radius=10000 / self.config.scale, res=50, filled=False)
+        # outer_circle_img = rendering.make_circle(radius=15000 / self.config.scale, res=50, filled=False)
         # jtransform = rendering.Transform(rotation=0, translation=(400, 400))
         # inner_circle_img.add_attr(jtransform)
         # outer_circle_img.add_attr(jtransform)
-        # self.viewer.onetime_geoms.append(inner_circle_img)
-        # self.viewer.onetime_geoms.append(outer_circle_img)
+        # self.viewer.add_geom(inner_circle_img)
+        # self.viewer.add_geom(outer_circle_img)
 
-        # draw all the aircraft
+        # draw all the aircraft, reusing the sprite of each aircraft and only moving its transform
         for id, aircraft in self.aircraft_dict.ac_dict.items():
-            aircraft_img = rendering.Image(os.path.join(__location__, 'images/aircraft.png'), 32, 32)
-            jtransform = rendering.Transform(rotation=aircraft.heading - math.pi / 2, translation=aircraft.position)
-            aircraft_img.add_attr(jtransform)
-            r, g, b = colors[aircraft.id % self.num_aircraft].get_rgb()
-            # r, g, b = black.get_rgb()
+            r, g, b = cache.colors[aircraft.id % self.num_aircraft]
+            aircraft_img = cache.sprite(('aircraft', id), 'aircraft.png', 32)
+            aircraft_img.transform.set_translation(aircraft.position[0], aircraft.position[1])
+            aircraft_img.transform.set_rotation(aircraft.heading - math.pi / 2)
             aircraft_img.set_color(r, g, b)
-            self.viewer.onetime_geoms.append(aircraft_img)
+            self.viewer.add_onetime(aircraft_img)
 
-            goal_img = rendering.Image(os.path.join(__location__, 'images/goal.png'), 20, 20)
-            jtransform = rendering.Transform(rotation=0, translation=aircraft.goal.position)
-            goal_img.add_attr(jtransform)
+            goal_img = cache.sprite(('goal', id), 'goal.png', 20)
+            goal_img.transform.set_translation(aircraft.goal.position[0], aircraft.goal.position[1])
             goal_img.set_color(r, g, b)
-            self.viewer.onetime_geoms.append(goal_img)
+            self.viewer.add_onetime(goal_img)
 
             # plot the line connecting aircraft and its goal
             # line = rendering.DashedLine(start=aircraft.position, end=aircraft.goal.position)
             # self.viewer.onetime_geoms.append(line)
 
+        cache.release(self.aircraft_dict.ac_dict)
+
         return self.viewer.render(return_rgb_array=False)
 
     def draw_point(self, point):
@@ -290,7 +336,7 @@ class MultiAircraftEnv(gym.Env):
             self.viewer = rendering.Viewer(self.window_width, self.window_height)
             self.viewer.set_bounds(0, self.window_width, 0, self.window_height)
 
-        img = self.viewer.draw_polygon(Config.point)
+        img = self.viewer.draw_polygon(self.config.point)
         jtransform = rendering.Transform(rotation=0, translation=point)
         img.add_attr(jtransform)
         self.viewer.onetime_geoms.append(img)
@@ -301,8 +347,13 @@ class MultiAircraftEnv(gym.Env):
         if self.viewer:
             self.viewer.close()
             self.viewer = None
+            self.render_cache = None
 
     # dist to all the aircraft
+    def fleet_positions(self):
+        # n by 2 array of the positions of all aircraft
+        return np.array([aircraft.position for aircraft in self.aircraft_dict.ac_dict.values()]).reshape(-1, 2)
+
     def dist_to_all_aircraft(self, aircraft):
         id_list = []
         dist_list = []
@@ -326,16 +377,16 @@ class MultiAircraftEnv(gym.Env):
     #     return np.linalg.norm(np.array(pos1) - np.array(pos2))
 
     def random_pos(self):
-        return np.random.uniform(
+        return self.rng.uniform(
             low=np.array([0, 0]),
             high=np.array([self.window_width, self.window_height])
         )
 
     def random_speed(self):
-        return np.random.uniform(low=self.min_speed, high=self.max_speed)
+        return self.rng.uniform(low=self.min_speed, high=self.max_speed)
 
     def random_heading(self):
-        return np.random.uniform(low=0, high=2 * math.pi)
+        return self.rng.uniform(low=0, high=2 * math.pi)
 
     def build_observation_space(self):
         s = spaces.Dict({
@@ -354,7 +405,9 @@ class MultiAircraftEnv(gym.Env):
 
 class Aircraft:
     def __init__(self, id, position, speed, heading, goal_pos, goal_vertiport_id=-1, sector_id=-1, priority=0, route=0,
-                 start_time=0):
+                 start_time=0, config=Config, rng=GLOBAL_RNG):
+        self.config = config
+        self.rng = rng
         self.id = id
         self.position = np.array(position, dtype=np.float32)
         self.speed = speed
@@ -376,21 +429,19 @@ class Aircraft:
 
         self.load_config()
 
-        self.conflict_id_set = set()  # store the id of all aircraft currently in conflict
-
     def load_config(self):
-        self.G = Config.G
-        self.scale = Config.scale
-        self.min_speed = Config.min_speed
-        self.max_speed = Config.max_speed
-        self.speed_sigma = Config.speed_sigma
-        # self.position_sigma = Config.position_sigma
-        self.d_heading = Config.d_heading
+        self.G = self.config.G
+        self.scale = self.config.scale
+        self.min_speed = self.config.min_speed
+        self.max_speed = self.config.max_speed
+        self.speed_sigma = self.config.speed_sigma
+        # self.position_sigma = self.config.position_sigma
+        self.d_heading = self.config.d_heading
 
     def step(self, a=1):
         self.speed = max(self.min_speed, min(self.speed, self.max_speed))  # project to range
-        self.speed += np.random.normal(0, self.speed_sigma)  # uncertainty
-        self.heading += (a - 1) * self.d_heading + np.random.normal(0, Config.heading_sigma)  # change heading
+        self.speed += self.rng.normal(0, self.speed_sigma)  # uncertainty
+        self.heading += (a - 1) * self.d_heading + self.rng.normal(0, self.config.heading_sigma)  # change heading
         vx = self.speed * math.cos(self.heading)
         vy = self.speed * math.sin(self.heading)
         self.velocity = np.array([vx, vy])
@@ -1,6 +1,8 @@
 import math
 import numpy as np
 
+from hex_network import load_hex_network
+
 print('loading hexagon sector vertiport configuration')
 
 
@@ -23,28 +25,22 @@ class Config:
     no_episodes = 1000000
 
     # airspace setting
-    window_width = 800
-    window_height = 800
-    diagonal = window_height * math.sqrt(2)
+    hex_rings = 1
+    hex_spacing = 300  # distance between neighbouring vertiports
+    # window_width, window_height and diagonal are derived from the rings (see derive)
     num_aircraft = 10
     EPISODES = 1000000
     G = 9.8
     tick = 30
     scale = 60  # 1 pixel = 60 meters
 
-    # distance param
-    minimum_separation = 926 / scale
-    NMAC_dist = 150 / scale
-    horizon_dist = 4000 / scale
-    initial_min_dist = 3000 / scale
-    goal_radius = 600 / scale
+    # distance param, derived from meters with scale (see derive): minimum_separation 926 m, NMAC_dist 150 m,
+    # horizon_dist 4000 m, initial_min_dist 3000 m, goal_radius 600 m, and proximity_radius
+    # 5 * minimum_separation (info reports the distance to the closest aircraft within it)
 
-    # speed
-    init_speed = 190 / 3.6 / scale
-    min_speed = 45 / scale
-    max_speed = 220 / 3.6 / scale
+    # speed, derived with scale (see derive): init_speed 190 km/h, min_speed 45 m/s, max_speed 220 km/h,
+    # speed_sigma 5 m/s
     # d_speed = 0 / scale
-    speed_sigma = 5 / scale
     # position_sigma = 0 / scale
 
     # heading in rad TBD
@@ -56,7 +52,31 @@ class Config:
     search_depth = 3
     no_simulations_lite = 30
     search_depth_lite = 2
+    # weights (.npz) of the prior and value network of the PUCT search (policy_net.py), None for UCT with random
+    # rollouts. The network values replace the rollouts, so far fewer simulations are needed
+    policy_net = None
+    c_puct = 1.5
+    leaf_batch = 8  # leaves evaluated together by the network
+    # weights (.npz) of a policy distilled from the searches (distill.py), None to search every aircraft. The
+    # aircraft that would get the lite search take the action of the policy instead, unless its highest prior is
+    # below policy_min_confidence
+    distilled_policy = None
+    policy_min_confidence = 0.
     simulate_frame = 10
+    # search trees of compact states: only the ownship is simulated per node, the other aircraft follow one
+    # trajectory shared by the tree (see CompactAircraftState in nodesHexSecGatePlus.py)
+    compact_nodes = False
+    # sampled futures of the aircraft of a sector drawn once per decision epoch and shared by the searches of all
+    # ownships of the sector, which then only simulate the ownship (compact states), 0 to not share
+    sector_futures = 0
+    # a decision epoch (every 5 time steps of 1 s) should be planned within this time, in ms
+    decision_deadline = 5000
+    # aircraft closer than full_search_dist (case study 1) / full_search_dist_two_stage (case study 2) to
+    # another one get the full search, derived from minimum_separation (see derive)
+
+    # conflict prediction (see cpa.py): pairs whose closest point of approach within cpa_horizon time steps
+    # is closer than cpa_radius are published each decision epoch, aircraft closer than cpa_alert_dist get
+    # the full search. All three are derived (see derive)
 
     # reward setting
     NMAC_penalty = -10 / 10
@@ -70,38 +90,27 @@ class Config:
 
     n_closest = 4
 
-    # vertiport parameter
-    start_safe_dist = 3 * minimum_separation
+    # vertiport parameter (start_safe_dist is derived, see derive)
     time_interval_lower = 60
     time_interval_upper = 120
-    vertiport_loc = np.zeros([7, 2])
-    vertiport_center = np.array([window_width / 2, window_height / 2])
-    vertiport_loc[0, :] = vertiport_center
-    for i in range(1, 7):
-        vertiport_loc[i, :] = pointy_hex_corner(vertiport_center, size=300, i=i)
-
-    # point
+    # departure process of each vertiport (see demand.py):
+    # 'uniform' (time_interval_lower/upper), 'poisson' (poisson_rate) or 'profile' (demand_profile)
+    arrival_process = 'uniform'
+    poisson_rate = 1 / 90  # departures per second
+    demand_profile = [1 / 300] * 6 + [1 / 60] * 4 + [1 / 90] * 6 + [1 / 60] * 4 + [1 / 180] * 4  # per hour of the day
+    demand_profile_period = 3600
+    spawn_retry_delay = 1  # seconds before a blocked departure is retried
+
+    # point (the polygon point is derived from point_len)
     point_len = 4
-    point = np.array([[-point_len, -point_len],
-                      [point_len, -point_len],
-                      [point_len, point_len],
-                      [-point_len, point_len],
-                      [-point_len, -point_len]])
 
-    # square
+    # square (the polygon vertices are derived from square_len and sector_exit_len)
     square_len = 5
     sector_exit_len = 15
-    vertices = np.array([[-sector_exit_len, -square_len],
-                         [sector_exit_len, -square_len],
-                         [sector_exit_len, square_len],
-                         [-sector_exit_len, square_len],
-                         [-sector_exit_len, -square_len]])
 
-    # sector vertices
-    sector_vertices = np.zeros([7, 6, 2])
-    for i in range(7):
-        for j in range(6):
-            sector_vertices[i, j, :] = pointy_hex_corner2(vertiport_loc[i], size=300 / np.sqrt(3), i=j)
+    # hexagon sector network: one vertiport per sector, hex_rings rings of sectors around the center sector
+    # (hex_rings = 1 is the original 7 sector layout), see hex_network.py. network, vertiport_center,
+    # vertiport_loc, sector_vertices, sector_adjacency and sector_len_exits are derived (see derive)
 
     # sector_len_exits = {
     #     0: np.array(
@@ -214,153 +223,72 @@ class Config:
     #           [608.66025404, 279.52994616]]]
     #     )}
 
-    sector_len_exits = {
-        0: np.array(
-            [[[550., 371.13248654],
-              [550., 356.13248654],
-              [550., 386.13248654]],
-
-             [[500., 515.47005384],
-              [512.99038106, 507.97005384],
-              [487.00961894, 522.97005384]],
-
-             [[350., 544.3375673],
-              [362.99038106, 551.8375673],
-              [337.00961894, 536.8375673]],
-
-             [[250., 428.86751346],
-              [250., 443.86751346],
-              [250., 413.86751346]],
-
-             [[300., 284.52994616],
-              [287.00961894, 292.02994616],
-              [312.99038106, 277.02994616]],
-
-             [[450., 255.6624327],
-              [437.00961894, 248.1624327],
-              [462.99038106, 263.1624327]]]
-        ),
-
-        1: np.array(
-            [[[400., 688.67513459],
-              [400., 703.67513459],
-              [400., 673.67513459]],
-
-             [[450., 544.3375673],
-              [437.00961894, 551.8375673],
-              [462.99038106, 536.8375673]],
-
-             [[600., 515.47005384],
-              [587.00961894, 507.97005384],
-              [612.99038106, 522.97005384]]]
-        ),
-
-        2: np.array(
-            [[[150., 544.3375673],
-              [137.00961894, 551.8375673],
-              [162.99038106, 536.8375673]],
-
-             [[300., 515.47005384],
-              [287.00961894, 507.97005384],
-              [312.99038106, 522.97005384]],
-
-             [[400., 630.94010768],
-              [400., 615.94010768],
-              [400., 645.94010768]]]
-        ),
-
-        3: np.array(
-            [[[150., 255.6624327],
-              [137.00961894, 248.1624327],
-              [162.99038106, 263.1624327]],
-
-             [[250., 371.13248654],
-              [250., 356.13248654],
-              [250., 386.13248654]],
-
-             [[200., 515.47005384],
-              [212.99038106, 507.97005384],
-              [187.00961894, 522.97005384]]]
-        ),
-
-        4: np.array(
-            [[[400., 111.32486541],
-              [400., 96.32486541],
-              [400., 126.32486541]],
-
-             [[350., 255.6624327],
-              [362.99038106, 248.1624327],
-              [337.00961894, 263.1624327]],
-
-             [[200., 284.52994616],
-              [212.99038106, 292.02994616],
-              [187.00961894, 277.02994616]]]
-        ),
-
-        5: np.array(
-            [[[650., 255.6624327],
-              [662.99038106, 248.1624327],
-              [637.00961894, 263.1624327]],
-
-             [[500., 284.52994616],
-              [512.99038106, 292.02994616],
-              [487.00961894, 277.02994616]],
-
-             [[400., 169.05989232],
-              [400., 184.05989232],
-              [400., 154.05989232]]]
-        ),
-
-        6: np.array(
-            [[[650., 544.3375673],
-              [662.99038106, 551.8375673],
-              [637.00961894, 536.8375673]],
-
-             [[550., 428.86751346],
-              [550., 443.86751346],
-              [550., 413.86751346]],
-
-             [[600., 284.52994616],
-              [587.00961894, 292.02994616],
-              [612.99038106, 277.02994616]]]
-        )}
-
-    sector_entries = {
-        0: np.array(
-            [[550., 428.86751346],
-             [450., 544.3375673],
-             [300., 515.47005384],
-             [250., 371.13248654],
-             [350., 255.6624327],
-             [500., 284.52994616]]
-        ),
-        1: np.array(
-            [[400., 630.94010768],
-             [500., 515.47005384],
-             [650., 544.3375673]]
-        ),
-        2: np.array(
-            [[200., 515.47005384],
-             [350., 544.3375673],
-             [400., 688.67513459]]
-        ),
-        3: np.array(
-            [[200., 284.52994616],
-             [250., 428.86751346],
-             [150., 544.3375673]]
-        ),
-        4: np.array(
-            [[400., 169.05989232],
-             [300., 284.52994616],
-             [150., 255.6624327]]
-        ),
-        5: np.array(
-            [[600., 284.52994616],
-             [450., 255.6624327],
-             [400., 111.32486541]]
-        ),
-        6: np.array(
-            [[600., 515.47005384],
-             [550., 371.13248654],
-             [650., 255.6624327]]
-        )}
+    # parameters set with replace(), derive() leaves them as they are
+    replaced = {}
+
+    @classmethod
+    def derive(cls):
+        """
+        set the parameters derived from other ones (distances and speeds from scale, window size and sector
+        network from the rings, distances from minimum_separation, ...), except the replaced ones. Run once below
+        and by replace()
+        """
+        def derived(key, value):
+            if key not in cls.replaced:
+                setattr(cls, key, value)
+
+        # distances in pixels and speeds in pixels per time step, from meters and meters per second
+        derived('minimum_separation', 926 / cls.scale)
+        derived('NMAC_dist', 150 / cls.scale)
+        derived('horizon_dist', 4000 / cls.scale)
+        derived('initial_min_dist', 3000 / cls.scale)
+        derived('goal_radius', 600 / cls.scale)
+        derived('init_speed', 190 / 3.6 / cls.scale)
+        derived('min_speed', 45 / cls.scale)
+        derived('max_speed', 220 / 3.6 / cls.scale)
+        derived('speed_sigma', 5 / cls.scale)
+        derived('window_width', 2 * cls.hex_rings * cls.hex_spacing + 200)
+        derived('window_height', 2 * cls.hex_rings * cls.hex_spacing + 200)
+        derived('diagonal', cls.window_height * math.sqrt(2))
+        derived('proximity_radius', 5 * cls.minimum_separation)
+        derived('full_search_dist', 2 * cls.minimum_separation)
+        derived('full_search_dist_two_stage', 5 * cls.minimum_separation)
+        derived('cpa_horizon', cls.search_depth * cls.simulate_frame)
+        derived('cpa_radius', 3 * cls.minimum_separation)
+        derived('cpa_alert_dist', 2 * cls.minimum_separation)
+        derived('start_safe_dist', 3 * cls.minimum_separation)
+        derived('vertiport_center', np.array([cls.window_width / 2, cls.window_height / 2]))
+        derived('point', np.array([[-cls.point_len, -cls.point_len],
+                                   [cls.point_len, -cls.point_len],
+                                   [cls.point_len, cls.point_len],
+                                   [-cls.point_len, cls.point_len],
+                                   [-cls.point_len, -cls.point_len]]))
+        derived('vertices', np.array([[-cls.sector_exit_len, -cls.square_len],
+                                      [cls.sector_exit_len, -cls.square_len],
+                                      [cls.sector_exit_len, cls.square_len],
+                                      [-cls.sector_exit_len, cls.square_len],
+                                      [-cls.sector_exit_len, -cls.square_len]]))
+        derived('network', load_hex_network(cls.hex_rings, cls.hex_spacing, cls.vertiport_center,
+                                            cls.sector_exit_len))
+        derived('vertiport_loc', cls.network.vertiport_loc)
+        derived('sector_vertices', cls.network.sector_vertices)
+        derived('sector_adjacency', cls.network.adjacency)
+        # gates of each sector, [center, end 1, end 2], generated by hex_network.py
+        derived('sector_len_exits', cls.network.gate_dict())
+
+    @classmethod
+    def replace(cls, **overrides):
+        """
+        a copy of this configuration with some parameters replaced, to pass to a simulator or a planner of its
+        own (config=...) instead of changing the parameters of every one in the process. The parameters derived
+        from a replaced one (e.g. cpa_radius from minimum_separation) are derived again, unless replaced too
+        """
+        for key in overrides:
+            if not hasattr(cls, key) or key == 'replaced':
+                raise ValueError('unknown Config parameter: %s' % key)
+        config = type(cls.__name__, (cls,), dict(overrides, replaced=dict(cls.replaced, **overrides)))
+        config.derive()
+        return config
+
+
+Config.derive()
@@ -15,18 +15,10 @@ class Config:
     tick = 30
     scale = 30
 
-    # distance param
-    minimum_separation = 555/scale
-    NMAC_dist = 150/scale
-    horizon_dist = 4000/scale
-    initial_min_dist = 3000/scale
-    goal_radius = 600/scale
-
-    # speed
-    init_speed = 60/scale
-    min_speed = 50/scale
-    max_speed = 80/scale
-    d_speed = 5/scale
+    # distance param, derived from meters with scale (see derive): minimum_separation 555, NMAC_dist 150,
+    # horizon_dist 4000, initial_min_dist 3000, goal_radius 600
+
+    # speed, derived with scale (see derive): init_speed 60, min_speed 50, max_speed 80, d_speed 5
     speed_sigma = 0
     position_sigma = 0
 
@@ -46,3 +38,43 @@ class Config:
     step_penalty = -0.01
     goal_reward = 20
     sparse_reward = True
+
+    # parameters set with replace(), derive() leaves them as they are
+    replaced = {}
+
+    @classmethod
+    def derive(cls):
+        """
+        set the parameters derived from other ones (distances and speeds from scale), except the replaced ones.
+        Run once below and by replace()
+        """
+        def derived(key, value):
+            if key not in cls.replaced:
+                setattr(cls, key, value)
+
+        derived('minimum_separation', 555/cls.scale)
+        derived('NMAC_dist', 150/cls.scale)
+        derived('horizon_dist', 4000/cls.scale)
+        derived('initial_min_dist', 3000/cls.scale)
+        derived('goal_radius', 600/cls.scale)
+        derived('init_speed', 60/cls.scale)
+        derived('min_speed', 50/cls.scale)
+        derived('max_speed', 80/cls.scale)
+        derived('d_speed', 5/cls.scale)
+
+    @classmethod
+    def replace(cls, **overrides):
+        """
+        a copy of this configuration with some parameters replaced, to pass to a simulator or a planner of its
+        own (config=...) instead of changing the parameters of every one in the process. The parameters derived
+        from a replaced one (e.g. minimum_separation from scale) are derived again, unless replaced too
+        """
+        for key in overrides:
+            if not hasattr(cls, key) or key == 'replaced':
+                raise ValueError('unknown Config parameter: %s' % key)
+        config = type(cls.__name__, (cls,), dict(overrides, replaced=dict(cls.replaced, **overrides)))
+        config.derive()
+        return config
+
+
+Config.derive()
@@ -18,26 +18,20 @@ class Config:
     # airspace setting
     window_width = 800
     window_height = 800
-    diagonal = window_height * math.sqrt(2)
+    # diagonal is derived from the window size (see derive)
     num_aircraft = 10
     EPISODES = 1000000
     G = 9.8
     tick = 30
     scale = 60  # 1 pixel = 60 meters
 
-    # distance param
-    minimum_separation = 926 / scale
-    NMAC_dist = 150 / scale
-    horizon_dist = 4000 / scale
-    initial_min_dist = 3000 / scale
-    goal_radius = 600 / scale
-
-    # speed
-    init_speed = 190 / 3.6 / scale
-    min_speed = 45 / scale
-    max_speed = 220 / 3.6 / scale
+    # distance param, derived from meters with scale (see derive): minimum_separation 926 m, NMAC_dist 150 m,
+    # horizon_dist 4000 m, initial_min_dist 3000 m, goal_radius 600 m, and proximity_radius
+    # 5 * minimum_separation (info reports the distance to the closest aircraft within it)
+
+    # speed, derived with scale (see derive): init_speed 190 km/h, min_speed 45 m/s, max_speed 220 km/h,
+    # speed_sigma 5 m/s
     # d_speed = 0 / scale
-    speed_sigma = 5 / scale
     # position_sigma = 0 / scale
 
     # heading in rad TBD
@@ -49,7 +43,20 @@ class Config:
     search_depth = 3
     no_simulations_lite = 30
     search_depth_lite = 2
+    # weights (.npz) of the prior and value network of the PUCT search (policy_net.py), None for UCT with random
+    # rollouts. The network values replace the rollouts, so far fewer simulations are needed
+    policy_net = None
+    c_puct = 1.5
+    leaf_batch = 8  # leaves evaluated together by the network
+    # weights (.npz) of a policy distilled from the searches (distill.py), None to search every aircraft. The
+    # aircraft that would get the lite search take the action of the policy instead, unless its highest prior is
+    # below policy_min_confidence
+    distilled_policy = None
+    policy_min_confidence = 0.
     simulate_frame = 10
+    # a decision epoch (every 5 time steps of 1 s) should be planned within this time, in ms
+    decision_deadline = 5000
+    # aircraft closer than full_search_dist (3 * minimum_separation, derived) to another one get the full search
 
     # reward setting
     NMAC_penalty = -10 / 10
@@ -63,31 +70,15 @@ class Config:
 
     n_closest = 4
 
-    # vertiport parameter
-    start_safe_dist = 3 * minimum_separation
+    # vertiport parameter (start_safe_dist, vertiport_center and vertiport_loc are derived, see derive)
     time_interval_lower = 60
     time_interval_upper = 120
-    vertiport_loc = np.zeros([7, 2])
-    vertiport_center = np.array([window_width / 2, window_height / 2])
-    vertiport_loc[0, :] = vertiport_center
-    for i in range(1, 7):
-        vertiport_loc[i, :] = pointy_hex_corner(vertiport_center, size=300, i=i)
 
-    # point
+    # point (the polygon point is derived from point_len)
     point_len = 4
-    point = np.array([[-point_len, -point_len],
-                      [point_len, -point_len],
-                      [point_len, point_len],
-                      [-point_len, point_len],
-                      [-point_len, -point_len]])
 
-    # square
+    # square (the polygon vertices are derived from square_len)
     square_len = 5
-    vertices = np.array([[-square_len, -square_len],
-                         [square_len, -square_len],
-                         [square_len, square_len],
-                         [-square_len, square_len],
-                         [-square_len, -square_len]])
     sector_exit_len = 10
 
     # sector vertices
@@ -275,3 +266,65 @@ class Config:
          [[580., 503.92304845],
           [571.33974596, 498.92304845],
           [588.66025404, 508.92304845]]]])
+
+    # parameters set with replace(), derive() leaves them as they are
+    replaced = {}
+
+    @classmethod
+    def derive(cls):
+        """
+        set the parameters derived from other ones (distances and speeds from scale, distances from
+        minimum_separation, vertiports from the window size, ...), except the replaced ones. Run once below and
+        by replace()
+        """
+        def derived(key, value):
+            if key not in cls.replaced:
+                setattr(cls, key, value)
+
+        # distances in pixels and speeds in pixels per time step, from meters and meters per second
+        derived('minimum_separation', 926 / cls.scale)
+        derived('NMAC_dist', 150 / cls.scale)
+        derived('horizon_dist', 4000 / cls.scale)
+        derived('initial_min_dist', 3000 / cls.scale)
+        derived('goal_radius', 600 / cls.scale)
+        derived('init_speed', 190 / 3.6 / cls.scale)
+        derived('min_speed', 45 / cls.scale)
+        derived('max_speed', 220 / 3.6 / cls.scale)
+        derived('speed_sigma', 5 / cls.scale)
+        derived('diagonal', cls.window_height * math.sqrt(2))
+        derived('proximity_radius', 5 * cls.minimum_separation)
+        derived('full_search_dist', 3 * cls.minimum_separation)
+        derived('start_safe_dist', 3 * cls.minimum_separation)
+        derived('vertiport_center', np.array([cls.window_width / 2, cls.window_height / 2]))
+        vertiport_loc = np.zeros([7, 2])
+        vertiport_loc[0, :] = cls.vertiport_center
+        for i in range(1, 7):
+            vertiport_loc[i, :] = pointy_hex_corner(cls.vertiport_center, size=300, i=i)
+        derived('vertiport_loc', vertiport_loc)
+        derived('point', np.array([[-cls.point_len, -cls.point_len],
+                                   [cls.point_len, -cls.point_len],
+                                   [cls.point_len, cls.point_len],
+                                   [-cls.point_len, cls.point_len],
+                                   [-cls.point_len, -cls.point_len]]))
+        derived('vertices', np.array([[-cls.square_len, -cls.square_len],
+                                      [cls.square_len, -cls.square_len],
+                                      [cls.square_len, cls.square_len],
+                                      [-cls.square_len, cls.square_len],
+                                      [-cls.square_len, -cls.square_len]]))
+
+    @classmethod
+    def replace(cls, **overrides):
+        """
+        a copy of this configuration with some parameters replaced, to pass to a simulator or a planner of its
+        own (config=...) instead of changing the parameters of every one in the process. The parameters derived
+        from a replaced one (e.g. full_search_dist from minimum_separation) are derived again, unless replaced too
+        """
+        for key in overrides:
+            if not hasattr(cls, key) or key == 'replaced':
+                raise ValueError('unknown Config parameter: %s' % key)
+        config = type(cls.__name__, (cls,), dict(overrides, replaced=dict(cls.replaced, **overrides)))
+        config.derive()
+        return config
+
+
+Config.derive()
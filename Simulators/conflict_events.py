@@ -0,0 +1,62 @@
+"""
+Pair-level conflict state of the simulators.
+
+Losses of separation are tracked per aircraft pair (id1 < id2) from the list of pairs closer than the
+minimum separation at each time step, so every conflict and NMAC is counted once and the work per step
+depends on the number of close pairs and active conflicts, not on the square of the fleet size.
+"""
+
+# kind of the events in MultiAircraftEnv.step_events and in recorded event tables
+EVENT_CONFLICT = 0  # a pair lost separation
+EVENT_NMAC = 1  # a pair came closer than NMAC_dist
+EVENT_CONFLICT_END = 2  # a pair regained separation (or one of the aircraft left), dist is the minimum reached
+
+
+class ConflictTracker:
+    def __init__(self):
+        self.active = {}  # {(id1, id2): [begin step, minimum distance so far]}
+        self.conflicts = 0
+        self.NMACs = 0
+
+    def update(self, step, id_pairs, dists, NMAC_dist):
+        """
+        id_pairs: (id1, id2) with id1 < id2 of the pairs closer than the minimum separation at this step,
+        dists: their distance.
+        return the events of this step as (kind, id1, id2, dist, duration) tuples
+        """
+        events = []
+        current = set()
+        for (id1, id2), dist in zip(id_pairs, dists):
+            pair = (int(id1), int(id2))
+            dist = float(dist)
+            current.add(pair)
+            state = self.active.get(pair)
+            if state is None:
+                state = self.active[pair] = [step, dist]
+                self.conflicts += 1
+                events.append((EVENT_CONFLICT, pair[0], pair[1], dist, 0))
+            elif dist < state[1]:
+                state[1] = dist
+            if dist < NMAC_dist:
+                self.NMACs += 1
+                events.append((EVENT_NMAC, pair[0], pair[1], dist, step - state[0]))
+
+        for pair in [pair for pair in self.active if pair not in current]:
+            events.append(self._end(pair, step))
+        return events
+
+    def remove(self, ids, step):
+        # end the conflicts of aircraft that left the airspace (goal or NMAC)
+        ids = set(ids)
+        return [self._end(pair, step) for pair in list(self.active) if pair[0] in ids or pair[1] in ids]
+
+    def _end(self, pair, step):
+        begin, min_dist = self.active.pop(pair)
+        return EVENT_CONFLICT_END, pair[0], pair[1], min_dist, step - begin
+
+    def in_conflict(self):
+        # ids of the aircraft currently in conflict
+        return set(id for pair in self.active for id in pair)
+
+    def __repr__(self):
+        return 'conflicts: %d, NMACs: %d, active: %d' % (self.conflicts, self.NMACs, len(self.active))
@@ -0,0 +1,117 @@
+"""
+Closest point of approach (CPA) conflict prediction.
+
+For every pair of aircraft that could meet within the look-ahead horizon, the time to CPA and the miss
+distance are computed from the current positions and velocities, assuming both aircraft keep their
+velocity. Pairs are found with a uniform grid whose cells are as large as the distance two aircraft can
+close within the horizon, so only aircraft in neighbouring cells are compared.
+"""
+
+import numpy as np
+
+CPA_DTYPE = np.dtype([('id1', np.int64), ('id2', np.int64),
+                      ('t_cpa', np.float64),  # time steps until the closest point of approach, in [0, horizon]
+                      ('d_cpa', np.float64),  # miss distance
+                      ('dist', np.float64)])  # current distance
+
+# cell offsets that visit every pair of neighbouring cells once
+HALF_NEIGHBORHOOD = [(0, 0), (1, -1), (1, 0), (1, 1), (0, 1)]
+
+
+def candidate_pairs(positions, reach):
+    """
+    index pairs (i < j) of the points closer than reach, (m, 2) array
+    """
+    n = positions.shape[0]
+    if n < 2:
+        return np.empty((0, 2), dtype=np.int64)
+
+    cells = np.floor(positions / reach).astype(np.int64)
+    cells -= cells.min(axis=0) - 1
+    width = cells[:, 1].max() + 2
+    keys = cells[:, 0] * width + cells[:, 1]
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+
+    pairs = []
+    for dx, dy in HALF_NEIGHBORHOOD:
+        neighbor_keys = (cells[:, 0] + dx) * width + cells[:, 1] + dy
+        lo = np.searchsorted(sorted_keys, neighbor_keys, side='left')
+        counts = np.searchsorted(sorted_keys, neighbor_keys, side='right') - lo
+        i = np.repeat(np.arange(n), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        j = order[np.repeat(lo, counts) + offsets]
+        if (dx, dy) == (0, 0):
+            keep = i < j
+            i, j = i[keep], j[keep]
+        pairs.append(np.stack([np.minimum(i, j), np.maximum(i, j)], axis=1))
+    pairs = np.concatenate(pairs)
+
+    diff = positions[pairs[:, 1]] - positions[pairs[:, 0]]
+    return pairs[np.hypot(diff[:, 0], diff[:, 1]) < reach]
+
+
+def closest_approach(positions, velocities, pairs, horizon):
+    # time to CPA (clipped to [0, horizon]), miss distance and current distance of each index pair
+    dp = positions[pairs[:, 1]] - positions[pairs[:, 0]]
+    dv = velocities[pairs[:, 1]] - velocities[pairs[:, 0]]
+    dv2 = (dv * dv).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(dv2 > 1e-12, -(dp * dv).sum(axis=1) / dv2, 0)
+    t = np.clip(t, 0, horizon)
+    miss = dp + dv * t[:, None]
+    return t, np.hypot(miss[:, 0], miss[:, 1]), np.hypot(dp[:, 0], dp[:, 1])
+
+
+def cpa_table(ids, positions, velocities, horizon, radius, max_speed):
+    """
+    sparse table (CPA_DTYPE rows, id1 < id2) of the pairs whose miss distance within horizon time steps is
+    below radius, sorted by time to CPA
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+    velocities = np.asarray(velocities, dtype=np.float64).reshape(-1, 2)
+
+    pairs = candidate_pairs(positions, radius + 2 * max_speed * horizon)
+    t, d, dist = closest_approach(positions, velocities, pairs, horizon)
+    keep = d < radius
+    pairs, t, d, dist = pairs[keep], t[keep], d[keep], dist[keep]
+
+    table = np.empty(pairs.shape[0], dtype=CPA_DTYPE)
+    id1, id2 = ids[pairs[:, 0]], ids[pairs[:, 1]]
+    table['id1'] = np.minimum(id1, id2)
+    table['id2'] = np.maximum(id1, id2)
+    table['t_cpa'] = t
+    table['d_cpa'] = d
+    table['dist'] = dist
+    return table[np.argsort(t, kind='stable')]
+
+
+class ConflictTable:
+    """
+    CPA table of one decision epoch, with the aircraft id of each row of the observation of every sector
+    (row_ids[sector_id]) so that the agent can map the table onto its search states
+    """
+
+    def __init__(self, table, row_ids=None):
+        self.table = table
+        self.row_ids = row_ids if row_ids is not None else {}
+        self.partners = {}
+        for row in table:
+            self.partners.setdefault(int(row['id1']), []).append(row)
+            self.partners.setdefault(int(row['id2']), []).append(row)
+
+    def alert_ids(self, alert_dist):
+        # aircraft predicted to come closer than alert_dist to another one within the horizon
+        alert = self.table[self.table['d_cpa'] < alert_dist]
+        return set(alert['id1'].tolist()) | set(alert['id2'].tolist())
+
+    def intruders(self, id):
+        # ids of the aircraft in the table together with id
+        return set(int(row['id1']) if row['id2'] == id else int(row['id2']) for row in self.partners.get(id, []))
+
+    def __len__(self):
+        return self.table.shape[0]
+
+    def __repr__(self):
+        return 'conflict table: %d pairs' % len(self)
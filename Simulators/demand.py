@@ -0,0 +1,131 @@
+"""
+Vertiport departure demand driven by an event queue.
+
+Instead of ticking a clock at every vertiport every second, the next departure time of each vertiport is
+kept in a priority queue, so the cost per time step depends on the number of departures due, not on the
+number of vertiports. The time between departures comes from a pluggable arrival process.
+"""
+
+import heapq
+import math
+
+import numpy as np
+
+from rng import GLOBAL_RNG
+
+
+class UniformInterval:
+    # time between departures drawn uniformly from [lower, upper] seconds
+    def __init__(self, lower, upper):
+        self.lower = lower
+        self.upper = upper
+
+    def next_interval(self, now, rng=GLOBAL_RNG):
+        return rng.uniform(self.lower, self.upper)
+
+
+class PoissonArrivals:
+    # departures form a Poisson process with rate departures per second
+    def __init__(self, rate):
+        self.rate = rate
+
+    def next_interval(self, now, rng=GLOBAL_RNG):
+        return rng.exponential(1.0 / self.rate)
+
+
+class TimeOfDayProfile:
+    """
+    non-homogeneous Poisson process: rates[k] departures per second during the k-th period (of period
+    seconds) of the day, repeated every len(rates) periods. Sampled by thinning.
+    """
+
+    def __init__(self, rates, period=3600):
+        self.rates = np.asarray(rates, dtype=np.float64)
+        if self.rates.size == 0 or (self.rates < 0).any() or not (self.rates > 0).any():
+            # thinning needs a positive maximum rate, an all-zero profile would never schedule a departure
+            raise ValueError('demand profile rates must be non-negative with at least one positive rate')
+        self.period = period
+        self.max_rate = self.rates.max()
+
+    def rate(self, t):
+        return self.rates[int(t // self.period) % self.rates.shape[0]]
+
+    def next_interval(self, now, rng=GLOBAL_RNG):
+        t = now
+        while True:
+            t += rng.exponential(1.0 / self.max_rate)
+            if rng.uniform() * self.max_rate <= self.rate(t):
+                return t - now
+
+
+def make_arrival_process(config):
+    if config.arrival_process == 'uniform':
+        return UniformInterval(config.time_interval_lower, config.time_interval_upper)
+    if config.arrival_process == 'poisson':
+        return PoissonArrivals(config.poisson_rate)
+    if config.arrival_process == 'profile':
+        return TimeOfDayProfile(config.demand_profile, config.demand_profile_period)
+    raise ValueError('unknown arrival process: %s' % config.arrival_process)
+
+
+class FlightRequest:
+    def __init__(self, time, vertiport_id, goal_vertiport_id=None, retries=0):
+        self.time = time
+        self.vertiport_id = vertiport_id
+        self.goal_vertiport_id = goal_vertiport_id  # None until the request is first served
+        self.retries = retries
+
+    def __repr__(self):
+        return 'flight request: vertiport %d at %.1f, goal: %s, retries: %d' \
+               % (self.vertiport_id, self.time, self.goal_vertiport_id, self.retries)
+
+
+class DemandScheduler:
+    """
+    priority queue of pending flight requests. A request whose departure is blocked (another aircraft too
+    close to the vertiport) is pushed back with the same goal after retry_delay seconds.
+    arrival_process is one process shared by all vertiports or a list with one process per vertiport.
+    The departure times are drawn from rng (see rng.py).
+    """
+
+    def __init__(self, num_vertiports, arrival_process, retry_delay=1, now=0, first_departure=(0, 60),
+                 rng=GLOBAL_RNG):
+        if isinstance(arrival_process, (list, tuple)):
+            self.processes = list(arrival_process)
+        else:
+            self.processes = [arrival_process] * num_vertiports
+        self.retry_delay = retry_delay
+        self.queue = []
+        self.counter = 0  # tie breaker, keeps requests due at the same time in FIFO order
+        self.blocked = 0
+        self.rng = rng
+
+        for vertiport_id in range(num_vertiports):
+            self.push(FlightRequest(now + rng.uniform(*first_departure), vertiport_id))
+
+    def push(self, request):
+        heapq.heappush(self.queue, (request.time, self.counter, request))
+        self.counter += 1
+
+    def pop_due(self, now):
+        # all requests due at or before now, in time order
+        due = []
+        while self.queue and self.queue[0][0] <= now:
+            due.append(heapq.heappop(self.queue)[2])
+        return due
+
+    def next_time(self):
+        return self.queue[0][0] if self.queue else math.inf
+
+    def departed(self, request, now):
+        # the aircraft took off, schedule the next departure of this vertiport
+        vertiport_id = request.vertiport_id
+        self.push(FlightRequest(now + self.processes[vertiport_id].next_interval(now, self.rng), vertiport_id))
+
+    def retry(self, request, now):
+        self.blocked += 1
+        self.push(FlightRequest(now + self.retry_delay, request.vertiport_id, request.goal_vertiport_id,
+                                request.retries + 1))
+
+    def __len__(self):
+        return len(self.queue)
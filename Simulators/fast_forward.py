@@ -0,0 +1,103 @@
+"""
+Fast-forward of the hexagon sector simulators over uneventful time steps.
+
+An aircraft moves at most max_speed per time step, so from the current positions we can bound, for the whole
+fleet at once, how many steps must pass before any pair can come within minimum_separation, any aircraft can
+reach its goal or leave its sector. Until then a time step only moves the aircraft, and the steps can be
+integrated in bulk, vectorized over the fleet, instead of running the per-aircraft conflict, goal and sector
+checks every second.
+
+In the two-stage simulator the speed noise accumulates and is not clipped after it is drawn, so an aircraft
+can fly faster than max_speed; its bound per step is widened by SPEED_NOISE_BOUND standard deviations of the
+speed noise.
+"""
+
+import numpy as np
+
+from cpa import candidate_pairs
+from rng import GLOBAL_RNG
+
+# speed noise draws beyond this many standard deviations (probability about 2e-9 each) are not covered by the
+# bound of safe_steps in the two-stage simulator
+SPEED_NOISE_BOUND = 6
+
+
+def nearest_distances(positions, radius):
+    # distance of every aircraft to its closest neighbour, 9999 if there is none within radius (as in
+    # _terminal_reward), pairs found with a uniform grid (see cpa.py)
+    pairs = candidate_pairs(positions, radius)
+    diff = positions[pairs[:, 1]] - positions[pairs[:, 0]]
+    pair_dist = np.hypot(diff[:, 0], diff[:, 1])
+    nearest = np.full(positions.shape[0], 9999.0)
+    np.minimum.at(nearest, pairs[:, 0], pair_dist)
+    np.minimum.at(nearest, pairs[:, 1], pair_dist)
+    return nearest
+
+
+def sector_edges(sector_vertices):
+    # (start, end) of every edge of every sector, (number of sectors * 6, 2, 2)
+    starts = sector_vertices.reshape(-1, 2)
+    ends = np.roll(sector_vertices, -1, axis=1).reshape(-1, 2)
+    return np.stack([starts, ends], axis=1)
+
+
+def boundary_distances(positions, edges):
+    # distance of each point (n, 2) to the closest of the edges (m, 2, 2)
+    starts = edges[:, 0]
+    segments = edges[:, 1] - starts
+    rel = positions[:, None, :] - starts
+    t = np.clip((rel * segments).sum(axis=2) / (segments * segments).sum(axis=1), 0, 1)
+    closest = starts + t[..., None] * segments
+    return np.hypot(*(positions[:, None, :] - closest).transpose(2, 0, 1)).min(axis=1)
+
+
+def safe_steps(positions, goals, edges, max_speed, minimum_separation, goal_radius, limit):
+    """
+    number of time steps (at most limit) during which, whatever the actions and the noise:
+    - every pair stays at least minimum_separation apart (so no conflict or NMAC)
+    - no aircraft comes within goal_radius of its goal
+    - no aircraft crosses a sector edge (so no sector change)
+    max_speed: the largest distance an aircraft can fly in one time step
+    """
+    if positions.shape[0] == 0:
+        return limit
+
+    steps = limit
+    # pairs further apart than reach cannot meet within limit steps
+    reach = minimum_separation + 2 * max_speed * (limit + 1)
+    nearest = min(nearest_distances(positions, reach).min(), reach)
+    steps = min(steps, int(np.floor((nearest - minimum_separation) / (2 * max_speed))))
+
+    goal_dist = np.hypot(*(positions - goals).T)
+    steps = min(steps, int(np.floor((goal_dist.min() - goal_radius) / max_speed)))
+
+    boundary = boundary_distances(positions, edges)
+    steps = min(steps, int(np.ceil(boundary.min() / max_speed)) - 1)
+
+    return max(steps, 0)
+
+
+def integrate(positions, speeds, headings, turns, steps, init_speed, speed_sigma, heading_sigma, min_speed,
+              max_speed, speed_walk=False, rng=GLOBAL_RNG):
+    """
+    fly the fleet for steps time steps with the same actions, drawing the speed and heading noise of all
+    aircraft at once. turns is the heading change per step of each aircraft, (action - 1) * d_heading.
+    speed_walk: the speed noise accumulates (two-stage simulator) instead of being drawn around init_speed.
+    As in the step() of each simulator, the speed is clipped to [min_speed, max_speed] after the noise is drawn
+    around init_speed, and before the noise is added with speed_walk.
+    rng: the random number generator of the simulator (see rng.py).
+    return positions, speeds, headings and velocities after the last step
+    """
+    n = positions.shape[0]
+    positions = positions.astype(np.float64)
+    speed_noise = rng.normal(0, speed_sigma, size=(steps, n))
+    heading_noise = rng.normal(0, heading_sigma, size=(steps, n))
+    for k in range(steps):
+        if speed_walk:
+            speeds = np.clip(speeds, min_speed, max_speed) + speed_noise[k]
+        else:
+            speeds = np.clip(init_speed + speed_noise[k], min_speed, max_speed)
+        headings = headings + turns + heading_noise[k]
+        velocities = np.stack([speeds * np.cos(headings), speeds * np.sin(headings)], axis=1)
+        positions += velocities
+    return positions, speeds, headings, velocities
@@ -0,0 +1,153 @@
+"""
+Generator of hexagonal sector networks.
+
+A network of R rings has one vertiport at the center of each hexagonal sector: the center sector (id 0),
+then ring 1 (ids 1-6), ring 2 (ids 7-18), ... 3R(R+1)+1 sectors in total. For R = 1 the tables are the
+same as the hand-written 7 sector layout of config_hex_sec.
+
+Tables (N sectors):
+    vertiport_loc    (N, 2)        vertiport / sector center position
+    sector_vertices  (N, 6, 2)     corners of each sector, counter-clockwise from 30 degrees
+    adjacency        (N, 6)        id of the sector across edge k (from corner k to corner k+1), -1 if none
+    gates            (N, 6, 3, 2)  gates of each sector: [center, end 1, end 2], padded with nan
+    gate_edge        (N, 6)        edge of each gate, -1 for padding
+    gate_count       (N,)          number of gates of each sector
+
+Generated networks are cached on disk as .npz files keyed by the generator parameters.
+"""
+
+import hashlib
+import math
+import os
+
+import numpy as np
+
+CACHE_VERSION = 1
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'network_cache')
+
+# the six directions between neighbouring sector centers, in axial coordinates of the first two
+AXIAL_DIRECTIONS = [(1, 0), (0, 1), (-1, 1), (-1, 0), (0, -1), (1, -1)]
+
+
+class HexNetwork:
+    def __init__(self, rings, vertiport_loc, sector_vertices, adjacency, gates, gate_edge, gate_count):
+        self.rings = rings
+        self.vertiport_loc = vertiport_loc
+        self.sector_vertices = sector_vertices
+        self.adjacency = adjacency
+        self.gates = gates
+        self.gate_edge = gate_edge
+        self.gate_count = gate_count
+
+    @property
+    def num_sectors(self):
+        return self.vertiport_loc.shape[0]
+
+    def sector_gates(self, sector_id):
+        return self.gates[sector_id, :self.gate_count[sector_id]]
+
+    def neighbors(self, sector_id):
+        return self.adjacency[sector_id][self.adjacency[sector_id] >= 0]
+
+    def outline(self):
+        # closed polyline through the vertiports of the outermost ring (counter-clockwise), the outer boundary
+        # drawn by the simulators, None for a single sector
+        if self.rings == 0:
+            return None
+        ring = np.arange(self.num_sectors - 6 * self.rings, self.num_sectors)
+        return self.vertiport_loc[np.append(ring, ring[0])]
+
+    def gate_dict(self):
+        # {sector_id: (number of gates, 3, 2) array}, the layout of Config.sector_len_exits
+        return {i: self.sector_gates(i) for i in range(self.num_sectors)}
+
+    def save(self, path):
+        np.savez(path, rings=self.rings, vertiport_loc=self.vertiport_loc, sector_vertices=self.sector_vertices,
+                 adjacency=self.adjacency, gates=self.gates, gate_edge=self.gate_edge, gate_count=self.gate_count)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(int(data['rings']), data['vertiport_loc'], data['sector_vertices'], data['adjacency'],
+                       data['gates'], data['gate_edge'], data['gate_count'])
+
+    def __repr__(self):
+        return 'hex network: %d rings, %d sectors, %d gates' % (self.rings, self.num_sectors, self.gate_count.sum())
+
+
+def ring_coordinates(rings):
+    # axial coordinates of all sector centers, center first, then each ring counter-clockwise from 60 degrees
+    coordinates = [(0, 0)]
+    for ring in range(1, rings + 1):
+        a, b = 0, ring  # ring * direction 1
+        for side in range(6):
+            for _ in range(ring):
+                coordinates.append((a, b))
+                da, db = AXIAL_DIRECTIONS[(side + 3) % 6]
+                a, b = a + da, b + db
+    return coordinates
+
+
+def build_hex_network(rings=1, spacing=300, center=(400, 400), gate_len=15):
+    coordinates = ring_coordinates(rings)
+    index = {c: i for i, c in enumerate(coordinates)}
+    num_sectors = len(coordinates)
+
+    axial = np.array(coordinates, dtype=np.float64)
+    basis = spacing * np.array([[1, 0], [math.cos(math.radians(60)), math.sin(math.radians(60))]])
+    vertiport_loc = np.asarray(center, dtype=np.float64) + axial @ basis
+
+    corner_angles = np.radians(60 * np.arange(6) + 30)
+    corners = spacing / math.sqrt(3) * np.stack([np.cos(corner_angles), np.sin(corner_angles)], axis=1)
+    sector_vertices = vertiport_loc[:, None, :] + corners[None, :, :]
+
+    # edge k faces the neighbour in direction k + 1
+    adjacency = -np.ones((num_sectors, 6), dtype=np.int64)
+    for i, (a, b) in enumerate(coordinates):
+        for k in range(6):
+            da, db = AXIAL_DIRECTIONS[(k + 1) % 6]
+            adjacency[i, k] = index.get((a + da, b + db), -1)
+
+    gates = np.full((num_sectors, 6, 3, 2), np.nan)
+    gate_edge = -np.ones((num_sectors, 6), dtype=np.int64)
+    gate_count = np.zeros(num_sectors, dtype=np.int64)
+    for i in range(num_sectors):
+        for k in gate_order(adjacency[i]):
+            start = sector_vertices[i, k]
+            end = sector_vertices[i, (k + 1) % 6]
+            point = start + (end - start) / 3
+            direction = (end - start) / np.linalg.norm(end - start)
+            gates[i, gate_count[i]] = [point, point - gate_len * direction, point + gate_len * direction]
+            gate_edge[i, gate_count[i]] = k
+            gate_count[i] += 1
+
+    return HexNetwork(rings, vertiport_loc, sector_vertices, adjacency, gates, gate_edge, gate_count)
+
+
+def gate_order(neighbors):
+    """
+    edges of a sector that get a gate (those shared with a neighbour), in counter-clockwise order starting
+    after an edge without neighbour, or at edge 5 for a sector surrounded by neighbours
+    """
+    if (neighbors >= 0).all():
+        return [5, 0, 1, 2, 3, 4]
+    first = [k for k in range(6) if neighbors[k] >= 0 and neighbors[k - 1] < 0][0]
+    return [(first + k) % 6 for k in range(6) if neighbors[(first + k) % 6] >= 0]
+
+
+def load_hex_network(rings=1, spacing=300, center=(400, 400), gate_len=15, cache_dir=CACHE_DIR):
+    # build the network, or read it from the cache if it was built before with the same parameters
+    key = repr((CACHE_VERSION, int(rings), float(spacing), tuple(float(e) for e in center), float(gate_len)))
+    path = os.path.join(cache_dir, 'hex_%s.npz' % hashlib.sha1(key.encode()).hexdigest()[:16])
+    if os.path.exists(path):
+        return HexNetwork.load(path)
+
+    network = build_hex_network(rings, spacing, center, gate_len)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = path + '.%d.tmp.npz' % os.getpid()
+        network.save(tmp_path)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass  # the cache is only an optimization
+    return network
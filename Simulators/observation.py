@@ -0,0 +1,89 @@
+"""
+Preallocated observations for learned policies and value networks.
+
+ObservationBuffer holds fixed-capacity arrays for every sector (one for the vertiport simulator). The
+simulators' _get_normalized_ob(buffer) writes the raw features (x, y, vx, vy, speed, heading, gx, gy) of the rows
+of each sector into it in place, scales them to [0, 1] and returns the per-sector views, so a consumer can read
+the observation at every time step without allocating arrays. Rows are in the order of _get_ob, padded up to
+the capacity; mask tells the valid rows.
+"""
+
+import collections
+import math
+
+import numpy as np
+
+FEATURES = ('x', 'y', 'vx', 'vy', 'speed', 'heading', 'gx', 'gy')
+
+# views of one sector into the buffer arrays
+SectorObservation = collections.namedtuple('SectorObservation',
+                                           ['raw', 'normalized', 'mask', 'controlled', 'priority', 'ids'])
+
+
+class ObservationBuffer:
+    """
+    observation arrays of num_sectors sectors of at most capacity aircraft each, scaled with the window size and
+    speed range of config:
+        raw, normalized   (num_sectors, capacity, 8) dtype, features in FEATURES order
+        mask              (num_sectors, capacity) bool, valid rows
+        controlled        (num_sectors, capacity) bool, rows of aircraft controlled by the sector
+        priority          (num_sectors, capacity) int8, priority of the aircraft (two-stage simulator, 0 otherwise)
+        ids               (num_sectors, capacity) int64, aircraft id of the rows, -1 in the padding
+        count             (num_sectors,) int64, valid rows of each sector
+    """
+
+    def __init__(self, num_sectors, capacity=64, config=None, dtype=np.float32):
+        self.capacity = capacity
+        self.raw = np.zeros((num_sectors, capacity, len(FEATURES)), dtype=dtype)
+        self.normalized = np.zeros((num_sectors, capacity, len(FEATURES)), dtype=dtype)
+        self.mask = np.zeros((num_sectors, capacity), dtype=bool)
+        self.controlled = np.zeros((num_sectors, capacity), dtype=bool)
+        self.priority = np.zeros((num_sectors, capacity), dtype=np.int8)
+        self.ids = np.full((num_sectors, capacity), -1, dtype=np.int64)
+        self.count = np.zeros(num_sectors, dtype=np.int64)
+        self.views = [SectorObservation(self.raw[i], self.normalized[i], self.mask[i], self.controlled[i],
+                                        self.priority[i], self.ids[i]) for i in range(num_sectors)]
+
+        # normalized = (raw - low) * inverse_range, the heading is taken modulo 2 pi first
+        self.low = np.zeros(len(FEATURES), dtype=dtype)
+        self.inverse_range = np.ones(len(FEATURES), dtype=dtype)
+        if config is not None:
+            self.low[:] = (0., 0., -config.max_speed, -config.max_speed, config.min_speed, 0., 0., 0.)
+            self.inverse_range[:] = (1. / config.window_width, 1. / config.window_height, 0.5 / config.max_speed,
+                                     0.5 / config.max_speed, 1. / (config.max_speed - config.min_speed),
+                                     1. / (2 * math.pi), 1. / config.window_width, 1. / config.window_height)
+
+    def write(self, sector_id, row, aircraft, goal_position, controlled=True):
+        # features of aircraft in row of sector_id, goal_position is its goal (or sub-goal) position
+        if row >= self.capacity:
+            raise ValueError('more than %d aircraft in sector %d, use a larger capacity' % (self.capacity, sector_id))
+        raw = self.raw[sector_id, row]
+        raw[0] = aircraft.position[0]
+        raw[1] = aircraft.position[1]
+        raw[2] = aircraft.velocity[0]
+        raw[3] = aircraft.velocity[1]
+        raw[4] = aircraft.speed
+        raw[5] = aircraft.heading
+        raw[6] = goal_position[0]
+        raw[7] = goal_position[1]
+        self.controlled[sector_id, row] = controlled
+        self.priority[sector_id, row] = getattr(aircraft, 'priority', 0)
+        self.ids[sector_id, row] = aircraft.id
+
+    def end_sector(self, sector_id, count):
+        # count rows were written in sector_id, clear the rest
+        self.count[sector_id] = count
+        self.mask[sector_id, :count] = True
+        self.mask[sector_id, count:] = False
+        self.raw[sector_id, count:] = 0.
+        self.controlled[sector_id, count:] = False
+        self.priority[sector_id, count:] = 0
+        self.ids[sector_id, count:] = -1
+
+    def normalize(self):
+        # scale all rows to [0, 1] in place, the padding stays 0
+        np.subtract(self.raw, self.low, out=self.normalized)
+        np.mod(self.raw[:, :, 5], 2 * math.pi, out=self.normalized[:, :, 5])
+        np.multiply(self.normalized, self.inverse_range, out=self.normalized)
+        np.clip(self.normalized, 0., 1., out=self.normalized)
+        np.multiply(self.normalized, self.mask[:, :, None], out=self.normalized)
@@ -0,0 +1,194 @@
+"""
+Headless, NumPy-only drawing of the simulators.
+
+FrameRasterizer draws the aircraft, goals, vertiports, sector boundaries and gates of one time step into an
+RGB uint8 array without a display or the gym viewer. FrameExporter rasterizes and writes frames on a
+background thread, either as a PPM image sequence or as one raw rgb24 video file, e.g.
+
+    ffmpeg -f rawvideo -pix_fmt rgb24 -s 800x800 -r 30 -i frames.rgb out.mp4
+"""
+
+import colorsys
+import json
+import math
+import os
+import queue
+import threading
+
+import numpy as np
+
+from trajectory_recorder import scene_info
+
+BACKGROUND = (255, 255, 255)
+BOUNDARY_COLOR = (0, 0, 0)
+GATE_COLOR = (255, 165, 0)
+VERTIPORT_COLOR = (70, 70, 200)
+
+
+def palette(num_colors):
+    # red to green, as in render()
+    hues = np.linspace(0, 1 / 3., max(num_colors, 1))
+    return np.array([colorsys.hls_to_rgb(h, 0.5, 1.0) for h in hues]) * 255
+
+
+def fleet_snapshot(env):
+    # copy of what is drawn for every aircraft, cheap enough to take on the simulation thread
+    fleet = list(env.aircraft_dict.ac_dict.values())
+    return {'id': np.array([aircraft.id for aircraft in fleet], dtype=np.int64),
+            'position': np.array([aircraft.position for aircraft in fleet], dtype=np.float64).reshape(-1, 2),
+            'heading': np.array([aircraft.heading for aircraft in fleet], dtype=np.float64),
+            'goal': np.array([aircraft.goal.position for aircraft in fleet], dtype=np.float64).reshape(-1, 2)}
+
+
+class FrameRasterizer:
+    def __init__(self, scene, scale=1.0, num_colors=10):
+        self.scale = scale
+        self.width = int(round(scene['window_width'] * scale))
+        self.height = int(round(scene['window_height'] * scale))
+        self.colors = palette(num_colors).astype(np.uint8)
+        self.background = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        self.background[:] = BACKGROUND
+        self._draw_static(scene)
+
+    def _draw_static(self, scene):
+        # the static layer is drawn once and copied at the start of each frame
+        img = self.background
+        for vertices in scene.get('sectors', []):
+            vertices = np.array(vertices)
+            for k in range(vertices.shape[0]):
+                self.line(img, vertices[k - 1], vertices[k], BOUNDARY_COLOR)
+        for gates in scene.get('gates', []):
+            for gate in gates:
+                gate = np.array(gate)
+                direction = gate[2] - gate[1]
+                normal = np.array([-direction[1], direction[0]]) / (np.linalg.norm(direction) + 1e-9) * 5
+                self.polygon(img, np.array([gate[1] - normal, gate[2] - normal, gate[2] + normal, gate[1] + normal]),
+                             GATE_COLOR)
+        for position in scene.get('vertiports', []):
+            x, y = position
+            self.polygon(img, np.array([[x - 8, y - 8], [x + 8, y - 8], [x + 8, y + 8], [x - 8, y + 8]]),
+                         VERTIPORT_COLOR)
+
+    def draw(self, snapshot):
+        img = self.background.copy()
+        colors = self.colors[snapshot['id'] % self.colors.shape[0]]
+        for goal, color in zip(snapshot['goal'], colors):
+            self.circle(img, goal, 4, color)
+        for position, heading, color in zip(snapshot['position'], snapshot['heading'], colors):
+            self.polygon(img, aircraft_triangle(position, heading), color)
+        return img
+
+    def _to_pixels(self, points):
+        # airspace coordinates (y up) to (column, row) pixel coordinates (row 0 at the top)
+        points = np.asarray(points, dtype=np.float64) * self.scale
+        return np.stack([points[..., 0], self.height - 1 - points[..., 1]], axis=-1)
+
+    def line(self, img, start, end, color):
+        start, end = self._to_pixels([start, end])
+        n = int(math.ceil(np.abs(end - start).max())) + 1
+        t = np.linspace(0, 1, n)[:, None]
+        pixels = np.rint(start + (end - start) * t).astype(np.int64)
+        keep = (pixels[:, 0] >= 0) & (pixels[:, 0] < self.width) & (pixels[:, 1] >= 0) & (pixels[:, 1] < self.height)
+        img[pixels[keep, 1], pixels[keep, 0]] = color
+
+    def polygon(self, img, vertices, color):
+        vertices = self._to_pixels(vertices)
+        col_lo, row_lo = np.maximum(np.floor(vertices.min(axis=0)).astype(np.int64), 0)
+        col_hi = min(int(math.ceil(vertices[:, 0].max())), self.width - 1)
+        row_hi = min(int(math.ceil(vertices[:, 1].max())), self.height - 1)
+        if col_lo > col_hi or row_lo > row_hi:
+            return
+        cols, rows = np.meshgrid(np.arange(col_lo, col_hi + 1), np.arange(row_lo, row_hi + 1))
+        inside = points_in_polygon(cols + 0.5, rows + 0.5, vertices)
+        img[row_lo:row_hi + 1, col_lo:col_hi + 1][inside] = color
+
+    def circle(self, img, center, radius, color):
+        (col, row), radius = self._to_pixels(center), radius * self.scale
+        col_lo, row_lo = max(int(col - radius), 0), max(int(row - radius), 0)
+        col_hi, row_hi = min(int(col + radius) + 1, self.width - 1), min(int(row + radius) + 1, self.height - 1)
+        if col_lo > col_hi or row_lo > row_hi:
+            return
+        cols, rows = np.meshgrid(np.arange(col_lo, col_hi + 1), np.arange(row_lo, row_hi + 1))
+        inside = (cols - col) ** 2 + (rows - row) ** 2 <= radius ** 2
+        img[row_lo:row_hi + 1, col_lo:col_hi + 1][inside] = color
+
+
+def aircraft_triangle(position, heading, size=10):
+    angles = heading + np.array([0, math.radians(140), -math.radians(140)])
+    lengths = np.array([size, 0.7 * size, 0.7 * size])
+    return position + np.stack([lengths * np.cos(angles), lengths * np.sin(angles)], axis=1)
+
+
+def points_in_polygon(x, y, vertices):
+    # even-odd rule, vectorized over the points
+    inside = np.zeros(x.shape, dtype=bool)
+    x1, y1 = vertices[-1]
+    for x2, y2 in vertices:
+        crosses = (y1 > y) != (y2 > y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_cross = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+        inside ^= crosses & (x < x_cross)
+        x1, y1 = x2, y2
+    return inside
+
+
+class FrameExporter:
+    """
+    take a snapshot of every frame_skip-th time step and rasterize/write it on a background thread.
+    fmt is 'ppm' (one frame_XXXXXX.ppm per frame) or 'raw' (all frames appended to frames.rgb, with the
+    frame size in frames.json). At most max_pending snapshots wait for the writer; submit blocks beyond that.
+    """
+
+    def __init__(self, path, env, fmt='ppm', frame_skip=1, scale=1.0, max_pending=16):
+        if fmt not in ('ppm', 'raw'):
+            raise ValueError('unknown frame format: %s' % fmt)
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.fmt = fmt
+        self.frame_skip = max(1, frame_skip)
+        self.rasterizer = FrameRasterizer(scene_info(env), scale, env.num_aircraft)
+        self.frames = 0
+        self.raw_file = open(os.path.join(path, 'frames.rgb'), 'wb') if fmt == 'raw' else None
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.writer = threading.Thread(target=self._write_loop, name='frame-writer', daemon=True)
+        self.writer.start()
+
+    def submit(self, env, step):
+        if self.error is not None:
+            raise self.error
+        if step % self.frame_skip == 0:
+            self.queue.put((step, fleet_snapshot(env)))
+
+    def _write_loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            step, snapshot = item
+            try:
+                frame = self.rasterizer.draw(snapshot)
+                if self.fmt == 'raw':
+                    self.raw_file.write(frame.tobytes())
+                else:
+                    write_ppm(os.path.join(self.path, 'frame_%06d.ppm' % step), frame)
+                self.frames += 1
+            except Exception as e:
+                self.error = e
+
+    def close(self):
+        self.queue.put(None)
+        self.writer.join()
+        if self.raw_file is not None:
+            self.raw_file.close()
+            with open(os.path.join(self.path, 'frames.json'), 'w') as f:
+                json.dump({'width': self.rasterizer.width, 'height': self.rasterizer.height,
+                           'pix_fmt': 'rgb24', 'frames': self.frames, 'frame_skip': self.frame_skip}, f)
+        if self.error is not None:
+            raise self.error
+
+
+def write_ppm(path, frame):
+    with open(path, 'wb') as f:
+        f.write(b'P6\n%d %d\n255\n' % (frame.shape[1], frame.shape[0]))
+        f.write(frame.tobytes())
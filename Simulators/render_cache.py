@@ -0,0 +1,76 @@
+import os
+
+__location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+
+_sprite_class = None
+
+
+def sprite_class():
+    """
+    return the Sprite geom class. It is defined on first use because gym's rendering module opens a
+    display when it is imported.
+
+    A Sprite draws a shared texture, so creating one does not read the image from disk, and it owns a
+    Transform that is updated in place from frame to frame.
+    """
+    global _sprite_class
+    if _sprite_class is None:
+        from gym.envs.classic_control import rendering
+
+        class Sprite(rendering.Geom):
+            def __init__(self, texture, width, height):
+                rendering.Geom.__init__(self)
+                self.texture = texture
+                self.width = width
+                self.height = height
+                self.transform = rendering.Transform()
+                self.add_attr(self.transform)
+
+            def render1(self):
+                self.texture.blit(-self.width / 2, -self.height / 2, width=self.width, height=self.height)
+
+        _sprite_class = Sprite
+    return _sprite_class
+
+
+class RenderCache:
+    """
+    keep everything render() can reuse between frames:
+    - the aircraft color palette
+    - textures, loaded once per image file
+    - one sprite per (kind, aircraft id), dropped when the aircraft leaves the airspace
+    - static geometry (vertiports, sector borders, gates), added to the viewer once as permanent geoms
+    """
+
+    def __init__(self, viewer, num_colors):
+        from colour import Color
+        self.viewer = viewer
+        self.colors = [c.get_rgb() for c in Color('red').range_to(Color('green'), num_colors)]
+        self.textures = {}
+        self.sprites = {}
+
+    def texture(self, name):
+        if name not in self.textures:
+            import pyglet
+            self.textures[name] = pyglet.image.load(os.path.join(__location__, 'images', name))
+        return self.textures[name]
+
+    def sprite(self, key, name, size):
+        # the pooled sprite of key, e.g. ('aircraft', id), created on first use
+        sprite = self.sprites.get(key)
+        if sprite is None:
+            sprite = sprite_class()(self.texture(name), size, size)
+            self.sprites[key] = sprite
+        return sprite
+
+    def static_sprite(self, name, size, translation, rotation=0):
+        sprite = sprite_class()(self.texture(name), size, size)
+        sprite.transform.set_translation(*translation)
+        sprite.transform.set_rotation(rotation)
+        self.viewer.add_geom(sprite)
+        return sprite
+
+    def release(self, alive_ids):
+        # drop the sprites of aircraft that are no longer in alive_ids
+        for key in [key for key in self.sprites if key[1] not in alive_ids]:
+            del self.sprites[key]
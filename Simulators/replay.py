@@ -0,0 +1,182 @@
+import argparse
+import json
+import math
+import os
+import time
+
+import numpy as np
+
+from trajectory_recorder import open_table
+
+EVENT_KINDS = {'conflict': 0, 'NMAC': 1, 'conflict_end': 2}
+
+
+class TrajectoryReader:
+    """
+    read a recording written by TrajectoryRecorder. All tables are memory-mapped, so only the rows of the
+    time steps that are drawn are read from disk.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.scene = self.meta['scene']
+        self.fleet = open_table(path, 'fleet')
+        self.events = open_table(path, 'events')
+        self.steps = open_table(path, 'steps')
+        self.step_array = np.asarray(self.steps['step'])
+
+    @property
+    def first_step(self):
+        return int(self.step_array[0]) if self.step_array.shape[0] > 0 else 0
+
+    @property
+    def last_step(self):
+        return int(self.step_array[-1]) if self.step_array.shape[0] > 0 else 0
+
+    def frame(self, step):
+        """
+        return the fleet rows of the recorded time step closest to (and not after) step
+        """
+        k = np.searchsorted(self.step_array, step, side='right') - 1
+        if k < 0:
+            return self.fleet[:0]
+        start = int(self.steps['fleet_start'][k])
+        return self.fleet[start:start + int(self.steps['fleet_count'][k])]
+
+    def window(self, start, end):
+        # (step, fleet rows) of every recorded time step in [start, end]
+        lo = np.searchsorted(self.step_array, start, side='left')
+        hi = np.searchsorted(self.step_array, end, side='right')
+        for k in range(lo, hi):
+            fleet_start = int(self.steps['fleet_start'][k])
+            yield int(self.step_array[k]), self.fleet[fleet_start:fleet_start + int(self.steps['fleet_count'][k])]
+
+    def event_index(self, kind=None):
+        # events of one kind ('conflict', 'NMAC' or 'conflict_end'), in time order
+        if kind is None:
+            return self.events
+        return self.events[self.events['kind'] == EVENT_KINDS[kind]]
+
+    def events_at(self, step):
+        lo = np.searchsorted(self.events['step'], step, side='left')
+        hi = np.searchsorted(self.events['step'], step, side='right')
+        return self.events[lo:hi]
+
+
+class ReplayViewer:
+    """
+    draw recorded time steps with the same gym viewer the simulators use in render(). Aircraft involved in
+    a conflict/NMAC event at the drawn time step are highlighted.
+    """
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.viewer = None
+        self.render_cache = None
+
+    def draw(self, step, fleet):
+        from gym.envs.classic_control import rendering
+        from render_cache import RenderCache
+        scene = self.reader.scene
+        if self.viewer is None:
+            self.viewer = rendering.Viewer(scene['window_width'], scene['window_height'])
+            self.viewer.set_bounds(0, scene['window_width'], 0, scene['window_height'])
+            self.render_cache = RenderCache(self.viewer, 2)
+            for vertices in scene.get('sectors', []):
+                vertices = np.array(vertices)
+                self.viewer.add_geom(rendering.PolyLine(vertices, True))
+            for gates in scene.get('gates', []):
+                for gate in gates:
+                    self.viewer.add_geom(rendering.Line(tuple(gate[1]), tuple(gate[2])))
+            for position in scene.get('vertiports', []):
+                self.render_cache.static_sprite('verti.png', 32, position)
+        cache = self.render_cache
+
+        highlighted = set()
+        for event in self.reader.events_at(step):
+            highlighted.add(int(event['id1']))
+            highlighted.add(int(event['id2']))
+
+        for row in fleet:
+            id = int(row['id'])
+            aircraft_img = cache.sprite(('aircraft', id), 'aircraft.png', 32)
+            aircraft_img.transform.set_translation(row['x'], row['y'])
+            aircraft_img.transform.set_rotation(row['heading'] - math.pi / 2)
+            if id in highlighted:
+                aircraft_img.set_color(1, 0, 0)
+            else:
+                aircraft_img.set_color(0, 0.6, 0)
+            self.viewer.add_onetime(aircraft_img)
+
+            goal_img = cache.sprite(('goal', id), 'goal.png', 20)
+            goal_img.transform.set_translation(row['gx'], row['gy'])
+            goal_img.set_color(0, 0.6, 0)
+            self.viewer.add_onetime(goal_img)
+
+        # forget aircraft that left the airspace
+        cache.release(set(int(id) for id in fleet['id']))
+
+        return self.viewer.render(return_rgb_array=False)
+
+    def play(self, start, end, speed=1.0):
+        """
+        redraw the time steps in [start, end]; speed is the number of simulated seconds per wall-clock second
+        """
+        for step, fleet in self.reader.window(start, end):
+            time_before = time.time()
+            self.draw(step, fleet)
+            delay = 1.0 / speed - (time.time() - time_before)
+            if delay > 0:
+                time.sleep(delay)
+
+    def close(self):
+        if self.viewer:
+            self.viewer.close()
+            self.viewer = None
+            self.render_cache = None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('record_dir', type=str, help='episode directory written by --record_dir')
+    parser.add_argument('--start', type=int, default=None)
+    parser.add_argument('--end', type=int, default=None)
+    parser.add_argument('--speed', type=float, default=10.0, help='simulated seconds per second')
+    parser.add_argument('--event', type=str, default=None, choices=sorted(EVENT_KINDS),
+                        help='seek to an event of this kind instead of --start/--end')
+    parser.add_argument('--event_number', '-n', type=int, default=0, help='which event of --event to show')
+    parser.add_argument('--context', type=int, default=30, help='time steps shown before and after an event')
+    parser.add_argument('--list_events', action='store_true', help='print the event index and exit')
+    args = parser.parse_args()
+
+    reader = TrajectoryReader(args.record_dir)
+
+    if args.list_events:
+        names = {kind: name for name, kind in EVENT_KINDS.items()}
+        for event in reader.events:
+            print('step %d: %s between %d and %d, distance %.2f, duration %d'
+                  % (event['step'], names.get(int(event['kind']), event['kind']), event['id1'], event['id2'],
+                     event['dist'], event['duration']))
+        return
+
+    start = reader.first_step if args.start is None else args.start
+    end = reader.last_step if args.end is None else args.end
+    if args.event is not None:
+        events = reader.event_index(args.event)
+        if args.event_number >= events.shape[0]:
+            raise ValueError('only %d %s events recorded' % (events.shape[0], args.event))
+        event_step = int(events['step'][args.event_number])
+        start = event_step - args.context
+        end = event_step + args.context
+
+    viewer = ReplayViewer(reader)
+    try:
+        viewer.play(start, end, args.speed)
+    finally:
+        viewer.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+Random number generators of the simulators and the search.
+
+The simulators, the search states and the search nodes draw their random numbers from an rng argument, a
+numpy.random.Generator, so that several simulators and planners can run in one process with streams of their
+own. Without one they draw from GLOBAL_RNG, which forwards to the global np.random and random streams seeded
+by MultiAircraftEnv.seed, so the existing runs draw the same numbers as before.
+"""
+
+import random
+
+import numpy as np
+
+
+class GlobalRandom:
+    # the Generator methods used in this repository, drawn from the global np.random stream
+    def uniform(self, low=0.0, high=1.0, size=None):
+        return np.random.uniform(low, high, size)
+
+    def normal(self, loc=0.0, scale=1.0, size=None):
+        return np.random.normal(loc, scale, size)
+
+    def exponential(self, scale=1.0, size=None):
+        return np.random.exponential(scale, size)
+
+    def integers(self, low, high=None, size=None):
+        return np.random.randint(low, high, size)
+
+    def choice(self, a, size=None, replace=True, p=None):
+        return np.random.choice(a, size, replace, p)
+
+
+GLOBAL_RNG = GlobalRandom()
+
+
+def randrange(rng, n):
+    # an integer in [0, n), from the random module for the global streams (as the simulators always did)
+    if rng is GLOBAL_RNG:
+        return random.randrange(n)
+    return int(rng.integers(n))
+
+
+def spawn_rngs(seed, n):
+    # n independent Generators from one seed, e.g. one per worker or per sector planner
+    return [np.random.default_rng(child) for child in np.random.SeedSequence(seed).spawn(n)]
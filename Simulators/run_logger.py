@@ -0,0 +1,154 @@
+"""
+Structured run logging with bounded memory.
+
+RunLogger writes metric records (dicts) as JSON lines from a background thread, in batches, so the
+simulation loop only pays for a queue put. RingBuffer keeps the last values of a time series and
+RunningStats (Welford) accumulates mean/std/min/max without keeping the samples.
+"""
+
+import json
+import math
+import queue
+import threading
+
+import numpy as np
+
+
+class RunLogger:
+    """
+    append records to path as JSON lines. Records are queued and written by a background thread, up to
+    batch_size records per write; log() only blocks when max_pending records are waiting.
+    """
+
+    def __init__(self, path, batch_size=64, max_pending=4096):
+        self.path = path
+        self.batch_size = batch_size
+        self.file = open(path, 'w')
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.writer = threading.Thread(target=self._write_loop, name='run-logger', daemon=True)
+        self.writer.start()
+
+    def log(self, record):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(record)
+
+    def _write_loop(self):
+        done = False
+        while not done:
+            batch = [self.queue.get()]
+            # take whatever else is already waiting, up to batch_size records
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                done = True
+                batch = batch[:batch.index(None)]
+            try:
+                self.file.write(''.join(json.dumps(record, default=to_json) + '\n' for record in batch))
+                self.file.flush()
+            except Exception as e:
+                self.error = e
+
+    def close(self):
+        self.queue.put(None)
+        self.writer.join()
+        self.file.close()
+        if self.error is not None:
+            raise self.error
+
+
+def to_json(value):
+    # NumPy scalars and arrays in the records
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, RunningStats):
+        return value.summary()
+    raise TypeError('%r is not JSON serializable' % (value,))
+
+
+class RingBuffer:
+    # the last capacity values of a time series
+    def __init__(self, capacity, dtype=np.float64):
+        self.data = np.zeros(capacity, dtype=dtype)
+        self.count = 0  # values appended so far
+
+    def append(self, value):
+        self.data[self.count % self.data.shape[0]] = value
+        self.count += 1
+
+    def values(self):
+        # the stored values, oldest first
+        capacity = self.data.shape[0]
+        if self.count <= capacity:
+            return self.data[:self.count].copy()
+        start = self.count % capacity
+        return np.concatenate([self.data[start:], self.data[:start]])
+
+    def __len__(self):
+        return min(self.count, self.data.shape[0])
+
+
+class RunningStats:
+    # Welford's online mean and variance
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.
+        self.m2 = 0.
+        self.min = math.inf
+        self.max = -math.inf
+
+    def update(self, value):
+        value = float(value)
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        # statistics of both sample sets (Chan et al.), as a new object
+        merged = RunningStats()
+        merged.count = self.count + other.count
+        if merged.count == 0:
+            return merged
+        delta = other.mean - self.mean
+        merged.mean = self.mean + delta * other.count / merged.count
+        merged.m2 = self.m2 + other.m2 + delta * delta * self.count * other.count / merged.count
+        merged.min = min(self.min, other.min)
+        merged.max = max(self.max, other.max)
+        return merged
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.
+
+    def summary(self):
+        if self.count == 0:
+            return {'count': 0, 'mean': None, 'std': None, 'min': None, 'max': None}
+        return {'count': self.count, 'mean': self.mean, 'std': self.std, 'min': self.min, 'max': self.max}
+
+    def __repr__(self):
+        if self.count == 0:
+            return 'n=0'
+        return 'n=%d mean=%.2f std=%.2f min=%.2f max=%.2f' % (self.count, self.mean, self.std, self.min, self.max)
+
+
+def env_record(env, **fields):
+    # the safety and traffic counters of a simulator as a record, plus the given fields
+    flight_hours = env.total_timesteps / 3600
+    record = {'conflicts': env.conflicts,
+              'NMACs': env.NMACs,
+              'NMAC/h': env.NMACs / flight_hours if flight_hours > 0 else 0.,
+              'flight_hours': flight_hours,
+              'generated': env.id_tracker,
+              'goals': env.goals,
+              'enroute': env.aircraft_dict.num_aircraft}
+    record.update(fields)
+    return record
@@ -0,0 +1,192 @@
+"""
+Streaming trajectory recorder.
+
+A recording is a directory of append-only binary tables, each a flat file of fixed-dtype rows that can be
+opened with np.memmap (see open_table):
+
+    fleet.bin   one row per aircraft per recorded time step (FLEET_DTYPE)
+    events.bin  one row per conflict begin/end and NMAC event (EVENT_DTYPE)
+    steps.bin   one row per recorded time step, indexing the rows of fleet.bin (STEP_DTYPE)
+    meta.json   dtypes, chunk index of each table and static scene information of the simulator
+"""
+
+import json
+import os
+import queue
+import threading
+
+import numpy as np
+
+FLEET_DTYPE = np.dtype([
+    ('step', '<i4'),
+    ('id', '<i4'),
+    ('x', '<f4'),
+    ('y', '<f4'),
+    ('vx', '<f4'),
+    ('vy', '<f4'),
+    ('speed', '<f4'),
+    ('heading', '<f4'),
+    ('gx', '<f4'),  # goal position
+    ('gy', '<f4'),
+    ('sgx', '<f4'),  # sub-goal (sector exit gate) position
+    ('sgy', '<f4'),
+    ('sector_id', '<i2'),
+    ('goal_exit_id', '<i2'),
+    ('action', '<i1'),
+])
+
+EVENT_DTYPE = np.dtype([
+    ('step', '<i4'),
+    ('kind', '<i1'),  # EVENT_CONFLICT, EVENT_NMAC or EVENT_CONFLICT_END (see conflict_events.py)
+    ('id1', '<i4'),
+    ('id2', '<i4'),
+    ('dist', '<f4'),  # distance, minimum distance reached for EVENT_CONFLICT_END
+    ('duration', '<i4'),  # time steps since the conflict began
+])
+
+STEP_DTYPE = np.dtype([
+    ('step', '<i4'),
+    ('fleet_start', '<i8'),
+    ('fleet_count', '<i4'),
+    ('conflicts', '<i4'),
+    ('NMACs', '<i4'),
+    ('goals', '<i4'),
+])
+
+TABLE_DTYPES = {'fleet': FLEET_DTYPE, 'events': EVENT_DTYPE, 'steps': STEP_DTYPE}
+
+
+class TrajectoryRecorder:
+    """
+    buffer per-step rows in fixed-size NumPy chunks and hand full chunks to a background writer thread.
+    The number of chunks waiting to be written is bounded by max_pending_chunks, so memory is bounded
+    and record_step only blocks when the disk cannot keep up.
+    """
+
+    def __init__(self, path, env=None, chunk_rows=16384, max_pending_chunks=8):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        os.makedirs(path, exist_ok=True)
+
+        self.meta = {'dtypes': {name: dtype.descr for name, dtype in TABLE_DTYPES.items()},
+                     'chunks': {name: [] for name in TABLE_DTYPES},
+                     'rows': {name: 0 for name in TABLE_DTYPES},
+                     'scene': scene_info(env) if env is not None else {}}
+        self.buffers = {name: np.empty(chunk_rows, dtype=dtype) for name, dtype in TABLE_DTYPES.items()}
+        self.buffer_rows = {name: 0 for name in TABLE_DTYPES}
+        self.table_rows = {name: 0 for name in TABLE_DTYPES}  # rows handed to the writer, including buffered
+
+        self.files = {name: open(os.path.join(path, name + '.bin'), 'wb') for name in TABLE_DTYPES}
+        self.queue = queue.Queue(maxsize=max_pending_chunks)
+        self.error = None
+        self.writer = threading.Thread(target=self._write_loop, name='trajectory-writer', daemon=True)
+        self.writer.start()
+
+    def record_step(self, env, step, action_by_id=None):
+        if self.error is not None:
+            raise self.error
+
+        action_by_id = {} if action_by_id is None else action_by_id
+        num_aircraft = env.aircraft_dict.num_aircraft
+        fleet_start = self.table_rows['fleet']
+        rows = np.empty(num_aircraft, dtype=FLEET_DTYPE)
+        for row, (id, aircraft) in enumerate(env.aircraft_dict.ac_dict.items()):
+            rows[row] = (step, id,
+                         aircraft.position[0], aircraft.position[1],
+                         aircraft.velocity[0], aircraft.velocity[1],
+                         aircraft.speed, aircraft.heading,
+                         aircraft.goal.position[0], aircraft.goal.position[1],
+                         aircraft.sub_goal.position[0], aircraft.sub_goal.position[1],
+                         getattr(aircraft, 'sector_id', -1),
+                         getattr(aircraft, 'goal_exit_id', -1),
+                         action_by_id.get(id, 1))  # aircraft without an action fly straight
+        self._append('fleet', rows)
+
+        events = getattr(env, 'step_events', [])
+        if events:
+            event_rows = np.empty(len(events), dtype=EVENT_DTYPE)
+            for row, (kind, id1, id2, dist, duration) in enumerate(events):
+                event_rows[row] = (step, kind, id1, id2, dist, duration)
+            self._append('events', event_rows)
+
+        self._append('steps', np.array([(step, fleet_start, num_aircraft, env.conflicts, env.NMACs, env.goals)],
+                                       dtype=STEP_DTYPE))
+
+    def _append(self, name, rows):
+        buffer = self.buffers[name]
+        start = 0
+        while start < rows.shape[0]:
+            n = min(rows.shape[0] - start, self.chunk_rows - self.buffer_rows[name])
+            buffer[self.buffer_rows[name]:self.buffer_rows[name] + n] = rows[start:start + n]
+            self.buffer_rows[name] += n
+            self.table_rows[name] += n
+            start += n
+            if self.buffer_rows[name] == self.chunk_rows:
+                self._flush(name)
+                buffer = self.buffers[name]
+
+    def _flush(self, name):
+        # hand the filled buffer to the writer and continue in a fresh one
+        if self.buffer_rows[name] == 0:
+            return
+        self.queue.put((name, self.buffers[name][:self.buffer_rows[name]]))
+        self.buffers[name] = np.empty(self.chunk_rows, dtype=TABLE_DTYPES[name])
+        self.buffer_rows[name] = 0
+
+    def _write_loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            name, chunk = item
+            try:
+                self.files[name].write(chunk.tobytes())
+                self.files[name].flush()
+                self.meta['chunks'][name].append([self.meta['rows'][name], chunk.shape[0]])
+                self.meta['rows'][name] += chunk.shape[0]
+                self._write_meta()
+            except Exception as e:
+                self.error = e
+
+    def _write_meta(self):
+        tmp_path = os.path.join(self.path, 'meta.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, os.path.join(self.path, 'meta.json'))
+
+    def close(self):
+        for name in TABLE_DTYPES:
+            self._flush(name)
+        self.queue.put(None)
+        self.writer.join()
+        for f in self.files.values():
+            f.close()
+        self._write_meta()
+        if self.error is not None:
+            raise self.error
+
+
+def scene_info(env):
+    # static information needed to draw a recording without the simulator
+    scene = {'window_width': env.window_width,
+             'window_height': env.window_height,
+             'minimum_separation': env.minimum_separation,
+             'NMAC_dist': env.NMAC_dist}
+    if hasattr(env, 'vertiport_list'):
+        scene['vertiports'] = [vertiport.position.tolist() for vertiport in env.vertiport_list]
+    if hasattr(env, 'sectors'):
+        scene['sectors'] = [sector.vertices.tolist() for sector in env.sectors]
+        scene['gates'] = [sector.exits.tolist() for sector in env.sectors]
+    return scene
+
+
+def open_table(path, name):
+    """
+    memory-map one table of a recording as a read-only structured array
+    """
+    dtype = TABLE_DTYPES[name]
+    file_path = os.path.join(path, name + '.bin')
+    rows = os.path.getsize(file_path) // dtype.itemsize
+    if rows == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(file_path, dtype=dtype, mode='r', shape=(rows,))
@@ -0,0 +1,66 @@
+"""
+compare two hot_paths.py result files and flag the benchmarks whose median time grew by more than the
+threshold. Exits with status 1 if there is any regression, so it can gate a CI job.
+
+    python compare.py baseline.json results.json --threshold 0.1
+"""
+
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path) as f:
+        data = json.load(f)
+    return data, {(result['name'], result['aircraft'], result['budget']): result for result in data['results']}
+
+
+def compare(baseline, current, threshold):
+    """
+    return the rows (key, baseline median, current median, ratio, status) over the benchmarks of both files
+    """
+    rows = []
+    for key in sorted(set(baseline) | set(current), key=lambda key: (key[0], key[1], key[2] or '')):
+        if key not in baseline or key not in current:
+            rows.append((key, baseline.get(key, {}).get('median_s'), current.get(key, {}).get('median_s'), None,
+                         'new' if key not in baseline else 'missing'))
+            continue
+        ratio = current[key]['median_s'] / baseline[key]['median_s']
+        if ratio > 1 + threshold:
+            status = 'REGRESSION'
+        elif ratio < 1 / (1 + threshold):
+            status = 'faster'
+        else:
+            status = 'ok'
+        rows.append((key, baseline[key]['median_s'], current[key]['median_s'], ratio, status))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('baseline', type=str)
+    parser.add_argument('current', type=str)
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative slowdown flagged as a regression')
+    args = parser.parse_args()
+
+    baseline_data, baseline = load(args.baseline)
+    current_data, current = load(args.current)
+    print('baseline: %s, current: %s' % (baseline_data.get('revision'), current_data.get('revision')))
+
+    rows = compare(baseline, current, args.threshold)
+    print('%-16s %8s %8s %12s %12s %8s' % ('benchmark', 'aircraft', 'budget', 'baseline ms', 'current ms', 'ratio'))
+    for (name, aircraft, budget), before, after, ratio, status in rows:
+        print('%-16s %8d %8s %12s %12s %8s %s'
+              % (name, aircraft, budget or '-', '%.3f' % (before * 1000) if before is not None else '-',
+                 '%.3f' % (after * 1000) if after is not None else '-', '%.2f' % ratio if ratio is not None else '-',
+                 status))
+
+    regressions = sum(row[4] == 'REGRESSION' for row in rows)
+    if regressions:
+        print('%d regression(s) above %.0f%%' % (regressions, args.threshold * 100))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
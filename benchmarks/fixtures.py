@@ -0,0 +1,83 @@
+"""
+fixed-seed fixtures of the benchmarks: simulators populated with a given number of aircraft and MCTS search
+states of a given size, always built the same way from the seed.
+"""
+
+import math
+import os
+import sys
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.extend([os.path.join(ROOT, 'Simulators'), os.path.join(ROOT, 'MCTS')])
+
+
+def make_env(name, seed):
+    if name == 'hex':
+        from MultiAircraftVertiHexSecGatePlusEnv import MultiAircraftEnv, Aircraft
+    elif name == 'two_stage':
+        from MultiAircraftVertiHexSecGatePlusTwoStageEnv import MultiAircraftEnv, Aircraft
+    else:
+        from MultiAircraftVertiportEnv import MultiAircraftEnv, Aircraft
+    env = MultiAircraftEnv(seed)
+    env.reset()
+    return env, Aircraft
+
+
+def populate(env, Aircraft, num_aircraft, rng):
+    # replace the fleet by num_aircraft aircraft spread uniformly over the airspace
+    env.aircraft_dict.ac_dict.clear()
+    if hasattr(env, 'sectors'):
+        for sector in env.sectors:
+            sector.controlled_aircraft_id.clear()
+    for id in range(num_aircraft):
+        position = rng.uniform(100, [env.window_width - 100, env.window_height - 100])
+        goal = rng.uniform(100, [env.window_width - 100, env.window_height - 100])
+        aircraft = Aircraft(id=id, position=position, speed=env.init_speed, heading=rng.uniform(0, 2 * math.pi),
+                            goal_pos=goal, goal_vertiport_id=-1, config=env.config, rng=env.rng)
+        env.aircraft_dict.add(aircraft)
+    if hasattr(env, 'assign_sector'):
+        env.assign_sector()
+
+
+def populated_env(name, num_aircraft, seed):
+    # simulator with num_aircraft aircraft, the global random state is seeded as well
+    np.random.seed(seed)
+    env, Aircraft = make_env(name, seed)
+    populate(env, Aircraft, num_aircraft, np.random.RandomState(seed))
+    return env
+
+
+def sector_observation(num_aircraft, seed, sector_id=0):
+    """
+    (num_aircraft, 8) observation of aircraft inside sector sector_id of case study 1, at least the minimum
+    separation apart, heading to random exit gates of the sector.
+    return the observation and the exit gate of each aircraft
+    """
+    import matplotlib.path as mpltPath
+    from config_hex_sec import Config
+
+    rng = np.random.RandomState(seed)
+    vertices = Config.sector_vertices[sector_id]
+    path = mpltPath.Path(vertices)
+    low, high = vertices.min(axis=0), vertices.max(axis=0)
+    num_gates = int(Config.network.gate_count[sector_id])
+
+    ob = np.zeros((num_aircraft, 8))
+    goal_exit_id = np.zeros(num_aircraft, dtype=np.int64)
+    count = 0
+    while count < num_aircraft:
+        position = rng.uniform(low, high)
+        if not path.contains_point(position):
+            continue
+        if count > 0 and np.hypot(*(ob[:count, :2] - position).T).min() < 1.5 * Config.minimum_separation:
+            continue
+        heading = rng.uniform(0, 2 * math.pi)
+        goal_exit_id[count] = rng.randint(num_gates)
+        goal = Config.sector_len_exits[sector_id][goal_exit_id[count]][0]
+        ob[count] = [position[0], position[1],
+                     Config.init_speed * math.cos(heading), Config.init_speed * math.sin(heading),
+                     Config.init_speed, heading, goal[0], goal[1]]
+        count += 1
+    return ob, goal_exit_id
@@ -0,0 +1,272 @@
+"""
+microbenchmarks of the search and simulator hot paths of case study 1, by number of aircraft and search budget
+(simulations x depth). Every repeat starts from the same fixed-seed fixture, only the call is timed.
+
+    python hot_paths.py --sizes 5 10 20 --budgets 30x2 100x3 --output results.json
+    python compare.py baseline.json results.json
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from fixtures import ROOT, populated_env, sector_observation
+
+from nodesHexSecGatePlus import MultiAircraftNode, make_root_state, sector_futures
+from search_multi import MCTS
+from policy_net import PolicyValueNet
+from config_hex_sec import Config
+
+
+# search trees of compact states (see CompactAircraftState), and futures shared by the searches of a sector
+COMPACT = Config.replace(compact_nodes=True)
+SHARED = Config.replace(sector_futures=16)
+# prior and value network of the PUCT search, randomly initialized
+NET = PolicyValueNet.random(seed=0)
+
+
+def search_root(num_aircraft, seed, search_depth=Config.search_depth, config=Config):
+    ob, goal_exit_id = sector_observation(num_aircraft, seed)
+    state = make_root_state(ob, 0, np.ones(num_aircraft, dtype=np.int32), 0, goal_exit_id[0], search_depth, config)
+    return MultiAircraftNode(state=state)
+
+
+def tree_bytes(root):
+    # memory of a search tree: nodes, states and their arrays, every shared trajectory counted once
+    total = 0
+    shared = set()
+    nodes = [root]
+    while nodes:
+        node = nodes.pop()
+        state = node.state
+        total += sys.getsizeof(node) + sys.getsizeof(node.children) + sys.getsizeof(state)
+        for array in (state.state, state.init_action, state.prev_action):
+            if isinstance(array, np.ndarray) and array.base is None:
+                total += sys.getsizeof(array)
+        for array in (getattr(state, 'futures', None), getattr(state, 'intruders', None)):
+            if array is not None and id(array) not in shared:
+                shared.add(id(array))
+                total += array.nbytes
+        nodes.extend(node.children)
+    return total
+
+
+def search_memory(num_aircraft, budget, seed, config=Config):
+    # tree memory of one search
+    np.random.seed(seed)
+    mcts = MCTS(search_root(num_aircraft, seed, budget[1], config))
+    mcts.best_action(budget[0], budget[1])
+    return tree_bytes(mcts.root)
+
+
+# every benchmark takes (number of aircraft, (simulations, depth), seed) and returns (setup, run):
+# setup() builds the fixture of one repeat, run(fixture) is the timed call
+
+def bench_state_move(num_aircraft, budget, seed):
+    def setup():
+        return search_root(num_aircraft, seed).state, np.ones(num_aircraft, dtype=np.int32)
+
+    def run(fixture):
+        state, action = fixture
+        state._move(action)
+    return setup, run
+
+
+def bench_node_rollout(num_aircraft, budget, seed):
+    def setup():
+        return search_root(num_aircraft, seed, budget[1])
+
+    def run(root):
+        root.rollout(budget[1])
+    return setup, run
+
+
+def bench_best_action(num_aircraft, budget, seed):
+    def setup():
+        return MCTS(search_root(num_aircraft, seed, budget[1]))
+
+    def run(mcts):
+        mcts.best_action(budget[0], budget[1])
+    return setup, run
+
+
+def bench_best_action_compact(num_aircraft, budget, seed):
+    def setup():
+        return MCTS(search_root(num_aircraft, seed, budget[1], COMPACT))
+
+    def run(mcts):
+        mcts.best_action(budget[0], budget[1])
+    return setup, run
+
+
+def bench_best_action_puct(num_aircraft, budget, seed):
+    # PUCT search with untrained network weights: the cost of the search, not the quality of its actions
+    def setup():
+        return MCTS(search_root(num_aircraft, seed, budget[1]), net=NET, c_puct=Config.c_puct,
+                    leaf_batch=Config.leaf_batch)
+
+    def run(mcts):
+        mcts.best_action(budget[0], budget[1])
+    return setup, run
+
+
+def bench_env_step(num_aircraft, budget, seed):
+    def setup():
+        return populated_env('hex', num_aircraft, seed)
+
+    def run(env):
+        env.step({})
+    return setup, run
+
+
+def bench_terminal_reward(num_aircraft, budget, seed):
+    def setup():
+        return populated_env('hex', num_aircraft, seed)
+
+    def run(env):
+        env._terminal_reward()
+    return setup, run
+
+
+def bench_get_ob(num_aircraft, budget, seed):
+    def setup():
+        return populated_env('hex', num_aircraft, seed)
+
+    def run(env):
+        env._get_ob()
+    return setup, run
+
+
+def bench_get_normalized_ob(num_aircraft, budget, seed):
+    def setup():
+        env = populated_env('hex', num_aircraft, seed)
+        env._get_normalized_ob()  # the buffer is made by the first call
+        return env
+
+    def run(env):
+        env._get_normalized_ob()
+    return setup, run
+
+
+def bench_assign_sector(num_aircraft, budget, seed):
+    def setup():
+        return populated_env('hex', num_aircraft, seed)
+
+    def run(env):
+        env.assign_sector()
+    return setup, run
+
+
+def sector_epoch(config):
+    # searches of every aircraft of a sector observation, as plan_epoch runs them
+    def bench(num_aircraft, budget, seed):
+        def setup():
+            return sector_observation(num_aircraft, seed)
+
+        def run(fixture):
+            ob, goal_exit_id = fixture
+            action = np.ones(num_aircraft, dtype=np.int32)
+            futures = sector_futures(ob, action, config) if config.sector_futures else None
+            for index in range(num_aircraft):
+                state = make_root_state(ob, index, action, 0, goal_exit_id[index], budget[1], config, futures=futures)
+                MCTS(MultiAircraftNode(state=state)).best_action(budget[0], budget[1])
+        return setup, run
+    return bench
+
+
+# name: (benchmark, depends on the search budget)
+BENCHMARKS = {
+    'state_move': (bench_state_move, False),
+    'node_rollout': (bench_node_rollout, True),
+    'best_action': (bench_best_action, True),
+    'best_action_compact': (bench_best_action_compact, True),
+    'best_action_puct': (bench_best_action_puct, True),
+    'sector_epoch': (sector_epoch(Config), True),
+    'sector_epoch_compact': (sector_epoch(COMPACT), True),
+    'sector_epoch_shared': (sector_epoch(SHARED), True),
+    'env_step': (bench_env_step, False),
+    'terminal_reward': (bench_terminal_reward, False),
+    'get_ob': (bench_get_ob, False),
+    'get_normalized_ob': (bench_get_normalized_ob, False),
+    'assign_sector': (bench_assign_sector, False),
+}
+
+
+def measure(bench, num_aircraft, budget, seed, repeats, warmup=1):
+    setup, run = bench(num_aircraft, budget, seed)
+    times = []
+    for repeat in range(warmup + repeats):
+        fixture = setup()
+        np.random.seed(seed)  # the same noise in every repeat
+        time_before = time.perf_counter()
+        run(fixture)
+        if repeat >= warmup:
+            times.append(time.perf_counter() - time_before)
+    times = np.array(times)
+    return {'median_s': float(np.median(times)), 'min_s': float(times.min()), 'mean_s': float(times.mean()),
+            'repeats': repeats}
+
+
+def parse_budget(text):
+    # '100x3' -> (100 simulations, depth 3)
+    simulations, depth = text.lower().split('x')
+    return int(simulations), int(depth)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--benchmarks', '-b', type=str, nargs='+', default=sorted(BENCHMARKS),
+                        choices=sorted(BENCHMARKS))
+    parser.add_argument('--sizes', type=int, nargs='+', default=[5, 10, 20])
+    parser.add_argument('--budgets', type=str, nargs='+', default=['%dx%d' % (Config.no_simulations_lite,
+                                                                            Config.search_depth_lite),
+                                                                   '%dx%d' % (Config.no_simulations,
+                                                                              Config.search_depth)],
+                        help='search budgets as SIMULATIONSxDEPTH')
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=2)
+    parser.add_argument('--output', '-o', type=str, default=None)
+    args = parser.parse_args()
+
+    budgets = [parse_budget(budget) for budget in args.budgets]
+    results = []
+    print('%-20s %8s %8s %12s %12s %10s' % ('benchmark', 'aircraft', 'budget', 'median ms', 'min ms', 'tree KB'))
+    for name in args.benchmarks:
+        bench, uses_budget = BENCHMARKS[name]
+        for num_aircraft in args.sizes:
+            for budget in (budgets if uses_budget else [None]):
+                # a full search is much slower than the other calls, it gets fewer repeats
+                search = name in ('best_action', 'best_action_compact')
+                repeats = max(args.repeats // 5, 3) if search or name.startswith('sector') else args.repeats
+                result = measure(bench, num_aircraft, budget, args.seed, repeats)
+                result.update({'name': name, 'aircraft': num_aircraft,
+                               'budget': '%dx%d' % budget if budget is not None else None})
+                if search:
+                    result['tree_bytes'] = search_memory(num_aircraft, budget, args.seed,
+                                                         COMPACT if name == 'best_action_compact' else Config)
+                results.append(result)
+                print('%-20s %8d %8s %12.3f %12.3f %10s'
+                      % (name, num_aircraft, result['budget'] or '-', result['median_s'] * 1000,
+                         result['min_s'] * 1000, '%.1f' % (result['tree_bytes'] / 1024.) if search else '-'))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'revision': git_revision(), 'python': platform.python_version(), 'numpy': np.__version__,
+                       'machine': platform.machine(), 'seed': args.seed, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
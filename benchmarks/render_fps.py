@@ -0,0 +1,49 @@
+"""
+frames-per-second of env.render() by fleet size. Needs the gym classic_control viewer (gym <= 0.21, pyglet
+1.5) and a display, e.g. xvfb-run on a server, or --headless to render through EGL without one.
+
+    python render_fps.py --env hex --sizes 10 25 50 100 200
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from fixtures import make_env, populate
+
+
+def measure(env, frames):
+    env.render()  # first frame builds the viewer, textures and static geometry
+    time_before = time.perf_counter()
+    for _ in range(frames):
+        for aircraft in env.aircraft_dict.ac_dict.values():
+            aircraft.step()
+        env.render()
+    return frames / (time.perf_counter() - time_before)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--env', type=str, default='hex', choices=['hex', 'two_stage', 'vertiport'])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 25, 50, 100, 200])
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=2)
+    parser.add_argument('--headless', action='store_true', help='pyglet headless mode (EGL), no display needed')
+    args = parser.parse_args()
+
+    if args.headless:
+        import pyglet
+        pyglet.options['headless'] = True
+
+    rng = np.random.RandomState(args.seed)
+    env, Aircraft = make_env(args.env, args.seed)
+    print('%10s %10s' % ('aircraft', 'fps'))
+    for num_aircraft in args.sizes:
+        populate(env, Aircraft, num_aircraft, rng)
+        print('%10d %10.1f' % (num_aircraft, measure(env, args.frames)))
+    env.close()
+
+
+if __name__ == '__main__':
+    main()